@@ -1,57 +1,91 @@
+from langchain_core.messages import AIMessage
 from langgraph.graph import StateGraph, END
-from app.agent.state import AgentState
+from langgraph.types import Send
+from app.agent.state import AgentState, ROUTE_TOOL
+from app.core.config import settings
+from app.core.tracing import traced_node
 from app.agent.nodes import (
-    retrieve, grade_documents, generate, transform_query, 
-    router_node, action_iching, action_horoscope
+    retrieve, grade_documents, generate, transform_query,
+    router_node, join_branches, action_node, action_iching, action_horoscope, action_zodiac,
+    action_bazi, action_naming
 )
 
-def create_graph():
+# Tool nodes reachable straight from the router (no LLM call)
+ACTION_NODES = ("action_iching", "action_horoscope", "action_zodiac", "action_bazi", "action_naming")
+
+# Graph nodes surfaced to SSE clients as status updates
+STREAM_NODES = ("router", "retrieve", "grade_documents", "generate", "transform_query", "tools", *ACTION_NODES)
+
+def create_graph(max_concurrency: int = None):
     workflow = StateGraph(AgentState)
 
-    # Define the nodes
-    workflow.add_node("retrieve", retrieve)
-    workflow.add_node("grade_documents", grade_documents)
-    workflow.add_node("generate", generate)
-    workflow.add_node("transform_query", transform_query)
-    workflow.add_node("action_iching", action_iching)
-    workflow.add_node("action_horoscope", action_horoscope)
-    # workflow.add_node("router", router_node) # Router logic is in the conditional edge
+    # Define the nodes, each timed into agent_node_duration_seconds
+    nodes = {
+        "retrieve": retrieve,
+        "grade_documents": grade_documents,
+        "generate": generate,
+        "transform_query": transform_query,
+        "action_iching": action_iching,
+        "action_horoscope": action_horoscope,
+        "action_zodiac": action_zodiac,
+        "action_bazi": action_bazi,
+        "action_naming": action_naming,
+        "router": router_node,
+        "tools": action_node,
+    }
+    for name, fn in nodes.items():
+        workflow.add_node(name, traced_node(name, fn))
+    # Deferred: runs once, after every branch (including retrieval retries) has finished
+    workflow.add_node("join", traced_node("join", join_branches), defer=True)
 
     # Define the edges
-    workflow.set_entry_point("retrieve") # Simplification: Start with retrieve or router
-    
-    # We can use a conditional entry point
-    # workflow.set_conditional_entry_point(
-    #     router_node,
-    #     {
-    #         "action_iching": "action_iching",
-    #         "action_horoscope": "action_horoscope",
-    #         "retrieve": "retrieve",
-    #         "generate": "generate"
-    #     }
-    # )
+    # The router fans out to one branch per tool intent, plus retrieval when
+    # the LLM answers; tool-only questions never reach generate
+    workflow.set_entry_point("router")
+
+    def fan_out(state):
+        branches = [Send(node, {**state, "tool_args": args}) for node, args in (state.get("tool_calls") or {}).items()]
+        if state.get("route") != ROUTE_TOOL:
+            branches.append(Send("retrieve", state))
+        return branches
+
+    workflow.add_conditional_edges("router", fan_out, ["retrieve", *ACTION_NODES])
 
     workflow.add_edge("retrieve", "grade_documents")
     
     def check_relevance(state):
         if state.get("next_step") == "transform_query":
             return "transform_query"
-        return "generate"
+        return "join"
 
     workflow.add_conditional_edges(
         "grade_documents",
         check_relevance,
         {
             "transform_query": "transform_query",
-            "generate": "generate"
+            "join": "join"
         }
     )
 
     workflow.add_edge("transform_query", "retrieve")
-    workflow.add_edge("generate", END)
-    workflow.add_edge("action_iching", END)
-    workflow.add_edge("action_horoscope", END)
+    for node in ACTION_NODES:
+        workflow.add_edge(node, "join")
+
+    def after_join(state):
+        return END if state.get("route") == ROUTE_TOOL else "generate"
+
+    workflow.add_conditional_edges("join", after_join, ["generate", END])
+
+    # Tool calls requested by the model run in "tools", then generate answers with their results
+    def after_generate(state):
+        turns = state.get("tool_messages") or []
+        if turns and isinstance(turns[-1], AIMessage) and turns[-1].tool_calls:
+            return "tools"
+        return END
+
+    workflow.add_conditional_edges("generate", after_generate, ["tools", END])
+    workflow.add_edge("tools", "generate")
 
-    # Compile
+    # Compile; the concurrency cap bounds how many branches of one run execute at once
     app = workflow.compile()
-    return app
+    return app.with_config(max_concurrency=max_concurrency or settings.GRAPH_MAX_CONCURRENCY)
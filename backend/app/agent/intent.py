@@ -0,0 +1,233 @@
+"""
+Deterministic intent detection for the router node.
+
+All tool keywords and their synonyms are compiled once into an Aho-Corasick
+automaton, so a question is scanned in a single pass regardless of how many
+keywords there are. A tool intent only counts when its arguments can be
+extracted from the question; otherwise the question goes to the LLM path.
+"""
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.core.text import to_simplified
+
+
+class KeywordMatcher:
+    """Aho-Corasick multi-pattern matcher mapping keywords to payloads."""
+
+    def __init__(self, keywords: Dict[str, Any]):
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[List[Tuple[str, Any]]] = [[]]
+        for pattern, payload in keywords.items():
+            self._insert(pattern, payload)
+        self._build()
+
+    def _insert(self, pattern: str, payload: Any):
+        node = 0
+        for ch in pattern:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+            node = nxt
+        self._out[node].append((pattern, payload))
+
+    def _build(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                fail = self._fail[node]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                candidate = self._goto[fail].get(ch, 0)
+                self._fail[nxt] = candidate if candidate != nxt else 0
+                self._out[nxt].extend(self._out[self._fail[nxt]])
+
+    def finditer(self, text: str) -> Iterator[Tuple[int, str, Any]]:
+        """Yield ``(start, keyword, payload)`` for every keyword occurrence in ``text``."""
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            for pattern, payload in out[node]:
+                yield i - len(pattern) + 1, pattern, payload
+
+
+@dataclass
+class IntentMatch:
+    intent: str
+    node: str
+    keyword: str
+    args: Dict[str, Any] = field(default_factory=dict)
+    deterministic: bool = True
+
+
+@dataclass
+class RoutePlan:
+    """Graph branches for a question: tool intents to run, and whether the LLM answers."""
+    intents: List[IntentMatch]
+    llm: bool
+
+
+# intent -> graph node, whether the tool output is a pure function of its args,
+# and the keywords/synonyms that trigger it
+TOOL_INTENTS = {
+    "iching": {
+        "node": "action_iching",
+        "deterministic": False,
+        "keywords": [
+            "占卜", "占卦", "占一卦", "算卦", "算一卦", "卜卦", "卜一卦", "起卦", "起一卦",
+            "摇卦", "摇一卦", "求卦", "求一卦", "问卦", "打卦", "测一卦", "六爻", "摇钱卦",
+        ],
+    },
+    "horoscope": {
+        "node": "action_horoscope",
+        "deterministic": True,
+        "keywords": ["星座", "什么座", "哪个座", "星象", "太阳星座"],
+    },
+    "zodiac": {
+        "node": "action_zodiac",
+        "deterministic": True,
+        "keywords": ["生肖", "属相", "属什么", "属啥", "肖什么", "属哪个", "什么属相"],
+    },
+    "bazi": {
+        "node": "action_bazi",
+        "deterministic": True,
+        "keywords": ["八字", "生辰八字", "四柱", "排盘", "命盘", "算命"],
+    },
+    "naming": {
+        "node": "action_naming",
+        "deterministic": False,
+        "keywords": ["起名", "取名", "起个名", "取个名", "起名字", "取名字", "名字推荐", "改名"],
+    },
+}
+
+# Questions asking *about* something are knowledge questions for the LLM path
+KNOWLEDGE_MARKERS = ["是什么意思", "什么意思", "含义", "寓意", "介绍一下", "典故", "历史", "由来", "怎么理解", "解释一下"]
+
+# Asking for an interpretation on top of a tool result also needs the LLM path,
+# e.g. "1990年出生属什么，今年运势如何" runs the zodiac tool and retrieval + LLM
+FOLLOWUP_MARKERS = ["运势", "运程", "如何", "怎么样", "怎样", "好不好", "为什么", "解读", "分析", "建议", "适合"]
+
+_KNOWLEDGE = object()
+
+_matcher = KeywordMatcher({
+    **{kw: intent for intent, spec in TOOL_INTENTS.items() for kw in spec["keywords"]},
+    **{kw: _KNOWLEDGE for kw in KNOWLEDGE_MARKERS},
+})
+
+_followup_matcher = KeywordMatcher({kw: True for kw in FOLLOWUP_MARKERS})
+
+_DATE_RE = re.compile(r"((?:19|20)\d{2})\s*[-/.年]\s*(\d{1,2})\s*[-/.月]\s*(\d{1,2})")
+_TIME_RE = re.compile(r"(\d{1,2})\s*(?:[:：]\s*(\d{2})|[点时](?:\s*(\d{1,2})\s*分)?)")
+_YEAR_RE = re.compile(r"((?:19|20)\d{2})\s*年?")
+_COMPOUND_SURNAMES = ("欧阳", "司马", "诸葛", "上官", "东方", "慕容", "皇甫", "令狐", "司徒", "公孙", "夏侯", "长孙")
+_SURNAME_RE = re.compile(r"姓\s*([\u4e00-\u9fff]{1,2})")
+_GENDER_RE = re.compile(r"(男孩|男宝|儿子|男生|男|女孩|女宝|女儿|女生|女)")
+
+
+def _extract_date(text: str) -> Optional[Tuple[str, int]]:
+    m = _DATE_RE.search(text)
+    if not m:
+        return None
+    year, month, day = (int(g) for g in m.groups())
+    if not (1 <= month <= 12 and 1 <= day <= 31):
+        return None
+    return f"{year:04d}-{month:02d}-{day:02d}", m.end()
+
+
+def _args_iching(text: str) -> Optional[Dict]:
+    return {"question": text}
+
+
+def _args_horoscope(text: str) -> Optional[Dict]:
+    date = _extract_date(text)
+    return {"date_str": date[0]} if date else None
+
+
+def _args_zodiac(text: str) -> Optional[Dict]:
+    m = _YEAR_RE.search(text)
+    return {"year": int(m.group(1))} if m else None
+
+
+def _args_bazi(text: str) -> Optional[Dict]:
+    date = _extract_date(text)
+    if not date:
+        return None
+    hour, minute = 12, 0  # 时辰未知时按午时排盘
+    m = _TIME_RE.search(text, date[1])
+    if m:
+        hour, minute = int(m.group(1)), int(m.group(2) or m.group(3) or 0)
+        if hour > 23 or minute > 59:
+            return None
+    return {"datetime_str": f"{date[0]} {hour:02d}:{minute:02d}"}
+
+
+def _args_naming(text: str) -> Optional[Dict]:
+    surname = None
+    m = _SURNAME_RE.search(text)
+    if m:
+        surname = m.group(1) if m.group(1) in _COMPOUND_SURNAMES else m.group(1)[0]
+    g = _GENDER_RE.search(text)
+    if not surname or not g:
+        return None
+    return {"surname": surname, "gender": "boy" if g.group(1).startswith(("男", "儿")) else "girl"}
+
+
+_ARG_EXTRACTORS = {
+    "iching": _args_iching,
+    "horoscope": _args_horoscope,
+    "zodiac": _args_zodiac,
+    "bazi": _args_bazi,
+    "naming": _args_naming,
+}
+
+
+def match_intents(question: str) -> List[IntentMatch]:
+    """
+    All tool intents in ``question`` whose arguments could be extracted, in
+    order of first appearance. Empty for knowledge questions.
+    """
+    text = to_simplified(question)
+    found: Dict[str, str] = {}
+    for _, keyword, intent in _matcher.finditer(text):
+        if intent is _KNOWLEDGE:
+            return []
+        found.setdefault(intent, keyword)
+
+    matches = []
+    for intent, keyword in found.items():
+        args = _ARG_EXTRACTORS[intent](text)
+        if args is not None:
+            spec = TOOL_INTENTS[intent]
+            matches.append(IntentMatch(intent, spec["node"], keyword, args, spec["deterministic"]))
+    return matches
+
+
+def match_intent(question: str) -> Optional[IntentMatch]:
+    """The first tool intent in ``question``, or None for the LLM path."""
+    matches = match_intents(question)
+    return matches[0] if matches else None
+
+
+def plan_route(question: str) -> RoutePlan:
+    """
+    Tool intents to run as parallel branches, and whether retrieval + LLM
+    runs alongside them: always without tool intents, and for follow-up
+    questions beyond what the tools answer.
+    """
+    intents = match_intents(question)
+    if not intents:
+        return RoutePlan([], True)
+    followup = next(_followup_matcher.finditer(to_simplified(question)), None) is not None
+    return RoutePlan(intents, followup)
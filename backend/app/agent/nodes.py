@@ -1,36 +1,96 @@
+import asyncio
+import time
 from typing import Dict, Any, List
-from langchain_core.messages import HumanMessage, AIMessage, FunctionMessage
-from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.callbacks import adispatch_custom_event
+from langchain_core.messages import HumanMessage, AIMessage, FunctionMessage, ToolMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnableConfig
 from langchain_openai import ChatOpenAI
 from langchain_core.output_parsers.openai_functions import JsonOutputFunctionsParser
 from langgraph.prebuilt import ToolNode
+from langgraph.prebuilt.tool_node import ToolCallRequest
 
-from app.agent.state import AgentState
+from app.agent.intent import plan_route
+from app.agent.state import AgentState, ROUTE_LLM, ROUTE_TOOL
 from app.tools.iching import IChingTool
 from app.tools.horoscope import HoroscopeTool
 from app.tools.bazi import BaZiTool
 from app.tools.zodiac import ZodiacTool
 from app.tools.naming import NamingTool
+from app.core.config import settings
+from app.core.context import pack_context, prompt_budget
+from app.core.llm import llm_clients, LLMOverloaded
+from app.core.metrics import GRADER_DOCUMENTS, GRADER_DURATION_SECONDS, NODE_DEADLINE_EXCEEDED, RETRIEVAL_LOOP_ITERATIONS
+from app.core.bm25 import BM25, keywords, tokenize
+from app.core.tokens import count_tokens
 from app.core.rag import retrieve_documents
 
-# Initialize Tools
-tools = [
-    IChingTool(),
-    HoroscopeTool(),
-    BaZiTool(),
-    ZodiacTool(),
-    NamingTool()
-]
-# tool_executor = ToolExecutor(tools)
-
-# Initialize LLM
-llm = ChatOpenAI(
-    model="qwen-max",
-    temperature=0,
-    openai_api_base="https://dashscope.aliyuncs.com/compatible-mode/v1",
-    openai_api_key="sk-a9375f14d4a6496dab811cc8d2faf92f"
+# Initialize Tools (stateless, shared by all requests)
+iching_tool = IChingTool()
+horoscope_tool = HoroscopeTool()
+bazi_tool = BaZiTool()
+zodiac_tool = ZodiacTool()
+naming_tool = NamingTool()
+tools = [iching_tool, horoscope_tool, bazi_tool, zodiac_tool, naming_tool]
+
+# Custom graph event reporting LLM tool calls starting and finishing
+TOOL_EVENT = "agent_tool"
+
+# Stand-in context when retrieval found nothing usable
+NO_DOCUMENTS = "暂无相关文档，请直接回答用户问题。"
+
+# Initialize LLM (shared connection pool, admission control, hedging and
+# failover across the configured backends, see app.core.llm)
+llm = llm_clients.chat_model()
+
+# Prompt chains are built once and shared by all requests
+RAG_PROMPT = ChatPromptTemplate.from_messages([
+    ("system", "You are a helpful assistant for Chinese Classics. Use the following context to answer the question if relevant.{summary}"),
+    MessagesPlaceholder("history", optional=True),
+    ("human", "Question: {question}{tools}\nContext: {context}"),
+    MessagesPlaceholder("tool_turns", optional=True),
+])
+
+def _with_tools(model):
+    # Stand-in models without tool calling answer directly
+    if not settings.LLM_TOOL_CALLING_ENABLED:
+        return model
+    try:
+        return model.bind_tools(tools)
+    except NotImplementedError:
+        return model
+
+# rag_chain may call tools; answer_chain is the last follow-up turn and must answer
+rag_chain = RAG_PROMPT | _with_tools(llm)
+answer_chain = RAG_PROMPT | llm
+# Template tokens, plus a few per message for chat formatting
+MESSAGE_OVERHEAD_TOKENS = 4
+RAG_PROMPT_TOKENS = sum(
+    count_tokens(m.content) + MESSAGE_OVERHEAD_TOKENS
+    for m in RAG_PROMPT.format_messages(question="", context="", summary="", tools="")
 )
 
+def set_llm(model):
+    """Swap the chat model behind the shared chains (benchmarks, tests)."""
+    global llm, rag_chain, answer_chain
+    llm = model
+    rag_chain = RAG_PROMPT | _with_tools(llm)
+    answer_chain = RAG_PROMPT | llm
+
+def _message_tokens(message) -> int:
+    tokens = count_tokens(str(message.content)) + MESSAGE_OVERHEAD_TOKENS
+    if getattr(message, "tool_calls", None):
+        tokens += count_tokens(str(message.tool_calls))
+    return tokens
+
+def _summary_section(summary: str) -> str:
+    return f"\nConversation summary so far:\n{summary}" if summary else ""
+
+def _tools_section(results: List[dict]) -> str:
+    # Tool branches that ran alongside retrieval (see join_branches)
+    lines = [r["generation"] for r in results if not r.get("error")]
+    return "\nTool results:\n" + "\n".join(lines) if lines else ""
+
 # Define Nodes
 
 async def retrieve(state: AgentState):
@@ -38,18 +98,26 @@ async def retrieve(state: AgentState):
     Retrieve documents from vector store.
     """
     print("---RETRIEVE---")
-    question = state["question"]
+    # A rewritten query (transform_query) only changes what is searched for
+    query = state.get("search_query") or state["question"]
     try:
-        documents = retrieve_documents(question)
+        # Off the event loop, so a slow index cannot stall other requests
+        documents = await asyncio.wait_for(
+            asyncio.to_thread(retrieve_documents, query), settings.NODE_RETRIEVE_TIMEOUT_SECONDS
+        )
+    except asyncio.TimeoutError:
+        NODE_DEADLINE_EXCEEDED.labels(node="retrieve").inc()
+        print("Retrieval timed out")
+        documents = []
     except Exception as e:
         print(f"Retrieval error: {e}")
         documents = []
         
     # Fallback if no documents found or error
     if not documents:
-        documents = ["暂无相关文档，请直接回答用户问题。"]
+        documents = [NO_DOCUMENTS]
         
-    return {"documents": documents, "question": question}
+    return {"documents": documents, "retrieve_attempts": state.get("retrieve_attempts", 0) + 1}
 
 async def generate(state: AgentState):
     """
@@ -58,77 +126,232 @@ async def generate(state: AgentState):
     print("---GENERATE---")
     question = state["question"]
     documents = state.get("documents", [])
-    
-    # RAG generation logic
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", "You are a helpful assistant for Chinese Classics. Use the following context to answer the question if relevant."),
-        ("human", "Question: {question}\nContext: {context}")
-    ])
-    chain = prompt | llm
-    
+
+    # Session memory: rolling summary plus recent turns (bounded, see app.core.memory)
+    history = list(state.get("messages") or [])
+    summary = _summary_section(state.get("summary", ""))
+    tool_context = _tools_section(state.get("tool_results") or [])
+    # Earlier tool-call turns of this question, answered by action_node
+    tool_turns = list(state.get("tool_messages") or [])
+    rounds = sum(1 for m in tool_turns if isinstance(m, AIMessage))
+    chain = rag_chain if rounds < settings.LLM_MAX_TOOL_ROUNDS else answer_chain
+
+    # Best distinct documents within what the model's prompt budget leaves over
+    fixed_tokens = RAG_PROMPT_TOKENS + count_tokens(question) + count_tokens(summary) + count_tokens(tool_context)
+    fixed_tokens += sum(_message_tokens(m) for m in history + tool_turns)
+    context = pack_context(documents, prompt_budget(settings.LLM_MODEL) - fixed_tokens)
+    prompt_tokens = fixed_tokens + context.tokens
+
     # Use async invocation for better performance
     try:
-        response = await chain.ainvoke({"question": question, "context": "\n".join(documents)})
-        return {"generation": response.content}
+        # On the deadline the LLM call is cancelled and its HTTP stream closed
+        response = await asyncio.wait_for(
+            chain.ainvoke({
+                "question": question, "context": context.text, "summary": summary, "tools": tool_context,
+                "history": history, "tool_turns": tool_turns,
+            }),
+            settings.NODE_GENERATE_TIMEOUT_SECONDS,
+        )
+        if response.tool_calls:
+            return {"tool_messages": [response], "prompt_tokens": prompt_tokens}
+        answer = {"generation": response.content, "prompt_tokens": prompt_tokens, "tool_rounds": rounds}
+    except LLMOverloaded:
+        raise
+    except asyncio.TimeoutError:
+        NODE_DEADLINE_EXCEEDED.labels(node="generate").inc()
+        answer = {"generation": "抱歉，生成回答超时，请稍后重试", "error": "timeout", "prompt_tokens": prompt_tokens}
     except Exception as e:
         print(f"Generation error: {e}")
-        return {"generation": f"抱歉，生成回答时出现错误: {str(e)}"}
+        answer = {"generation": f"抱歉，生成回答时出现错误: {str(e)}", "error": str(e), "prompt_tokens": prompt_tokens}
+    # Once per answer: a turn that asked for tools comes back here after action_node
+    RETRIEVAL_LOOP_ITERATIONS.observe(state.get("retrieve_attempts", 1))
+    return answer
+
+def _rewrite_query(question: str) -> str:
+    # Content words only: question filler dilutes the search
+    return " ".join(dict.fromkeys(keywords(question)))
 
 def grade_documents(state: AgentState):
     """
     Determines whether the retrieved documents are relevant to the question
     """
     print("---CHECK RELEVANCE---")
-    # Mock grading logic
-    return {"next_step": "generate"}
+    documents = state.get("documents") or []
+    question_terms = tokenize(state["question"])
+    if not settings.GRADER_ENABLED or documents == [NO_DOCUMENTS] or not question_terms:
+        return {"next_step": "generate"}
+
+    # BM25 against the question, no LLM call (see app.core.bm25)
+    start = time.perf_counter()
+    relevance = BM25([tokenize(d) for d in documents]).relevance(question_terms)
+    kept = [d for d, r in zip(documents, relevance) if r >= settings.GRADER_MIN_RELEVANCE]
+    GRADER_DURATION_SECONDS.observe(time.perf_counter() - start)
+    GRADER_DOCUMENTS.labels(result="kept").inc(len(kept))
+    GRADER_DOCUMENTS.labels(result="dropped").inc(len(documents) - len(kept))
+    if kept:
+        return {"documents": kept, "next_step": "generate"}
+
+    # Nothing relevant: search again with a rewritten query, a bounded number of
+    # times, and only while the rewrite would search for something new
+    rewrite = _rewrite_query(state["question"])
+    rewrites = state.get("retrieve_attempts", 1) - 1
+    if rewrites < settings.RETRIEVAL_MAX_REWRITES and rewrite and rewrite != state.get("search_query"):
+        return {"documents": [], "next_step": "transform_query"}
+    return {"documents": [NO_DOCUMENTS], "next_step": "generate"}
 
 def transform_query(state: AgentState):
     """
     Transform the query to produce a better question.
     """
     print("---TRANSFORM QUERY---")
-    question = state["question"]
-    return {"question": question + " (refined)"}
+    # The question itself is kept for the answer prompt
+    return {"search_query": _rewrite_query(state["question"])}
+
+async def _report_tool(config, payload: Dict):
+    try:
+        await adispatch_custom_event(TOOL_EVENT, payload, config=config)
+    except RuntimeError:
+        pass  # Not running inside a graph run, nobody to tell
 
-def action_node(state: AgentState):
+async def _tool_call_deadline(request: ToolCallRequest, execute):
+    """Run one tool call with its own deadline; a failure only affects its own answer."""
+    call = request.tool_call
+    config = getattr(request.runtime, "config", None)
+    await _report_tool(config, {"phase": "start", "name": call["name"], "id": call["id"]})
+    start = time.perf_counter()
+    try:
+        result = await asyncio.wait_for(execute(request), settings.NODE_TOOL_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        NODE_DEADLINE_EXCEEDED.labels(node=call["name"]).inc()
+        result = ToolMessage(content="Error: tool timed out", name=call["name"], tool_call_id=call["id"], status="error")
+    await _report_tool(config, {
+        "phase": "end",
+        "name": call["name"],
+        "id": call["id"],
+        "duration_ms": round((time.perf_counter() - start) * 1000, 1),
+        "status": getattr(result, "status", "success"),
+    })
+    return result
+
+def build_tool_node(node_tools) -> ToolNode:
+    # Tool calls of one model turn run concurrently (each tool's async path),
+    # exceptions become error ToolMessages instead of failing the run
+    return ToolNode(node_tools, messages_key="tool_messages", handle_tool_errors=True, awrap_tool_call=_tool_call_deadline)
+
+tool_node = build_tool_node(tools)
+
+async def action_node(state: AgentState, config: RunnableConfig):
     """
-    Execute tools.
+    Execute the tool calls of the model's last turn, all at once.
+    Their answers go back to generate in a single follow-up turn.
     """
     print("---ACTION---")
-    # In a real LangGraph with ToolNode, this is handled automatically.
-    # Here we simulate tool execution if the LLM decided to call a tool.
-    messages = state["messages"]
-    last_message = messages[-1]
-    
-    # This is a simplified manual tool execution
-    # In production, use LangGraph's prebuilt ToolNode
-    return {"messages": []}
+    return await tool_node.ainvoke(state, config)
 
 def router_node(state: AgentState):
     """
-    Route to appropriate node based on intent.
+    Route to appropriate nodes based on intent.
+    Every tool intent becomes its own branch; retrieval runs alongside them
+    when the LLM has to answer too. Tool-only questions never call the LLM.
     """
     print("---ROUTER---")
     question = state["question"]
-    
-    # Simple keyword based routing for demonstration
-    if any(keyword in question for keyword in ["占卜", "卦", "吉凶"]):
-        return {"next_step": "action_iching"}
-    elif any(keyword in question for keyword in ["星座", "运势"]):
-        return {"next_step": "action_horoscope"}
-    elif any(keyword in question for keyword in ["知识", "介绍", "是什么", "含义", "典故", "历史"]):
-        return {"next_step": "retrieve"}
-    else:
-        return {"next_step": "generate"} # Default to chat
+
+    plan = plan_route(question)
+    return {
+        "route": ROUTE_LLM if plan.llm else ROUTE_TOOL,
+        "intent": ",".join(m.intent for m in plan.intents),
+        "tool_calls": {m.node: m.args for m in plan.intents},
+    }
+
+def join_branches(state: AgentState):
+    """
+    Wait for every parallel branch. Tool-only answers are composed here, in
+    the order the intents appear in the question; otherwise generate takes
+    the tool results as extra context.
+    """
+    print("---JOIN---")
+    if state.get("route") != ROUTE_TOOL:
+        return {}
+    order = list(state.get("tool_calls") or {})
+    results = sorted(state.get("tool_results") or [], key=lambda r: order.index(r["node"]))
+    update = {"generation": "\n\n".join(r["generation"] for r in results)}
+    errors = [r["error"] for r in results if r.get("error")]
+    # A partial answer is still an answer
+    if errors and len(errors) == len(results):
+        update["error"] = errors[0]
+    return update
 
 # Specialized Action Nodes for specific tools
-def action_iching(state: AgentState):
-    tool = IChingTool()
-    result = tool.run(state["question"])
-    return {"generation": str(result)}
-
-def action_horoscope(state: AgentState):
-    tool = HoroscopeTool()
-    # Need to extract date from question, mocking it here
-    result = tool.run("2000-01-01") 
-    return {"generation": str(result)}
+
+def _format_hexagram(h: Dict) -> str:
+    return f"{h['title']}（第{h['number']}卦，{h['upper']}上{h['lower']}下）"
+
+def _format_iching(result: Dict) -> str:
+    original = result["original_hexagram"]
+    parts = [f"为您起卦（三钱法）：\n本卦：{_format_hexagram(original)}"]
+    if original["judgment"]:
+        parts.append(f"卦辞：{original['judgment']}")
+    moving = [f"{m['label']}：{m['text']}" if m["text"] else m["label"] for m in result.get("moving_lines", [])]
+    if moving:
+        parts.append(f"动爻：{'；'.join(moving)}")
+    lines = "、".join(str(x) for x in result["lines"])
+    parts.append(f"变卦：{_format_hexagram(result['changed_hexagram'])}\n六爻（自下而上）：{lines}")
+    return "\n".join(parts)
+
+def _format_horoscope(result: Dict) -> str:
+    return f"{result['date']} 出生的星座是：{result['sign']}。"
+
+def _format_zodiac(result: Dict) -> str:
+    compatibility = result["compatibility"]
+    return (
+        f"{result['year']} 年出生的生肖是：{result['sign']}。\n"
+        f"相合：{'、'.join(compatibility['best'])}；相冲：{'、'.join(compatibility['worst'])}。"
+    )
+
+def _format_bazi(result: Dict) -> str:
+    return (
+        f"出生时间 {result['input_time']} 的八字：\n"
+        f"年柱 {result['year_pillar']}，月柱 {result['month_pillar']}，"
+        f"日柱 {result['day_pillar']}，时柱 {result['hour_pillar']}。"
+    )
+
+def _format_naming(result: Dict) -> str:
+    names = "\n".join(f"{s['name']}（{s['score']}分）" for s in result["suggestions"])
+    return f"为{result['surname']}姓{'男孩' if result['gender'] == 'boy' else '女孩'}推荐的名字：\n{names}"
+
+async def _run_tool(tool, formatter, state: AgentState):
+    try:
+        result = await asyncio.wait_for(
+            asyncio.to_thread(tool.run, state.get("tool_args") or {}), settings.NODE_TOOL_TIMEOUT_SECONDS
+        )
+    except asyncio.TimeoutError:
+        NODE_DEADLINE_EXCEEDED.labels(node=tool.name).inc()
+        return {"generation": "抱歉，计算超时，请稍后重试", "error": "timeout"}
+    if "error" in result:
+        return {"generation": f"抱歉，计算时出现错误: {result['error']}", "error": result["error"]}
+    return {"generation": formatter(result)}
+
+def _branch_result(node: str, outcome: Dict) -> Dict:
+    # Branches run in parallel and may not write the same key; join_branches merges them
+    return {"tool_results": [{"node": node, **outcome}]}
+
+async def action_iching(state: AgentState):
+    print("---ACTION: ICHING---")
+    return _branch_result("action_iching", await _run_tool(iching_tool, _format_iching, state))
+
+async def action_horoscope(state: AgentState):
+    print("---ACTION: HOROSCOPE---")
+    return _branch_result("action_horoscope", await _run_tool(horoscope_tool, _format_horoscope, state))
+
+async def action_zodiac(state: AgentState):
+    print("---ACTION: ZODIAC---")
+    return _branch_result("action_zodiac", await _run_tool(zodiac_tool, _format_zodiac, state))
+
+async def action_bazi(state: AgentState):
+    print("---ACTION: BAZI---")
+    return _branch_result("action_bazi", await _run_tool(bazi_tool, _format_bazi, state))
+
+async def action_naming(state: AgentState):
+    print("---ACTION: NAMING---")
+    return _branch_result("action_naming", await _run_tool(naming_tool, _format_naming, state))
@@ -0,0 +1,77 @@
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from app.agent.graph import create_graph
+
+DEFAULT_GRAPH = "default"
+
+
+class GraphRegistry:
+    """
+    Process-wide registry of compiled LangGraph workflows.
+
+    Builders are registered under a variant name and compiled lazily (or
+    eagerly via ``warm``). Compiled graphs are immutable and safe to share
+    across concurrent requests, so each variant is compiled once per process.
+    """
+
+    def __init__(self):
+        self._builders: Dict[str, Callable] = {}
+        self._compiled: Dict[str, object] = {}
+        self._build_times: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def register(self, name: str, builder: Callable, replace: bool = False):
+        """Register a graph builder under ``name``."""
+        with self._lock:
+            if name in self._builders and not replace:
+                raise ValueError(f"Graph variant already registered: {name}")
+            self._builders[name] = builder
+            self._compiled.pop(name, None)
+
+    def variants(self) -> List[str]:
+        return sorted(self._builders)
+
+    def get(self, name: str = DEFAULT_GRAPH):
+        """Return the compiled graph for ``name``, compiling it on first use."""
+        graph = self._compiled.get(name)
+        if graph is not None:
+            return graph
+        with self._lock:
+            graph = self._compiled.get(name)
+            if graph is None:
+                graph = self._build(name)
+            return graph
+
+    def warm(self, names: Optional[List[str]] = None) -> Dict[str, float]:
+        """Compile the given variants (all by default); returns build times in ms."""
+        with self._lock:
+            for name in names or list(self._builders):
+                if name not in self._compiled:
+                    self._build(name)
+            return dict(self._build_times)
+
+    def reload(self, name: Optional[str] = None) -> Dict[str, float]:
+        """Rebuild one variant, or every variant when ``name`` is None."""
+        with self._lock:
+            names = [name] if name else list(self._builders)
+            for n in names:
+                self._compiled.pop(n, None)
+                self._build(n)
+            return {n: self._build_times[n] for n in names}
+
+    def _build(self, name: str):
+        # Caller must hold self._lock
+        builder = self._builders.get(name)
+        if builder is None:
+            raise KeyError(f"Unknown graph variant: {name}")
+        start = time.perf_counter()
+        graph = builder()
+        self._build_times[name] = round((time.perf_counter() - start) * 1000, 3)
+        self._compiled[name] = graph
+        return graph
+
+
+graph_registry = GraphRegistry()
+graph_registry.register(DEFAULT_GRAPH, create_graph)
@@ -1,10 +1,29 @@
-from typing import Annotated, Sequence, TypedDict, Union, List
+from typing import Annotated, Dict, Sequence, TypedDict, Union, List
 from langchain_core.messages import BaseMessage
 import operator
 
+# Which path answered the question
+ROUTE_LLM = "llm"
+ROUTE_TOOL = "tool"
+
 class AgentState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], operator.add]
     question: str
     documents: List[str]
     generation: str
     next_step: str
+    error: str
+    route: str
+    intent: str
+    tool_args: dict
+    # Parallel tool branches: graph node -> arguments, and what each branch produced
+    tool_calls: Dict[str, dict]
+    tool_results: Annotated[List[dict], operator.add]
+    # Native tool calling: the model's tool-call turns and the tool answers, and how many rounds it took
+    tool_messages: Annotated[List[BaseMessage], operator.add]
+    tool_rounds: int
+    prompt_tokens: int
+    summary: str
+    retrieve_attempts: int
+    # What retrieval searches for once transform_query has rewritten the question
+    search_query: str
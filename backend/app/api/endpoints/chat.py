@@ -1,137 +1,503 @@
 import asyncio
 import json
-from typing import Any, AsyncGenerator
+from typing import Any, AsyncGenerator, Dict, List, Literal, Optional, Union
 from fastapi import APIRouter, Depends, Request
+from fastapi.responses import JSONResponse, StreamingResponse
 from sse_starlette.sse import EventSourceResponse
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+import structlog
 import time
 
-from app.agent.graph import create_graph
+from app.agent.graph import STREAM_NODES
+from app.agent.intent import match_intent, match_intents, plan_route
+from app.agent.nodes import TOOL_EVENT
+from app.agent.state import ROUTE_LLM
+from app.agent.registry import graph_registry, DEFAULT_GRAPH
+from app.core.answer_cache import answer_cache
+from app.core.config import settings
+from app.core.llm import llm_clients, LLMOverloaded, LLM_QUEUE_EVENT
+from app.core.metrics import BATCH_ITEMS, CHAT_DISCONNECTS
+from app.core.memory import SessionMemory, session_memory
+from app.core.resumable import resumable_streams
+from app.core.singleflight import single_flight
+from app.core.sse import coalesce_tokens, message_frame, token_frame
+from app.core.text import normalize_question
+from app.core.tracing import collect_stages, current_trace_id
 
 router = APIRouter()
+logger = structlog.get_logger()
+
+# Cached answers are replayed as token frames of this many characters
+REPLAY_CHUNK_CHARS = 8
+
+OVERLOADED_MESSAGE = "当前咨询人数过多，请稍后重试"
+
+# Internal frame carrying run metadata to the per-subscriber done frame; never sent
+META_EVENT = "meta"
+
+# How often a non-streaming request checks whether its client is still there
+DISCONNECT_POLL_SECONDS = 0.5
+
+class ClientDisconnected(Exception):
+    pass
 
 class ChatRequest(BaseModel):
     message: str
     session_id: str = "default"
+    graph: str = DEFAULT_GRAPH
+    stream_mode: Optional[Literal["full", "compact"]] = None
+
+async def _lookup_cache(request: ChatRequest, memory: SessionMemory):
+    # Tool intents are answered without the LLM and are not worth caching;
+    # answers that depend on earlier turns are never shared
+    if not settings.ANSWER_CACHE_ENABLED or memory or match_intent(request.message):
+        return None
+    hit = await answer_cache.alookup(request.message, request.graph)
+    if hit:
+        logger.info("answer_cache_hit", tier=hit.tier, similarity=round(hit.similarity, 4))
+    return hit
+
+async def _store_cache(request: ChatRequest, memory: SessionMemory, answer: str):
+    # Answers built on tool output (tool intent plus follow-up question) are not shared either
+    if settings.ANSWER_CACHE_ENABLED and not memory and not match_intent(request.message):
+        await answer_cache.astore(request.message, answer, request.graph)
+
+async def _replay_answer(answer: str, start_time: float) -> AsyncGenerator[dict, None]:
+    """Replay a cached answer as the same status/token/done sequence a live run emits."""
+    yield _first_frame()
+    for i in range(0, len(answer), REPLAY_CHUNK_CHARS):
+        yield token_frame(answer[i:i + REPLAY_CHUNK_CHARS])
+    elapsed = time.time() - start_time
+    yield message_frame({
+        "type": "done", "content": "", "elapsed_time": round(elapsed, 2), "route": ROUTE_LLM, "intent": "",
+        "prompt_tokens": 0, "trace_id": current_trace_id(), "stages": {},
+    })
+
+def _first_frame() -> dict:
+    """Initial status frame, sent at once; carries the trace id so a stream cut short can still be reported."""
+    return message_frame({"type": "status", "content": "正在处理您的请求...", "trace_id": current_trace_id()})
+
+def _error_frame(payload: dict) -> dict:
+    """Terminal error frame; carries the request's trace id for problem reports, like the done frame."""
+    return {"event": "error", "data": json.dumps({**payload, "trace_id": current_trace_id()})}
+
+def _overloaded_frame(e: LLMOverloaded) -> dict:
+    return _error_frame({"error": OVERLOADED_MESSAGE, "code": "overloaded", "reason": e.reason})
+
+def _reject_early(request: ChatRequest) -> Optional[LLMOverloaded]:
+    """Turn LLM-bound requests away before any work if every backend queue is already full."""
+    if plan_route(request.message).llm and llm_clients.saturated():
+        return LLMOverloaded(llm_clients.backends[0].name, "queue_full")
+    return None
+
+def _flight_key(request: ChatRequest, memory: SessionMemory, mode: str = "") -> Optional[str]:
+    """Single-flight key, or None when runs must not be shared (random tool output)."""
+    if any(not intent.deterministic for intent in match_intents(request.message)):
+        return None
+    # Only runs over the same conversation history may be shared
+    return f"{request.graph}\x00{mode}\x00{memory.fingerprint()}\x00{normalize_question(request.message)}"
+
+def _graph_inputs(request: ChatRequest, memory: SessionMemory) -> dict:
+    return {
+        "question": request.message,
+        "messages": memory.messages(),
+        "summary": memory.summary,
+        "documents": [],
+        "generation": "",
+    }
+
+async def _coalesced(key: Optional[str], fn):
+    if key is None:
+        return await fn()
+    return await single_flight.do(key, fn)
+
+async def _cancel_on_disconnect(req: Request, coro):
+    """Await ``coro``, cancelling it (graph run, LLM call) if the client goes away first."""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await req.is_disconnected():
+                CHAT_DISCONNECTS.labels(endpoint="chat").inc()
+                raise ClientDisconnected()
+    finally:
+        task.cancel()
+
+def _coalesced_stream(key: Optional[str], fn):
+    if key is None:
+        return fn()
+    return single_flight.stream(key, fn)
+
+async def _graph_items(app, request: ChatRequest, memory: SessionMemory, mode: str) -> AsyncGenerator[Union[str, dict], None]:
+    """
+    Run the graph once and yield token text (``str``) or ready SSE frames.
+
+    In compact mode events are filtered at the source to the graph's own
+    nodes, chat models and tools, and only one status frame is sent per node.
+    """
+    inputs = _graph_inputs(request, memory)
+    node_updates = {}
+    # Filled in by the traced graph nodes as they finish
+    stages = collect_stages()
+
+    stream_kwargs = {}
+    if mode == "compact":
+        stream_kwargs = {
+            "include_names": [getattr(app, "name", "LangGraph"), *STREAM_NODES, LLM_QUEUE_EVENT, TOOL_EVENT],
+            "include_types": ["chat_model", "tool"],
+        }
+
+    try:
+        # Use astream for better control over streaming
+        # First, stream the graph execution with timeout
+        async for event in app.astream_events(inputs, version="v2", **stream_kwargs):
+            kind = event["event"]
+            # Events of the graph itself have no parent run
+            is_root = not event.get("parent_ids")
+
+            # Capture LLM streaming tokens
+            if kind == "on_chat_model_stream":
+                chunk_data = event.get("data", {})
+                chunk = chunk_data.get("chunk")
+                if chunk and hasattr(chunk, 'content'):
+                    content = chunk.content
+                    if content:
+                        yield content
+
+            # Tool calls requested by the model, each with its own duration
+            elif kind == "on_custom_event" and event.get("name") == TOOL_EVENT:
+                call = event["data"]
+                if call["phase"] == "start":
+                    yield message_frame({
+                        "type": "tool_start", "content": f"正在使用工具: {call['name']}...",
+                        "name": call["name"], "id": call["id"],
+                    })
+                else:
+                    yield message_frame({
+                        "type": "tool_end", "content": f"工具 {call['name']} 已完成",
+                        "name": call["name"], "id": call["id"],
+                        "duration_ms": call["duration_ms"], "status": call["status"],
+                    })
+
+            # Waiting for an LLM slot (admission control)
+            elif kind == "on_custom_event" and event.get("name") == LLM_QUEUE_EVENT:
+                position = event["data"]["position"]
+                yield message_frame({
+                    "type": "status",
+                    "content": f"当前排队人数较多，您前面还有 {position - 1} 位...",
+                    "queue_position": position,
+                })
+
+            # Capture node transitions
+            elif kind == "on_chain_start":
+                node_name = event.get('name', '')
+                if node_name and not (mode == "compact" and is_root):
+                    yield message_frame({"type": "status", "content": f"正在{node_name}..."})
+
+            # Track node outputs of the graph itself
+            elif kind == "on_chain_stream" and is_root:
+                chunk = event.get("data", {}).get("chunk") or {}
+                node_updates.update(chunk)
+                # Tool answers are produced without an LLM, send them as tokens
+                if (chunk.get("join") or {}).get("generation"):
+                    yield chunk["join"]["generation"]
+
+        # Only clean LLM answers are cached, and only those not built on tool calls
+        generated = node_updates.get("generate") or {}
+        if generated.get("generation") and not generated.get("error") and not generated.get("tool_rounds"):
+            await _store_cache(request, memory, generated["generation"])
+
+        # The final answer goes to each subscriber's session memory
+        answer = ""
+        for node in ("generate", "join"):
+            update = node_updates.get(node) or {}
+            if update.get("generation") and not update.get("error"):
+                answer = update["generation"]
+
+        routed = node_updates.get("router") or {}
+        yield {"event": META_EVENT, "data": {
+            "route": routed.get("route", ROUTE_LLM),
+            "intent": routed.get("intent", ""),
+            "prompt_tokens": generated.get("prompt_tokens", 0),
+            "stages": stages,
+            "answer": answer,
+        }}
+
+    except asyncio.TimeoutError:
+        yield _error_frame({"error": "请求超时，请稍后重试", "code": "timeout"})
+    except LLMOverloaded as e:
+        yield _overloaded_frame(e)
+    except Exception as e:
+        print(f"Stream error: {e}")
+        yield _error_frame({"error": f"处理请求时出错: {str(e)}"})
+
+async def _graph_events(app, request: ChatRequest, memory: SessionMemory, mode: str) -> AsyncGenerator[dict, None]:
+    """
+    SSE frames of one graph run (without the final done frame).
+    Shared by every subscriber coalesced onto the same question.
+    """
+    items = _graph_items(app, request, memory, mode)
+    if mode == "compact":
+        async for frame in coalesce_tokens(
+            items,
+            window_ms=settings.SSE_COALESCE_WINDOW_MS,
+            max_bytes=settings.SSE_COALESCE_MAX_BYTES,
+        ):
+            yield frame
+    else:
+        async for item in items:
+            yield token_frame(item) if isinstance(item, str) else item
 
 @router.post("/stream")
 async def stream_chat(request: ChatRequest, req: Request):
     """
     Stream chat response using SSE (Server-Sent Events)
-    Optimized version with caching and better error handling
+    Identical concurrent questions share one graph run (single-flight).
+    Frames carry ids; reconnecting with Last-Event-ID resumes the same run.
     """
     start_time = time.time()
-    
-    # Create graph (this should be cached in production)
+
+    last_event_id = req.headers.get("last-event-id")
+    if last_event_id:
+        resumed = await resumable_streams.resume(last_event_id)
+        if resumed is not None:
+            return EventSourceResponse(resumed, ping=settings.SSE_KEEPALIVE_SECONDS)
+    memory = await session_memory.load(request.session_id)
+
+    hit = await _lookup_cache(request, memory)
+    if hit:
+        await session_memory.record(request.session_id, request.message, hit.answer)
+        return EventSourceResponse(_replay_answer(hit.answer, start_time))
+
+    rejected = _reject_early(request)
+    if rejected:
+        async def rejected_generator():
+            yield _overloaded_frame(rejected)
+        return EventSourceResponse(rejected_generator())
+
+    # Compiled graphs are shared process-wide, see app.agent.registry
     try:
-        app = create_graph()
+        app = graph_registry.get(request.graph)
     except Exception as e:
         async def error_generator():
-            yield {
-                "event": "error",
-                "data": json.dumps({"error": f"Failed to initialize chat engine: {str(e)}"})
-            }
+            yield _error_frame({"error": f"Failed to initialize chat engine: {str(e)}"})
         return EventSourceResponse(error_generator())
-    
+
+    mode = request.stream_mode or settings.SSE_STREAM_MODE
+
     async def event_generator() -> AsyncGenerator[dict, None]:
-        # Initial inputs
-        inputs = {"question": request.message, "messages": [], "documents": [], "generation": ""}
-        
-        # Send initial status immediately
-        yield {
-            "event": "message",
-            "data": json.dumps({"type": "status", "content": "正在处理您的请求..."})
+        failed = False
+        meta = {}
+        flight_key = _flight_key(request, memory, mode)
+        # Per subscriber, ahead of the possibly shared run
+        yield _first_frame()
+        async for frame in _coalesced_stream(flight_key, lambda: _graph_events(app, request, memory, mode)):
+            if frame["event"] == META_EVENT:
+                meta.update(frame["data"])
+                continue
+            failed = frame["event"] == "error"
+            if failed:
+                # The run may be shared: report this subscriber's trace id, not the leader's
+                frame = _error_frame({k: v for k, v in json.loads(frame["data"]).items() if k != "trace_id"})
+            yield frame
+        if failed:
+            logger.info("chat_stream_failed", elapsed_ms=round((time.time() - start_time) * 1000, 1))
+            return
+        await session_memory.record(request.session_id, request.message, meta.pop("answer", ""))
+
+        # Send completion, timed per subscriber; route tells which path answered
+        # and stages how long each graph node took (ms)
+        elapsed = time.time() - start_time
+        logger.info("chat_stream_done", elapsed_ms=round(elapsed * 1000, 1), route=meta.get("route"), stages=meta.get("stages"))
+        yield message_frame({"type": "done", "content": "", "elapsed_time": round(elapsed, 2), "trace_id": current_trace_id(), **meta})
+
+    # The run outlives this connection so a reconnect can pick it up again
+    stream = resumable_streams.start(event_generator())
+    # Idle periods are covered by keep-alive comments rather than status frames
+    return EventSourceResponse(stream.follow(), ping=settings.SSE_KEEPALIVE_SECONDS)
+
+def _overloaded_response(request: ChatRequest, e: LLMOverloaded) -> JSONResponse:
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": "5"},
+        content={
+            "response": OVERLOADED_MESSAGE,
+            "session_id": request.session_id,
+            "error": "overloaded",
+            "reason": e.reason,
+            "trace_id": current_trace_id(),
         }
-        
-        try:
-            # Use astream for better control over streaming
-            # First, stream the graph execution with timeout
-            async for event in app.astream_events(inputs, version="v1"):
-                kind = event["event"]
-                
-                # Capture LLM streaming tokens
-                if kind == "on_chat_model_stream":
-                    chunk_data = event.get("data", {})
-                    chunk = chunk_data.get("chunk")
-                    if chunk and hasattr(chunk, 'content'):
-                        content = chunk.content
-                        if content:
-                            yield {
-                                "event": "message",
-                                "data": json.dumps({"type": "token", "content": content})
-                            }
-                
-                # Capture Tool outputs
-                elif kind == "on_tool_start":
-                    tool_name = event.get('name', 'unknown')
-                    yield {
-                        "event": "message",
-                        "data": json.dumps({"type": "status", "content": f"正在使用工具: {tool_name}..."})
-                    }
-                
-                # Capture node transitions
-                elif kind == "on_chain_start":
-                    node_name = event.get('name', '')
-                    if node_name:
-                        yield {
-                            "event": "message", 
-                            "data": json.dumps({"type": "status", "content": f"正在{node_name}..."})
-                        }
-            
-            # Send completion
-            elapsed = time.time() - start_time
-            yield {
-                "event": "message",
-                "data": json.dumps({"type": "done", "content": "", "elapsed_time": round(elapsed, 2)})
-            }
-            
-        except asyncio.TimeoutError:
-            yield {
-                "event": "error",
-                "data": json.dumps({"error": "请求超时，请稍后重试"})
-            }
-        except Exception as e:
-            print(f"Stream error: {e}")
-            yield {
-                "event": "error",
-                "data": json.dumps({"error": f"处理请求时出错: {str(e)}"})
-            }
-
-    return EventSourceResponse(event_generator())
+    )
+
+async def _invoke_graph(app, request: ChatRequest, memory: SessionMemory) -> dict:
+    """Run the graph to completion; identical concurrent questions share one run."""
+    inputs = _graph_inputs(request, memory)
+
+    async def run_graph():
+        stages = collect_stages()
+        # Run the graph with timeout
+        result = await asyncio.wait_for(app.ainvoke(inputs), timeout=settings.CHAT_TIMEOUT_SECONDS)
+        logger.info("chat_graph_done", route=result.get("route"), stages=stages)
+        if (result.get("route") == ROUTE_LLM and result.get("generation") and not result.get("error")
+                and not result.get("tool_rounds")):
+            await _store_cache(request, memory, result["generation"])
+        return result
+
+    return await _coalesced(_flight_key(request, memory), run_graph)
 
 @router.post("/")
-async def chat(request: ChatRequest):
+async def chat(request: ChatRequest, req: Request):
     """
     Standard chat endpoint (non-streaming)
     """
     start_time = time.time()
-    
+    memory = await session_memory.load(request.session_id)
+
+    hit = await _lookup_cache(request, memory)
+    if hit:
+        await session_memory.record(request.session_id, request.message, hit.answer)
+        return {
+            "response": hit.answer,
+            "session_id": request.session_id,
+            "elapsed_time": round(time.time() - start_time, 2),
+            "route": ROUTE_LLM,
+            "prompt_tokens": 0
+        }
+
+    rejected = _reject_early(request)
+    if rejected:
+        return _overloaded_response(request, rejected)
+
     try:
-        app = create_graph()
-        inputs = {"question": request.message, "messages": [], "documents": [], "generation": ""}
-        
-        # Run the graph with timeout
-        result = await asyncio.wait_for(
-            app.ainvoke(inputs),
-            timeout=60.0  # 60 second timeout
-        )
-        
+        app = graph_registry.get(request.graph)
+        # Leaving a shared run only cancels it once every caller has disconnected
+        result = await _cancel_on_disconnect(req, _invoke_graph(app, request, memory))
         elapsed = time.time() - start_time
-        
+        if not result.get("error"):
+            await session_memory.record(request.session_id, request.message, result.get("generation", ""))
+
         return {
             "response": result.get("generation", "No response generated"),
             "session_id": request.session_id,
-            "elapsed_time": round(elapsed, 2)
+            "elapsed_time": round(elapsed, 2),
+            "route": result.get("route", ROUTE_LLM),
+            "prompt_tokens": result.get("prompt_tokens", 0)
         }
+    except LLMOverloaded as e:
+        return _overloaded_response(request, e)
+    except ClientDisconnected:
+        # Nobody is there to read it
+        return JSONResponse(status_code=499, content={"session_id": request.session_id, "error": "client_disconnected"})
     except asyncio.TimeoutError:
         return {
             "response": "请求处理超时，请稍后重试",
             "session_id": request.session_id,
-            "error": "timeout"
+            "error": "timeout",
+            "trace_id": current_trace_id(),
         }
     except Exception as e:
         return {
             "response": f"处理请求时出错: {str(e)}",
             "session_id": request.session_id,
-            "error": str(e)
+            "error": str(e),
+            "trace_id": current_trace_id(),
         }
+
+class BatchChatRequest(BaseModel):
+    messages: List[str] = Field(..., min_length=1)
+    graph: str = DEFAULT_GRAPH
+    concurrency: Optional[int] = Field(None, ge=1)
+
+def _batch_outcome(response: str, error: Optional[str] = None, route: Optional[str] = None,
+                   prompt_tokens: Optional[int] = None, cached: bool = False) -> dict:
+    # Every NDJSON result line has the same keys; null where a value does not apply
+    return {"response": response, "route": route, "prompt_tokens": prompt_tokens, "cached": cached, "error": error}
+
+async def _answer_batch_item(app, request: ChatRequest) -> dict:
+    memory = SessionMemory()
+    hit = await _lookup_cache(request, memory)
+    if hit:
+        return _batch_outcome(hit.answer, route=ROUTE_LLM, prompt_tokens=0, cached=True)
+    try:
+        result = await _invoke_graph(app, request, memory)
+    except LLMOverloaded:
+        return _batch_outcome(OVERLOADED_MESSAGE, error="overloaded")
+    except asyncio.TimeoutError:
+        return _batch_outcome("请求处理超时，请稍后重试", error="timeout")
+    except Exception as e:
+        return _batch_outcome(f"处理请求时出错: {str(e)}", error=str(e))
+    return _batch_outcome(
+        result.get("generation", "No response generated"),
+        error=result.get("error") or None,
+        route=result.get("route", ROUTE_LLM),
+        prompt_tokens=result.get("prompt_tokens", 0),
+    )
+
+async def _batch_lines(app, request: BatchChatRequest, concurrency: int) -> AsyncGenerator[str, None]:
+    start_time = time.perf_counter()
+    # Identical prompts (same flight key) are answered once; random tool output never is shared
+    jobs: Dict[str, List[int]] = {}
+    for index, message in enumerate(request.messages):
+        key = _flight_key(ChatRequest(message=message, graph=request.graph), SessionMemory()) or f"\x00{index}"
+        jobs.setdefault(key, []).append(index)
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(indexes: List[int]):
+        queued = time.perf_counter()
+        async with slots:
+            started = time.perf_counter()
+            item = ChatRequest(message=request.messages[indexes[0]], graph=request.graph)
+            outcome = await _answer_batch_item(app, item)
+        outcome["wait_time"] = round(started - queued, 3)
+        outcome["elapsed_time"] = round(time.perf_counter() - started, 3)
+        return indexes, outcome
+
+    tasks = [asyncio.ensure_future(run(indexes)) for indexes in jobs.values()]
+    errors = 0
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            indexes, outcome = await next_done
+            for index in indexes:
+                errors += outcome["error"] is not None
+                BATCH_ITEMS.labels(outcome="error" if outcome["error"] else "ok").inc()
+                line = {
+                    "type": "result",
+                    "index": index,
+                    "message": request.messages[index],
+                    **outcome,
+                    "duplicate_of": indexes[0] if index != indexes[0] else None,
+                }
+                yield json.dumps(line, ensure_ascii=False) + "\n"
+        yield json.dumps({
+            "type": "summary",
+            "total": len(request.messages),
+            "unique": len(jobs),
+            "errors": errors,
+            "elapsed_time": round(time.perf_counter() - start_time, 3),
+        }) + "\n"
+    finally:
+        # Client went away (or we are done): stop whatever is still running
+        for task in tasks:
+            task.cancel()
+
+@router.post("/batch")
+async def chat_batch(request: BatchChatRequest):
+    """
+    Answer a list of questions concurrently through the shared compiled graph.
+    Results are streamed back as NDJSON, one line per question in completion
+    order, followed by a summary line.
+    """
+    if len(request.messages) > settings.BATCH_MAX_ITEMS:
+        return JSONResponse(
+            status_code=413,
+            content={"error": f"too many messages (max {settings.BATCH_MAX_ITEMS})"}
+        )
+    try:
+        app = graph_registry.get(request.graph)
+    except Exception as e:
+        return JSONResponse(status_code=400, content={"error": f"Failed to initialize chat engine: {str(e)}"})
+
+    concurrency = min(request.concurrency or settings.BATCH_CONCURRENCY, settings.BATCH_MAX_CONCURRENCY)
+    return StreamingResponse(_batch_lines(app, request, concurrency), media_type="application/x-ndjson")
@@ -0,0 +1,242 @@
+"""
+Two-tier answer cache placed in front of the agent graph.
+
+Tier 1 is an exact match on the normalised question (see
+``app.core.text.normalize_question``). Tier 2 is a nearest-neighbour match on
+question embeddings above a cosine similarity threshold. Both tiers share one
+LRU of entries with a TTL.
+
+Tier 2 embeds questions with the retrieval query embedder (``rag.query_embedder``,
+the EMBEDDING_MODEL model) and is off while there is none, e.g. with
+EMBEDDING_MODEL=hashing: hashed character n-grams score long questions that
+differ in one word as near-identical. Even with a model, a semantic hit must
+name the same key entities (zodiac animals, hexagrams, star signs, numbers) as
+the question, since those decide the answer.
+"""
+import asyncio
+import hashlib
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, NamedTuple, Optional
+
+import numpy as np
+
+from app.core import rag
+from app.core.config import settings
+from app.core.metrics import ANSWER_CACHE_LOOKUPS, ANSWER_CACHE_EVICTIONS, ANSWER_CACHE_ENTRIES
+from app.core.text import normalize_question, extract_numbers
+from app.tools.hexagrams import KING_WEN
+from app.tools.horoscope import SIGNS
+from app.tools.zodiac import ZODIAC_SIGNS
+
+# Single-character hexagram names (需, 比, 师...) are everyday words; those only count as 需卦
+_ENTITY_RE = re.compile("|".join(sorted(
+    {*SIGNS, *ZODIAC_SIGNS, *(f"{name}卦" for name, _, _ in KING_WEN), *(name for name, _, _ in KING_WEN if len(name) > 1)},
+    key=len, reverse=True,
+)))
+
+
+async def _aembed(embedder, text: str) -> np.ndarray:
+    """Through the micro-batching EmbeddingService when RAG runs one, else on a worker thread."""
+    if hasattr(embedder, "aembed"):
+        return await embedder.aembed(text)
+    return await asyncio.to_thread(embedder.embed, text)
+
+
+def question_entities(normalized: str) -> tuple:
+    """Numbers, then the distinct zodiac animals, hexagrams and star signs named in a normalised question."""
+    return extract_numbers(normalized) + tuple(sorted(set(_ENTITY_RE.findall(normalized))))
+
+
+class CacheHit(NamedTuple):
+    answer: str
+    tier: str  # "exact" | "semantic"
+    similarity: float
+
+
+@dataclass
+class _Entry:
+    answer: str
+    variant: str
+    entities: tuple
+    slot: int
+    expires_at: float
+    hits: int = 0
+    created_at: float = field(default_factory=time.time)
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        max_entries: int = 2048,
+        ttl_seconds: float = 3600,
+        similarity_threshold: float = 0.95,
+        embedder=None,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        # The semantic tier's embedder, looked up on every use: the query embedder changes with the index
+        self._embedder: Callable[[], Optional[object]] = (lambda: embedder) if embedder is not None else rag.query_embedder
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # One row per slot, for the embedder they were computed with; free slots are all-zero so they never match
+        self._vectors: Optional[np.ndarray] = None
+        self._vectors_embedder = None
+        self._slot_keys: Dict[int, str] = {}
+        self._free_slots = list(range(max_entries - 1, -1, -1))
+        self._counts = {"exact_hit": 0, "semantic_hit": 0, "miss": 0}
+
+    @staticmethod
+    def _key(normalized: str, variant: str) -> str:
+        return hashlib.sha1(f"{variant}\x00{normalized}".encode("utf-8")).hexdigest()
+
+    def lookup(self, question: str, variant: str = "default") -> Optional[CacheHit]:
+        normalized = normalize_question(question)
+        hit = self._exact(normalized, variant)
+        embedder = self._semantic_embedder() if hit is None else None
+        if embedder is not None:
+            hit = self._semantic(normalized, variant, embedder, embedder.embed(normalized))
+        return hit or self._miss()
+
+    async def alookup(self, question: str, variant: str = "default") -> Optional[CacheHit]:
+        """``lookup`` with the question embedded off the event loop."""
+        normalized = normalize_question(question)
+        hit = self._exact(normalized, variant)
+        embedder = self._semantic_embedder() if hit is None else None
+        if embedder is not None:
+            vector = await _aembed(embedder, normalized)
+            hit = self._semantic(normalized, variant, embedder, vector)
+        return hit or self._miss()
+
+    def _exact(self, normalized: str, variant: str) -> Optional[CacheHit]:
+        key = self._key(normalized, variant)
+        entry = self._entries.get(key)
+        if entry is not None and not self._expire_if_stale(key, entry, time.time()):
+            return self._hit(key, entry, "exact", 1.0)
+        return None
+
+    def _semantic_embedder(self):
+        if self.similarity_threshold > 1.0 or not self._entries:
+            return None
+        return self._embedder()
+
+    def _semantic(self, normalized: str, variant: str, embedder, query: np.ndarray) -> Optional[CacheHit]:
+        if embedder is not self._vectors_embedder:
+            return None  # Entries were embedded by another model, or not at all
+        now = time.time()
+        entities = question_entities(normalized)
+        sims = self._vectors @ query
+        top = min(8, len(sims))
+        candidates = np.argpartition(-sims, top - 1)[:top]
+        for slot in candidates[np.argsort(-sims[candidates])]:
+            similarity = float(sims[slot])
+            if similarity < self.similarity_threshold:
+                break
+            cand_key = self._slot_keys.get(int(slot))
+            cand = self._entries.get(cand_key) if cand_key else None
+            if cand is None or self._expire_if_stale(cand_key, cand, now):
+                continue
+            # Numbers (years, dates) and named entities change the answer; never match across them
+            if cand.variant != variant or cand.entities != entities:
+                continue
+            return self._hit(cand_key, cand, "semantic", similarity)
+        return None
+
+    def _miss(self) -> None:
+        self._record("miss")
+        return None
+
+    def store(self, question: str, answer: str, variant: str = "default"):
+        if not answer:
+            return
+        normalized = normalize_question(question)
+        embedder = self._embedder()
+        self._put(normalized, answer, variant, embedder, embedder.embed(normalized) if embedder else None)
+
+    async def astore(self, question: str, answer: str, variant: str = "default"):
+        """``store`` with the question embedded off the event loop."""
+        if not answer:
+            return
+        normalized = normalize_question(question)
+        embedder = self._embedder()
+        vector = await _aembed(embedder, normalized) if embedder else None
+        self._put(normalized, answer, variant, embedder, vector)
+
+    def _put(self, normalized: str, answer: str, variant: str, embedder, vector: Optional[np.ndarray]):
+        key = self._key(normalized, variant)
+        if key in self._entries:
+            self._remove(key)
+        while not self._free_slots:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            ANSWER_CACHE_EVICTIONS.labels(reason="lru").inc()
+
+        slot = self._free_slots.pop()
+        if embedder is not None and embedder is not self._vectors_embedder:
+            # A new query embedder (first use, or another model after an index reload): old rows no longer compare
+            self._vectors = np.zeros((self.max_entries, embedder.dim), dtype=np.float32)
+            self._vectors_embedder = embedder
+        if vector is not None and embedder is self._vectors_embedder:
+            self._vectors[slot] = vector
+        self._slot_keys[slot] = key
+        self._entries[key] = _Entry(
+            answer=answer,
+            variant=variant,
+            entities=question_entities(normalized),
+            slot=slot,
+            expires_at=time.time() + self.ttl_seconds,
+        )
+        ANSWER_CACHE_ENTRIES.set(len(self._entries))
+
+    def clear(self):
+        for key in list(self._entries):
+            self._remove(key)
+        ANSWER_CACHE_ENTRIES.set(0)
+
+    def stats(self) -> Dict:
+        lookups = sum(self._counts.values())
+        hits = self._counts["exact_hit"] + self._counts["semantic_hit"]
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            **self._counts,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _hit(self, key: str, entry: _Entry, tier: str, similarity: float) -> CacheHit:
+        entry.hits += 1
+        self._entries.move_to_end(key)
+        self._record(f"{tier}_hit")
+        return CacheHit(entry.answer, tier, similarity)
+
+    def _record(self, result: str):
+        self._counts[result] += 1
+        ANSWER_CACHE_LOOKUPS.labels(result=result).inc()
+
+    def _expire_if_stale(self, key: str, entry: _Entry, now: float) -> bool:
+        if entry.expires_at > now:
+            return False
+        self._remove(key)
+        ANSWER_CACHE_EVICTIONS.labels(reason="ttl").inc()
+        return True
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key)
+        if self._vectors is not None:
+            self._vectors[entry.slot] = 0.0
+        self._slot_keys.pop(entry.slot, None)
+        self._free_slots.append(entry.slot)
+        ANSWER_CACHE_ENTRIES.set(len(self._entries))
+
+
+answer_cache = AnswerCache(
+    max_entries=settings.ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.ANSWER_CACHE_TTL_SECONDS,
+    similarity_threshold=settings.ANSWER_CACHE_SIMILARITY,
+)
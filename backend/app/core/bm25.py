@@ -0,0 +1,218 @@
+"""
+BM25 over jieba tokens: a local lexical relevance model, no LLM call.
+
+``grade_documents`` scores retrieved documents against the question with it
+and drops those sharing too little with the question before the prompt is
+built. Scores are normalised by the best score the question could reach
+(every term present at its best saturation), so one threshold works for
+short and long questions alike.
+
+``InvertedIndex`` is the same model over the whole knowledge base, built by
+``scripts/build_index.py`` next to the vector index: users quote classical
+text verbatim (潜龙，勿用), which exact term matches find and embeddings
+often do not (see app.core.rag for how the two are fused).
+"""
+import bisect
+import logging
+import math
+import os
+import re
+from array import array
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Sequence
+
+import jieba
+import numpy as np
+
+from app.core.text import to_simplified
+from app.core.vector_index import top_k
+
+INDEX_SUFFIX = ".bm25.npz"
+
+# Okapi BM25 parameters (term frequency saturation, length normalisation)
+K1 = 1.5
+B = 0.75
+
+# Question filler that says nothing about the topic
+STOPWORDS = frozenset(
+    "的 了 是 在 和 与 及 或 吗 呢 吧 啊 呀 么 我 你 他 她 它 我们 你们 请 请问 一下 "
+    "什么 怎么 怎么样 怎样 如何 哪些 哪个 为什么 有 没有 可以 能 会 要 想 知道 告诉 这 那 这个 那个 "
+    "讲 讲讲 说 说说 介绍 解释".split()
+)
+_WORD = re.compile(r"\w")
+_CJK = re.compile(r"^[\u4e00-\u9fff]+$")
+
+jieba.setLogLevel(logging.WARNING)
+
+
+def warm():
+    """Load jieba's dictionary (about a second) ahead of the first question."""
+    jieba.initialize()
+
+
+def _is_term(word: str) -> bool:
+    return bool(_WORD.search(word)) and word not in STOPWORDS
+
+
+def keywords(text: str) -> List[str]:
+    """Simplified, lower-cased jieba words without punctuation and stopwords."""
+    return [w for w in jieba.lcut(to_simplified(text)) if _is_term(w)]
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    ``keywords`` plus the character bigrams of each run of adjacent Chinese keywords.
+
+    jieba does not segment the same words the same way in every context
+    (乾卦/象辞 in a question, 乾/卦象/辞 in 乾卦象辞), the bigrams still match.
+    """
+    terms: List[str] = []
+    run: List[str] = []
+    for word in jieba.lcut(to_simplified(text)):
+        if _is_term(word):
+            terms.append(word)
+        if _is_term(word) and _CJK.match(word):
+            run.append(word)
+        else:
+            terms.extend(_bigrams(run))
+            run = []
+    terms.extend(_bigrams(run))
+    return terms
+
+
+def _bigrams(run: List[str]) -> List[str]:
+    # Bigrams that are one of the run's words already are not counted twice
+    text = "".join(run)
+    return [text[i:i + 2] for i in range(len(text) - 1) if text[i:i + 2] not in run]
+
+
+class BM25:
+    """BM25 index over a handful of tokenised documents."""
+
+    def __init__(self, corpus: Sequence[List[str]]):
+        self.corpus = corpus
+        self.doc_len = [len(doc) for doc in corpus]
+        self.avgdl = (sum(self.doc_len) / len(corpus)) if corpus else 0.0
+        self.term_freqs = [Counter(doc) for doc in corpus]
+        df: Counter = Counter()
+        for tf in self.term_freqs:
+            df.update(tf.keys())
+        n = len(corpus)
+        # Lucene's idf: never negative, even for terms in every document
+        self.idf: Dict[str, float] = {t: math.log(1 + (n - f + 0.5) / (f + 0.5)) for t, f in df.items()}
+        self._unseen_idf = math.log(1 + (n + 0.5) / 0.5)
+
+    def scores(self, query: List[str]) -> List[float]:
+        result = []
+        for tf, dl in zip(self.term_freqs, self.doc_len):
+            norm = K1 * (1 - B + B * dl / self.avgdl) if self.avgdl else K1
+            score = 0.0
+            for term in query:
+                f = tf.get(term)
+                if f:
+                    score += self.idf[term] * f * (K1 + 1) / (f + norm)
+            result.append(score)
+        return result
+
+    def relevance(self, query: List[str]) -> List[float]:
+        """Scores in [0, 1): the share of the best score ``query`` could reach."""
+        query = list(dict.fromkeys(query))
+        best = sum(self.idf.get(t, self._unseen_idf) * (K1 + 1) for t in query)
+        if not best:
+            return [0.0] * len(self.corpus)
+        return [s / best for s in self.scores(query)]
+
+
+class InvertedIndex:
+    """
+    BM25 postings of a whole corpus, in flat arrays.
+
+    The postings of term ``i`` are ``doc_ids[offsets[i]:offsets[i + 1]]`` with
+    their term frequencies in ``tfs``. Terms are kept sorted and looked up by
+    bisection, so loading builds no dict: it is a few array reads (saved
+    uncompressed with ``np.savez``) and one split of the newline-joined
+    vocabulary.
+    """
+
+    def __init__(self, terms: List[str], offsets: np.ndarray, doc_ids: np.ndarray, tfs: np.ndarray,
+                 doc_len: np.ndarray):
+        self.terms = terms
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_len = doc_len
+        n = len(doc_len)
+        df = np.diff(offsets)
+        self.idf = np.log(1 + (n - df + 0.5) / (df + 0.5)).astype(np.float32)
+        avgdl = float(doc_len.mean()) if n else 0.0
+        self._norm = (K1 * (1 - B + B * doc_len / avgdl) if avgdl else np.full(n, K1)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return len(self.doc_len)
+
+    @classmethod
+    def build(cls, corpus: Sequence[List[str]]) -> "InvertedIndex":
+        builder = PostingsBuilder()
+        for doc in corpus:
+            builder.add(doc)
+        return builder.build()
+
+    def save(self, path: str):
+        """Write ``path``.bm25.npz, atomically."""
+        terms = self.terms
+        with open(path + INDEX_SUFFIX + ".tmp", "wb") as f:
+            np.savez(
+                f,
+                terms=np.frombuffer("\n".join(terms).encode("utf-8"), dtype=np.uint8),
+                offsets=self.offsets,
+                doc_ids=self.doc_ids,
+                tfs=self.tfs,
+                doc_len=self.doc_len,
+            )
+        os.replace(path + INDEX_SUFFIX + ".tmp", path + INDEX_SUFFIX)
+
+    @classmethod
+    def load(cls, path: str) -> "InvertedIndex":
+        with np.load(path + INDEX_SUFFIX) as data:
+            raw = data["terms"].tobytes().decode("utf-8")
+            return cls(raw.split("\n") if raw else [], data["offsets"], data["doc_ids"], data["tfs"], data["doc_len"])
+
+    def top(self, query: List[str], k: int, rows: Optional[np.ndarray] = None):
+        """Row numbers and BM25 scores of the best ``k`` documents (of ``rows``) matching any query term."""
+        scores = np.zeros(len(self.doc_len), dtype=np.float32)
+        for term in dict.fromkeys(query):
+            i = bisect.bisect_left(self.terms, term)
+            if i == len(self.terms) or self.terms[i] != term:
+                continue
+            ids = self.doc_ids[self.offsets[i]:self.offsets[i + 1]]
+            tf = self.tfs[self.offsets[i]:self.offsets[i + 1]].astype(np.float32)
+            # A term appears once per document in its postings, so no duplicate ids here
+            scores[ids] += self.idf[i] * tf * (K1 + 1) / (tf + self._norm[ids])
+        candidates = np.flatnonzero(scores) if rows is None else rows[scores[rows] > 0]
+        order, best = top_k(scores[candidates], k)
+        return candidates[order], best
+
+
+class PostingsBuilder:
+    """Collects postings one document at a time, in compact arrays, for ``InvertedIndex``."""
+
+    def __init__(self):
+        self._doc_ids: Dict[str, array] = defaultdict(lambda: array("i"))
+        self._tfs: Dict[str, array] = defaultdict(lambda: array("H"))
+        self._doc_len = array("i")
+
+    def add(self, tokens: List[str]):
+        doc_id = len(self._doc_len)
+        for term, tf in Counter(tokens).items():
+            self._doc_ids[term].append(doc_id)
+            # Term frequencies past a few dozen add nothing under BM25 saturation
+            self._tfs[term].append(min(tf, 0xFFFF))
+        self._doc_len.append(len(tokens))
+
+    def build(self) -> InvertedIndex:
+        terms = sorted(self._doc_ids)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        np.cumsum([len(self._doc_ids[t]) for t in terms], out=offsets[1:])
+        doc_ids = np.concatenate([np.frombuffer(self._doc_ids[t], dtype=np.int32) for t in terms] or [np.zeros(0, np.int32)])
+        tfs = np.concatenate([np.frombuffer(self._tfs[t], dtype=np.uint16) for t in terms] or [np.zeros(0, np.uint16)])
+        return InvertedIndex(terms, offsets, doc_ids, tfs, np.array(self._doc_len, dtype=np.int32))
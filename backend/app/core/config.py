@@ -1,3 +1,5 @@
+from typing import Any, Dict, List
+
 from pydantic_settings import BaseSettings
 
 class Settings(BaseSettings):
@@ -18,6 +20,144 @@ class Settings(BaseSettings):
     
     OPENAI_API_KEY: str = ""
 
+    # LLM provider (OpenAI-compatible endpoint)
+    LLM_PROVIDER: str = "dashscope"
+    LLM_MODEL: str = "qwen-max"
+    LLM_API_BASE: str = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+    # From the environment or .env; empty falls back to OPENAI_API_KEY
+    LLM_API_KEY: str = ""
+    LLM_MAX_RETRIES: int = 2
+    LLM_REQUEST_TIMEOUT_SECONDS: float = 60.0
+    # Shared keep-alive HTTP pool
+    LLM_POOL_MAX_CONNECTIONS: int = 100
+    LLM_POOL_MAX_KEEPALIVE: int = 20
+    LLM_POOL_KEEPALIVE_SECONDS: float = 30.0
+    # Admission control per provider
+    LLM_MAX_IN_FLIGHT: int = 16
+    LLM_MAX_QUEUE: int = 64
+    LLM_QUEUE_TIMEOUT_SECONDS: float = 30.0
+    # Extra OpenAI-compatible backends, tried in order after the one above.
+    # JSON list of {"name", "api_base", "api_key", "model"}; empty = single backend.
+    # {"kind": "fake", ...} entries take FakeChatModel fields (app.core.fake_llm)
+    LLM_BACKENDS: List[Dict[str, Any]] = []
+    # Hedging: race a second backend when the first token is later than the primary's p95
+    LLM_HEDGE_ENABLED: bool = True
+    LLM_HEDGE_PERCENTILE: float = 95.0
+    LLM_HEDGE_MIN_SAMPLES: int = 20
+    LLM_HEDGE_DEFAULT_DELAY_SECONDS: float = 2.0
+    LLM_HEDGE_MIN_DELAY_SECONDS: float = 0.2
+    LLM_LATENCY_WINDOW: int = 200
+    # Failover: skip a backend whose recent error rate crosses the threshold
+    LLM_FAILOVER_ERROR_RATE: float = 0.5
+    LLM_FAILOVER_WINDOW: int = 20
+    LLM_FAILOVER_MIN_REQUESTS: int = 5
+    LLM_FAILOVER_COOLDOWN_SECONDS: float = 30.0
+    # Starting guess for answer length, refined per backend; used for the tokens-saved metric
+    LLM_EXPECTED_COMPLETION_TOKENS: int = 400
+    # Offline stand-in used when LLM_PROVIDER=fake (load tests, local development)
+    FAKE_LLM_TTFT_MS: float = 300.0
+    FAKE_LLM_TOKENS_PER_SECOND: float = 50.0
+    FAKE_LLM_ANSWER_TOKENS: int = 200
+    FAKE_LLM_FAILURE_RATE: float = 0.0
+    FAKE_LLM_FAILURE_MODE: str = "before_first_token"
+    FAKE_LLM_SEED: int = 0
+    # Prompt size: token budget per model (question + retrieved context + template)
+    LLM_PROMPT_TOKEN_BUDGET: int = 3000
+    LLM_PROMPT_TOKEN_BUDGETS: Dict[str, int] = {}
+    # "estimate" (offline) or a tiktoken encoding name available locally
+    CONTEXT_TOKENIZER: str = "estimate"
+
+    # Per-session conversation memory ("memory" or "redis", which uses REDIS_URL)
+    SESSION_MEMORY_ENABLED: bool = True
+    SESSION_STORE: str = "memory"
+    SESSION_MAX_SESSIONS: int = 10000
+    SESSION_IDLE_TTL_SECONDS: int = 1800
+    # Recent turns kept verbatim; older ones are folded into a rolling summary
+    SESSION_WINDOW_TURNS: int = 6
+    SESSION_HISTORY_TOKEN_BUDGET: int = 800
+    SESSION_SUMMARY_TOKEN_BUDGET: int = 300
+    # "extractive" (local) or "llm"
+    SESSION_SUMMARY_MODE: str = "extractive"
+
+    # /chat/batch: questions per request, default and maximum parallel graph runs
+    BATCH_MAX_ITEMS: int = 500
+    BATCH_CONCURRENCY: int = 4
+    BATCH_MAX_CONCURRENCY: int = 16
+
+    # Answer cache in front of the agent graph
+    ANSWER_CACHE_ENABLED: bool = True
+    ANSWER_CACHE_MAX_ENTRIES: int = 2048
+    ANSWER_CACHE_TTL_SECONDS: int = 3600
+    # Cosine threshold of the semantic tier; it only runs with a model EMBEDDING_MODEL, never on hashing
+    ANSWER_CACHE_SIMILARITY: float = 0.95
+
+    # Chat SSE stream: "compact" filters events at the source and batches tokens
+    SSE_STREAM_MODE: str = "compact"
+    SSE_COALESCE_WINDOW_MS: int = 50
+    SSE_COALESCE_MAX_BYTES: int = 1024
+    SSE_KEEPALIVE_SECONDS: int = 10
+    # Resumable streams: frames are checkpointed to SQLite and replayed on Last-Event-ID
+    SSE_RESUME_DB: str = "./sse_checkpoints.db"
+    SSE_RESUME_TTL_SECONDS: int = 120
+    SSE_CHECKPOINT_INTERVAL_MS: int = 100
+    # A run nobody has listened to for this long (client gone, no resume) is cancelled
+    SSE_ABANDON_GRACE_SECONDS: float = 5.0
+
+    # Deadlines: whole non-streaming request, and per graph node
+    CHAT_TIMEOUT_SECONDS: float = 90.0
+    NODE_RETRIEVE_TIMEOUT_SECONDS: float = 10.0
+    NODE_GENERATE_TIMEOUT_SECONDS: float = 60.0
+    NODE_TOOL_TIMEOUT_SECONDS: float = 5.0
+
+    # Native tool calling on the LLM path: the model may call the tools, all calls
+    # of a turn run concurrently and are answered in this many follow-up turns at most
+    LLM_TOOL_CALLING_ENABLED: bool = True
+    LLM_MAX_TOOL_ROUNDS: int = 1
+
+    # Knowledge base index written by scripts/build_index.py (<path>.npy + <path>.meta.json),
+    # memory-mapped by every worker; documents returned per retrieval
+    RAG_INDEX_PATH: str = "./storage/classics"
+    RAG_TOP_K: int = 4
+    # Hybrid retrieval: BM25 (<path>.bm25.npz) and vector candidates each, merged by
+    # reciprocal rank fusion with this rank constant
+    RAG_HYBRID_ENABLED: bool = True
+    RAG_HYBRID_CANDIDATES: int = 20
+    RAG_RRF_K: int = 60
+    # Embedding model of the index and of queries (app.core.embeddings): a sentence-transformers
+    # model name or directory, or "hashing" for the model-free HashingEmbedder (offline builds, tests).
+    # An index built with another embedder is not loaded
+    EMBEDDING_MODEL: str = "BAAI/bge-m3"
+    # torch device for the model ("cpu", "cuda"); empty picks one
+    EMBEDDING_DEVICE: str = ""
+    # How the model runs: "torch" (full precision), or its ONNX export in EMBEDDING_ONNX_DIR
+    # (scripts/export_onnx.py) on ONNX Runtime, "onnx" (full precision) or "onnx-int8"
+    EMBEDDING_BACKEND: str = "torch"
+    EMBEDDING_ONNX_DIR: str = "./storage/bge-m3-onnx"
+    # Micro-batch concurrent query embeddings (app.core.embedding_service): a batch closes
+    # at this many queries or after this window. A model's forward pass costs about the same
+    # for one query as for a few dozen; with EMBEDDING_MODEL=hashing (~20us a query, less than
+    # the hand-off to the batch thread) turn it off
+    EMBED_BATCH_ENABLED: bool = True
+    EMBED_BATCH_MAX_SIZE: int = 32
+    EMBED_BATCH_WINDOW_MS: float = 2.0
+    # Query vector and retrieval result caches (app.core.retrieval_cache): LRUs of this many
+    # entries each in front of a SQLite file (default <RAG_INDEX_PATH>.cache.db), emptied
+    # whenever an index with a different corpus version is loaded
+    RAG_CACHE_ENABLED: bool = True
+    RAG_CACHE_MAX_ENTRIES: int = 4096
+    RAG_CACHE_MAX_DISK_ENTRIES: int = 100000
+    RAG_CACHE_DB: str = ""
+
+    # Relevance grading of retrieved documents (BM25 over jieba tokens, see app.core.bm25):
+    # documents below this share of the question's best score are dropped; when none
+    # is left the question is rewritten and retrieved again at most this many times
+    GRADER_ENABLED: bool = True
+    GRADER_MIN_RELEVANCE: float = 0.1
+    RETRIEVAL_MAX_REWRITES: int = 1
+
+    # Parallel graph branches (retrieval plus one per tool intent) running at once per request
+    GRAPH_MAX_CONCURRENCY: int = 4
+
     class Config:
         env_file = ".env"
 
@@ -0,0 +1,92 @@
+"""
+Token-budgeted context packing for RAG prompts.
+
+Retrieved documents keep the retriever's order (dense and BM25 ranks fused
+by RRF, see ``app.core.rag``), duplicates (after normalisation, or wholly
+contained in a better-ranked document) are dropped, and the rest fill the
+model's prompt budget in that order. A document that does not fit is cut at
+the last sentence boundary that does.
+"""
+import re
+from dataclasses import dataclass
+from typing import List
+
+from app.core.config import settings
+from app.core.text import normalize_text
+from app.core.tokens import count_tokens
+
+SEPARATOR = "\n"
+
+# Split after sentence-ending punctuation (full- or half-width) and line breaks
+_SENTENCE_END = re.compile(r"(?<=[。！？；!?;\n])|(?<=\.)\s+")
+
+# Truncated tails shorter than this are not worth a slot in the prompt
+MIN_TRUNCATED_TOKENS = 16
+
+
+@dataclass
+class PackedContext:
+    text: str
+    tokens: int
+    documents: int
+    dropped: int
+    truncated: bool
+
+
+def prompt_budget(model: str) -> int:
+    """Total prompt token budget for ``model``."""
+    return settings.LLM_PROMPT_TOKEN_BUDGETS.get(model, settings.LLM_PROMPT_TOKEN_BUDGET)
+
+
+def dedupe_documents(documents: List[str]) -> List[str]:
+    kept, keys = [], []
+    for doc in documents:
+        key = normalize_text(doc)
+        if not key or any(key in other for other in keys):
+            continue
+        kept.append(doc)
+        keys.append(key)
+    return kept
+
+
+def truncate_to_sentences(text: str, budget: int) -> str:
+    """Longest prefix of whole sentences within ``budget`` tokens."""
+    out, used = [], 0
+    for sentence in _SENTENCE_END.split(text):
+        if not sentence:
+            continue
+        tokens = count_tokens(sentence)
+        if used + tokens > budget:
+            break
+        out.append(sentence)
+        used += tokens
+    return "".join(out).strip()
+
+
+def pack_context(documents: List[str], budget: int) -> PackedContext:
+    """Fill up to ``budget`` tokens with the best distinct documents, ``documents`` being best first."""
+    candidates = dedupe_documents(documents)
+    sep_tokens = count_tokens(SEPARATOR)
+    parts, used, truncated = [], 0, False
+    for doc in candidates:
+        remaining = budget - used - (sep_tokens if parts else 0)
+        if remaining <= 0:
+            break
+        tokens = count_tokens(doc)
+        if tokens > remaining:
+            if remaining < MIN_TRUNCATED_TOKENS:
+                continue
+            doc = truncate_to_sentences(doc, remaining)
+            if not doc:
+                continue
+            tokens = count_tokens(doc)
+            truncated = True
+        used += tokens + (sep_tokens if parts else 0)
+        parts.append(doc)
+    return PackedContext(
+        text=SEPARATOR.join(parts),
+        tokens=used,
+        documents=len(parts),
+        dropped=len(documents) - len(parts),
+        truncated=truncated,
+    )
@@ -0,0 +1,28 @@
+"""
+Corpus version of a knowledge base index.
+
+A build publishes ``<path>.version`` last (app.core.index_builder); serving
+code (app.core.rag, and through it app.core.retrieval_cache) reads it here
+without depending on the builder.
+"""
+import os
+
+from app.core.vector_index import META_SUFFIX
+
+VERSION_SUFFIX = ".version"
+
+
+def corpus_version(path: str) -> str:
+    """
+    Identifies the corpus of the index at ``path``: the version a build
+    published (the metadata digest, so a rebuild that changes nothing keeps
+    it), or the metadata file's size and mtime for an index written otherwise.
+    """
+    meta = os.stat(path + META_SUFFIX)
+    try:
+        if os.stat(path + VERSION_SUFFIX).st_mtime_ns >= meta.st_mtime_ns:
+            with open(path + VERSION_SUFFIX, encoding="utf-8") as f:
+                return f.read().strip()
+    except FileNotFoundError:
+        pass
+    return f"{meta.st_size:x}-{meta.st_mtime_ns:x}"
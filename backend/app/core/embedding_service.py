@@ -0,0 +1,110 @@
+"""
+Micro-batched query embedding.
+
+Retrieval embeds one query per request, from many threads at once (graph
+nodes run ``retrieve_documents`` through ``asyncio.to_thread``). With a model
+behind the embedder a forward pass costs about the same for one text as for
+a few dozen, so ``EmbeddingService`` queues concurrent ``embed`` calls and
+embeds them together on its own thread: the first queued text opens a batch,
+which closes when it holds ``max_batch`` texts or ``max_wait_ms`` has passed.
+Callers block on (or, on the event loop, await) a future for their row.
+
+A window of 0 still batches whatever queued while the previous batch was
+embedding, without waiting for more; that is the right setting when the
+embedder is as cheap as ``HashingEmbedder``. Any object with ``dim`` and
+``embed_batch`` can sit behind the service.
+"""
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import List, Optional
+
+import numpy as np
+
+from app.core.metrics import EMBED_BATCH_SIZE
+
+_STOP = object()
+
+
+class EmbeddingService:
+    def __init__(self, embedder, max_batch: int = 32, max_wait_ms: float = 2.0):
+        self.embedder = embedder
+        self.dim = embedder.dim
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000
+        self._queue: "queue.SimpleQueue" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def submit(self, text: str) -> Future:
+        future: Future = Future()
+        with self._lock:
+            closed = self._closed
+            if not closed:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="embedding-service", daemon=True)
+                    self._thread.start()
+                self._queue.put((text, future))
+        if closed:
+            # A caller still holding a replaced service: embed unbatched
+            future.set_result(self.embedder.embed_batch([text])[0])
+        return future
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.submit(text).result()
+
+    async def aembed(self, text: str) -> np.ndarray:
+        return await asyncio.wrap_future(self.submit(text))
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        # Already a batch: straight to the embedder
+        return self.embedder.embed_batch(texts)
+
+    def close(self):
+        """Embed what is queued, then stop the batching thread."""
+        with self._lock:
+            self._closed = True
+            thread = self._thread
+            if thread is not None:
+                self._queue.put(_STOP)
+        if thread is not None:
+            thread.join()
+
+    def _collect(self, first) -> tuple:
+        """The batch opened by ``first``, and whether the service was stopped meanwhile."""
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self):
+        stopped = False
+        while not stopped:
+            first = self._queue.get()
+            if first is _STOP:
+                break
+            batch, stopped = self._collect(first)
+            # Callers that gave up (cancelled futures) are left out of the forward pass
+            batch = [(text, future) for text, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            EMBED_BATCH_SIZE.observe(len(batch))
+            try:
+                vectors = self.embedder.embed_batch([text for text, _ in batch])
+            except Exception as exc:
+                for _, future in batch:
+                    future.set_exception(exc)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
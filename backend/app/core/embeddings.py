@@ -0,0 +1,226 @@
+"""
+Text embedders. Every embedder has a ``name`` and a ``backend`` (both
+recorded in index metadata, queries must be embedded the same way), a
+``dim``, ``embed`` and ``embed_batch`` returning L2-normalised float32 rows.
+
+The knowledge base index is embedded with a local neural model,
+BAAI/bge-m3 by default, with PyTorch (``SentenceTransformerEmbedder``) or
+ONNX Runtime at full precision or int8 (``OnnxEmbedder``). ``HashingEmbedder``
+needs no model and stays for near-duplicate question matching, and as the
+explicit ``EMBEDDING_MODEL=hashing`` opt-in for offline builds and tests.
+"""
+import json
+import os
+import threading
+import zlib
+from typing import List, Optional
+
+import numpy as np
+
+HASHING = "hashing"
+
+
+class HashingEmbedder:
+    """
+    Lightweight local text embedder: character unigrams and bigrams hashed
+    into a fixed number of buckets, L2-normalised.
+
+    It needs no model download and is stable across processes (crc32, not
+    Python's randomised ``hash``), which makes it suitable for near-duplicate
+    question matching and as an offline stand-in for a neural embedder.
+    """
+
+    name = HASHING
+    backend = HASHING
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def embed(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for gram in self._ngrams(text):
+            vec[zlib.crc32(gram.encode("utf-8")) % self.dim] += 1.0
+        norm = np.linalg.norm(vec)
+        if norm > 0:
+            vec /= norm
+        return vec
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return np.stack([self.embed(t) for t in texts])
+
+    @staticmethod
+    def _ngrams(text: str):
+        yield from text
+        for i in range(len(text) - 1):
+            yield text[i:i + 2]
+
+
+class _LocalModel:
+    """Lazily loaded model state (``_LOADED`` attributes) that is dropped when pickled."""
+
+    _LOADED: tuple = ()
+
+    def __init__(self, name: str):
+        self.name = name
+        for attr in self._LOADED:
+            setattr(self, attr, None)
+        self._lock = threading.Lock()
+
+    def _missing(self, package: str) -> ImportError:
+        return ImportError(
+            f"embedding model {self.name} ({self.backend}) needs {package} "
+            f"(pip install {package}), or use the {HASHING} embedder"
+        )
+
+    def embed(self, text: str) -> np.ndarray:
+        return self.embed_batch([text])[0]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        for attr in self._LOADED:
+            state[attr] = None
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+
+class SentenceTransformerEmbedder(_LocalModel):
+    """
+    A local sentence-transformers model (PyTorch), full precision: for
+    BAAI/bge-m3 the dense CLS embedding, 1024 dimensions.
+
+    The model is loaded on first use, from the Hugging Face cache (or hub)
+    or a local directory, and is not pickled: index build workers each load
+    their own copy.
+    """
+
+    backend = "torch"
+    _LOADED = ("_model",)
+
+    def __init__(self, model_name: str, device: Optional[str] = None, batch_size: int = 32):
+        super().__init__(model_name)
+        self.device = device or None
+        self.batch_size = batch_size
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    try:
+                        from sentence_transformers import SentenceTransformer
+                    except ImportError as e:
+                        raise self._missing("sentence-transformers") from e
+                    self._model = SentenceTransformer(self.name, device=self.device)
+        return self._model
+
+    @property
+    def dim(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        vectors = self.model.encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True,
+            convert_to_numpy=True, show_progress_bar=False,
+        )
+        return np.asarray(vectors, dtype=np.float32)
+
+
+class OnnxEmbedder(_LocalModel):
+    """
+    The same model exported to ONNX (``scripts/export_onnx.py``) and run on
+    CPU by ONNX Runtime: ``model.onnx`` at full precision, or with
+    ``quantized`` the dynamically int8-quantised ``model_quantized.onnx``.
+
+    Vectors are the CLS token's last hidden state, L2-normalised, like the
+    sentence-transformers model's. int8 vectors only approximate the
+    full-precision ones; ``benchmarks/bench_embedding_service.py`` measures
+    their cosine agreement and top-k overlap before an index is served with
+    them.
+    """
+
+    _LOADED = ("_session", "_tokenizer", "_inputs")
+    MODEL_FILES = {False: "model.onnx", True: "model_quantized.onnx"}
+
+    def __init__(self, name: str, model_dir: str, quantized: bool = False, batch_size: int = 32,
+                 max_length: int = 8192):
+        super().__init__(name)
+        self.model_dir = model_dir
+        self.quantized = quantized
+        self.batch_size = batch_size
+        # bge-m3's limit, as sentence-transformers truncates
+        self.max_length = max_length
+        with open(os.path.join(model_dir, "config.json"), encoding="utf-8") as f:
+            config = json.load(f)
+        self.dim = int(config["hidden_size"])
+        self.pad_id = int(config.get("pad_token_id") or 0)
+
+    @property
+    def backend(self) -> str:
+        return "onnx-int8" if self.quantized else "onnx"
+
+    def _load(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    try:
+                        import onnxruntime
+                        from tokenizers import Tokenizer
+                    except ImportError as e:
+                        raise self._missing("onnxruntime") from e
+                    tokenizer = Tokenizer.from_file(os.path.join(self.model_dir, "tokenizer.json"))
+                    tokenizer.enable_truncation(self.max_length)
+                    tokenizer.enable_padding(pad_id=self.pad_id, pad_token=tokenizer.id_to_token(self.pad_id))
+                    session = onnxruntime.InferenceSession(
+                        os.path.join(self.model_dir, self.MODEL_FILES[self.quantized]),
+                        providers=["CPUExecutionProvider"],
+                    )
+                    self._inputs = {i.name for i in session.get_inputs()}
+                    self._tokenizer, self._session = tokenizer, session
+
+    def embed_batch(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        self._load()
+        vectors = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self._tokenizer.encode_batch(texts[start:start + self.batch_size])
+            ids = np.array([e.ids for e in encodings], dtype=np.int64)
+            feed = {"input_ids": ids, "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64)}
+            if "token_type_ids" in self._inputs:
+                feed["token_type_ids"] = np.zeros_like(ids)
+            hidden = self._session.run(["last_hidden_state"], feed)[0]
+            vectors[start:start + len(ids)] = hidden[:, 0]
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+
+
+def load_embedder(name: str, dim: int = 512, device: Optional[str] = None, backend: str = "torch",
+                  onnx_dir: str = ""):
+    """
+    The embedder called ``name``: ``HASHING`` (with ``dim`` buckets), or the
+    model run by ``backend``: PyTorch via sentence-transformers, or its ONNX
+    export in ``onnx_dir`` at full precision or int8.
+    """
+    if name == HASHING:
+        return HashingEmbedder(dim)
+    if backend == "torch":
+        return SentenceTransformerEmbedder(name, device=device)
+    if backend in ("onnx", "onnx-int8"):
+        return OnnxEmbedder(name, onnx_dir, quantized=backend == "onnx-int8")
+    raise ValueError(f"unknown embedding backend {backend!r}, expected one of {', '.join(BACKENDS)}")
+
+
+def backend_of(name: str, backend: str) -> str:
+    """The ``backend`` of ``load_embedder(name, backend=backend)``, without loading it."""
+    return HASHING if name == HASHING else backend
@@ -0,0 +1,97 @@
+"""
+Offline stand-ins for the LLM.
+
+``FakeChatModel`` is selected with ``LLM_PROVIDER=fake`` (or ``"kind": "fake"``
+in an ``LLM_BACKENDS`` entry). It runs behind the same gates, hedging and
+metrics as a real backend, so the whole chat path can be load-tested without
+spending provider quota. Its answers are deterministic per prompt; latency
+follows a configured time-to-first-token and token rate, and a seeded
+fraction of calls fail before the first token or midway through the stream.
+"""
+import asyncio
+import random
+import time
+import zlib
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+
+# Answers are cut from this text, one character per token
+FAKE_CORPUS = (
+    "乾为天，元亨利贞。初九，潜龙勿用。九二，见龙在田，利见大人。九三，君子终日乾乾，夕惕若厉，无咎。"
+    "九四，或跃在渊，无咎。九五，飞龙在天，利见大人。上九，亢龙有悔。用九，见群龙无首，吉。"
+    "坤为地，元亨，利牝马之贞。君子有攸往，先迷后得主，利西南得朋，东北丧朋，安贞吉。"
+)
+
+FAILURE_MODES = ("before_first_token", "midstream")
+
+
+class FakeLLMError(RuntimeError):
+    """Injected failure."""
+
+
+class FakeChatModel(BaseChatModel):
+    """Deterministic streaming chat model with configurable latency and failures."""
+
+    answer_tokens: int = 200
+    first_token_delay: float = 0.3
+    tokens_per_second: float = 50.0
+    failure_rate: float = 0.0
+    failure_mode: str = "before_first_token"
+    seed: int = 0
+
+    _rng: random.Random = PrivateAttr()
+
+    def model_post_init(self, __context):
+        if self.failure_mode not in FAILURE_MODES:
+            raise ValueError(f"failure_mode must be one of {FAILURE_MODES}")
+        self._rng = random.Random(self.seed)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake"
+
+    def answer_for(self, messages) -> str:
+        """The answer for a prompt: same prompt, same answer."""
+        prompt = "".join(str(m.content) for m in messages)
+        start = zlib.crc32(prompt.encode("utf-8")) % len(FAKE_CORPUS)
+        text = FAKE_CORPUS[start:] + FAKE_CORPUS * (self.answer_tokens // len(FAKE_CORPUS) + 1)
+        return text[:self.answer_tokens]
+
+    def _failure_point(self) -> int:
+        """Token index at which this call fails, or -1."""
+        if self.failure_rate <= 0 or self._rng.random() >= self.failure_rate:
+            return -1
+        if self.failure_mode == "before_first_token":
+            return 0
+        return self._rng.randrange(1, max(2, self.answer_tokens))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        text = self.answer_for(messages)
+        fail_at = self._failure_point()
+        # Absolute schedule: token i is due at ttft + i / rate, so sleeps never drift
+        start = time.perf_counter() + self.first_token_delay
+        interval = 1.0 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        for i, ch in enumerate(text):
+            delay = start + i * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if i == fail_at:
+                raise FakeLLMError(f"injected failure at token {i}")
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=ch))
+            if run_manager:
+                await run_manager.on_llm_new_token(ch, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        text = "".join([c.text async for c in self._astream(messages, stop, run_manager, **kwargs)])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        fail_at = self._failure_point()
+        if fail_at >= 0:
+            raise FakeLLMError(f"injected failure at token {fail_at}")
+        time.sleep(self.first_token_delay + self.answer_tokens / max(self.tokens_per_second, 1e-9))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer_for(messages)))])
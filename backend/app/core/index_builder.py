@@ -0,0 +1,315 @@
+"""
+Incremental, content-addressed builds of the knowledge base index.
+
+Every chunk is identified by the SHA-256 of its text. A manifest written next
+to the index (``<path>.manifest.json``) records the hash, source and name of
+every row of ``<path>.npy``, the embedder and backend that produced them,
+and the measured embedding time per chunk. A rebuild embeds only chunks whose
+hash is not in the manifest, copies the vectors of the others from the
+current index, and leaves out rows whose chunk is gone. A vector is reused
+only for the same text, embedder, backend and dimension: switching, say,
+from torch to onnx-int8 re-embeds everything. The BM25 index is rebuilt from
+scratch every time.
+
+Documents are consumed as a stream, ``batch_size`` at a time. Each batch is
+tokenised for BM25 and its new chunks embedded, in a worker process when
+``workers`` > 0, and the results are appended to the index in bulk, in input
+order (``IndexWriter``), as they come back. At most ``max_in_flight``
+batches are outstanding, and with ``max_memory_mb`` set the RSS of this
+process and its workers is held under that budget: no new batch is submitted
+while over it, and in-process the batch size is halved (down to one chunk).
+Memory is bounded by the batches in flight plus the postings and per-row
+hashes, sources and names, whatever the corpus size.
+
+The manifest is written after the index and carries the digest of the
+metadata file it describes: after an interrupted build it no longer matches
+the index and the next build starts over. Last, ``<path>.version`` publishes
+the start of that digest as the corpus version (see ``app.core.corpus``).
+"""
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import Callable, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.core.bm25 import PostingsBuilder, tokenize, warm
+from app.core.corpus import VERSION_SUFFIX
+from app.core.vector_index import META_SUFFIX, VECTORS_SUFFIX, IndexWriter
+
+MANIFEST_SUFFIX = ".manifest.json"
+
+
+class MemoryBudgetExceeded(ValueError):
+    """``max_memory_mb`` is below what the build uses before it starts."""
+
+
+def content_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+@dataclass
+class BuildReport:
+    documents: int = 0
+    # Chunks through the pipeline so far (the progress count; ``documents`` once done)
+    written: int = 0
+    embedded: int = 0
+    reused: int = 0
+    removed: int = 0
+    # (source, name) pairs present before and after whose text changed
+    changed: List[tuple] = field(default_factory=list)
+    # Embedding time summed over workers, and wall time of the whole build
+    embed_seconds: float = 0.0
+    seconds: float = 0.0
+    # Estimate: reused chunks times the embedding time per chunk
+    saved_seconds: float = 0.0
+    # This process and its workers
+    peak_rss_mb: float = 0.0
+    dry_run: bool = False
+
+    def throughput(self) -> str:
+        seconds = max(self.seconds, 1e-9)
+        return (
+            f"{self.written} chunks, {self.written / seconds:.0f} chunks/s, "
+            f"{self.embedded / seconds:.0f} embeddings/s, RSS {rss_mb():.0f}MB"
+        )
+
+    def summary(self) -> str:
+        mode = "dry run: would embed" if self.dry_run else "embedded"
+        return (
+            f"{self.documents} chunks: {mode} {self.embedded} "
+            f"({len(self.changed)} changed), reused {self.reused}, removed {self.removed}; "
+            f"embedding {self.embed_seconds:.3f}s, saved ~{self.saved_seconds:.3f}s; "
+            f"{self.seconds:.2f}s wall, peak RSS {self.peak_rss_mb:.0f}MB"
+        )
+
+
+def rss_mb(pid="self") -> float:
+    """Resident set size of a process, this one by default, in MB (from /proc; 0 where unavailable)."""
+    try:
+        with open(f"/proc/{pid}/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+def tree_rss_mb() -> float:
+    """RSS of this process plus its live child processes (the pool workers)."""
+    return rss_mb() + sum(rss_mb(child.pid) for child in multiprocessing.active_children())
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _previous(path: str, embedder: str, backend: str, dim: int):
+    """(manifest, vectors) of the current index, or None when it cannot be reused."""
+    try:
+        with open(path + MANIFEST_SUFFIX, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("meta_sha256") != _file_digest(path + META_SUFFIX):
+            return None
+        if "source" not in manifest:
+            # Manifests from before the source/name columns were recorded
+            with open(path + META_SUFFIX, encoding="utf-8") as f:
+                meta = json.load(f)
+            manifest["source"], manifest["name"] = meta["source"], meta["name"]
+        vectors = np.load(path + VECTORS_SUFFIX, mmap_mode="r")
+    except (FileNotFoundError, ValueError):
+        return None
+    hashes = manifest.get("hashes", [])
+    if (manifest.get("embedder"), manifest.get("backend"), manifest.get("dim")) != (embedder, backend, dim):
+        return None
+    if len(hashes) != len(vectors):
+        return None
+    return manifest, vectors
+
+
+# Set once per worker process by the pool initializer, not sent with every batch
+_worker_embedder = None
+
+
+def _init_worker(embedder):
+    global _worker_embedder
+    _worker_embedder = embedder
+    warm()
+
+
+def _process_batch(texts: List[str], embed: List[bool], embedder=None):
+    """BM25 tokens of every text, vectors of the ``embed`` ones, and the embedding time."""
+    embedder = embedder or _worker_embedder
+    tokens = [tokenize(text) for text in texts]
+    selected = [text for text, flag in zip(texts, embed) if flag]
+    start = time.perf_counter()
+    vectors = embedder.embed_batch(selected) if selected else np.zeros((0, embedder.dim), dtype=np.float32)
+    return tokens, vectors, time.perf_counter() - start
+
+
+def build(path: str, documents: Iterable[Dict], embedder, embedder_name: str,
+          dry_run: bool = False, full: bool = False, batch_size: int = 256, workers: int = 0,
+          max_in_flight: Optional[int] = None, max_memory_mb: Optional[float] = None,
+          progress: Optional[Callable[[BuildReport], None]] = None) -> BuildReport:
+    """
+    Bring the index at ``path`` up to date with ``documents`` (dicts with text, source, name).
+
+    ``full`` ignores the manifest and embeds everything; ``dry_run`` only
+    reports what a build would do. ``workers`` > 0 tokenises and embeds in
+    that many processes (``embedder`` must pickle); 0 works in-process.
+    ``progress`` is called with the running report after every batch.
+    Raises MemoryBudgetExceeded when ``max_memory_mb`` is already exceeded before the
+    first batch (by the loaded model, say): no throttling can honour it.
+    """
+    start = time.perf_counter()
+    previous = None if full else _previous(path, embedder_name, embedder.backend, embedder.dim)
+    manifest, old_vectors = previous if previous is not None else ({}, None)
+    old_rows: Dict[str, int] = {h: row for row, h in enumerate(manifest.get("hashes", []))}
+    seconds_per_chunk: Optional[float] = manifest.get("seconds_per_chunk")
+
+    report = BuildReport(dry_run=dry_run, peak_rss_mb=tree_rss_mb())
+    if max_memory_mb is not None and report.peak_rss_mb > max_memory_mb:
+        raise MemoryBudgetExceeded(
+            f"max_memory_mb={max_memory_mb:g} is below the {report.peak_rss_mb:.0f}MB in use before the first batch"
+        )
+    hashes: List[str] = []
+    # Row of the first new chunk with each text; later duplicates copy its vector
+    fresh_rows: Dict[str, int] = {}
+    added_keys = set()
+
+    def plan(batch: List[Dict]) -> List[tuple]:
+        """Where each document's vector comes from: ("old", row), ("dup", row) or ("new", None)."""
+        origins = []
+        for doc in batch:
+            h = content_hash(doc["text"])
+            if h in old_rows:
+                origins.append(("old", old_rows[h]))
+                report.reused += 1
+            elif h in fresh_rows:
+                origins.append(("dup", fresh_rows[h]))
+            else:
+                fresh_rows[h] = len(hashes)
+                origins.append(("new", None))
+                report.embedded += 1
+                added_keys.add((doc["source"], doc["name"]))
+            hashes.append(h)
+        report.documents += len(batch)
+        return origins
+
+    def sample_memory() -> float:
+        rss = tree_rss_mb()
+        report.peak_rss_mb = max(report.peak_rss_mb, rss)
+        return rss
+
+    def tick():
+        sample_memory()
+        if progress is not None:
+            report.seconds = time.perf_counter() - start
+            progress(report)
+
+    stream = iter(documents)
+    batches = iter(lambda: list(islice(stream, batch_size)), [])
+    if dry_run:
+        for batch in batches:
+            plan(batch)
+            report.written += len(batch)
+            tick()
+    else:
+        writer = IndexWriter(path, embedder.dim, embedder_name, embedder.backend)
+        postings = PostingsBuilder()
+
+        def write(batch: List[Dict], origins: List[tuple], result):
+            tokens, fresh, seconds = result
+            report.embed_seconds += seconds
+            first = writer.count
+            rows = np.empty((len(batch), embedder.dim), dtype=np.float32)
+            fresh = iter(fresh)
+            for i, (kind, row) in enumerate(origins):
+                if kind == "new":
+                    rows[i] = next(fresh)
+                elif kind == "old":
+                    # Copied out of the old mapping before close() replaces the file
+                    rows[i] = old_vectors[row]
+                else:
+                    rows[i] = rows[row - first] if row >= first else writer.row(row)
+            writer.add(rows, [d["text"] for d in batch], [d["source"] for d in batch], [d["name"] for d in batch])
+            for doc_tokens in tokens:
+                postings.add(doc_tokens)
+            report.written += len(batch)
+            tick()
+
+        pool = ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(embedder,)) if workers else None
+        max_in_flight = max_in_flight or 2 * max(workers, 1)
+        in_flight: deque = deque()
+        try:
+            for batch in batches:
+                origins = plan(batch)
+                texts = [d["text"] for d in batch]
+                embed = [kind == "new" for kind, _ in origins]
+                if pool is None:
+                    write(batch, origins, _process_batch(texts, embed, embedder))
+                    if max_memory_mb is not None and batch_size > 1 and sample_memory() > max_memory_mb:
+                        # Fewer texts, tokens and vectors held at once; read by ``batches`` for the next one
+                        batch_size = max(1, batch_size // 2)
+                    continue
+                # Results are written in submission order: drain the oldest while at capacity
+                while in_flight and (
+                    len(in_flight) >= max_in_flight
+                    or (max_memory_mb is not None and sample_memory() > max_memory_mb)
+                ):
+                    done_batch, done_origins, future = in_flight.popleft()
+                    write(done_batch, done_origins, future.result())
+                in_flight.append((batch, origins, pool.submit(_process_batch, texts, embed)))
+            while in_flight:
+                done_batch, done_origins, future = in_flight.popleft()
+                write(done_batch, done_origins, future.result())
+        except BaseException:
+            writer.abort()
+            raise
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+
+    current = set(hashes)
+    removed_keys = Counter(
+        (manifest["source"][row], manifest["name"][row]) for h, row in old_rows.items() if h not in current
+    )
+    report.removed = sum(removed_keys.values())
+    report.changed = sorted(added_keys & set(removed_keys))
+    if report.embedded and not dry_run:
+        seconds_per_chunk = report.embed_seconds / report.embedded
+    report.saved_seconds = report.reused * (seconds_per_chunk or 0.0)
+    if dry_run:
+        report.seconds = time.perf_counter() - start
+        return report
+
+    writer.close()
+    postings.build().save(path)
+    meta_digest = _file_digest(path + META_SUFFIX)
+    with open(path + MANIFEST_SUFFIX + ".tmp", "w", encoding="utf-8") as f:
+        json.dump({
+            "embedder": embedder_name,
+            "backend": embedder.backend,
+            "dim": embedder.dim,
+            "seconds_per_chunk": seconds_per_chunk,
+            "meta_sha256": meta_digest,
+            "hashes": hashes,
+            "source": writer.sources,
+            "name": writer.names,
+        }, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(path + MANIFEST_SUFFIX + ".tmp", path + MANIFEST_SUFFIX)
+    # Published last: retrieval caches keyed on the previous version stop matching
+    with open(path + VERSION_SUFFIX + ".tmp", "w", encoding="utf-8") as f:
+        f.write(meta_digest[:16])
+    os.replace(path + VERSION_SUFFIX + ".tmp", path + VERSION_SUFFIX)
+    sample_memory()
+    report.seconds = time.perf_counter() - start
+    return report
@@ -0,0 +1,529 @@
+"""
+Managed LLM client layer.
+
+All chat models share one keep-alive HTTP connection pool, and every call to
+a provider goes through that provider's ``LLMGate``: at most
+``LLM_MAX_IN_FLIGHT`` concurrent requests, a bounded FIFO wait queue behind
+them, and early rejection (``LLMOverloaded``) once the queue is full or a
+caller has waited too long. Callers can observe their queue position, which
+the chat stream forwards to clients as status events.
+
+Several OpenAI-compatible backends can be configured (``LLM_BACKENDS``).
+``HedgedChatModel`` streams from the first healthy one; if its first token is
+later than that backend's recent p95 it races a hedged request on the next
+backend and cancels whichever loses. Backends failing before their first
+token are failed over, and a backend whose recent error rate crosses
+``LLM_FAILOVER_ERROR_RATE`` is skipped until its cooldown expires.
+"""
+import asyncio
+import contextvars
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import httpx
+import numpy as np
+from langchain_core.callbacks import adispatch_custom_event
+from langchain_core.language_models.chat_models import BaseChatModel, agenerate_from_stream
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.utils.function_calling import convert_to_openai_tool
+from langchain_openai import ChatOpenAI
+from pydantic import ConfigDict
+
+from app.core.config import settings
+from app.core.metrics import (
+    LLM_INFLIGHT, LLM_QUEUE_DEPTH, LLM_QUEUE_WAIT_SECONDS, LLM_ADMISSION_REJECTED,
+    LLM_FIRST_TOKEN_SECONDS, LLM_TOKENS_PER_SECOND, LLM_HEDGES, LLM_FAILOVERS, LLM_BACKEND_ERRORS, LLM_BACKEND_HEALTHY,
+    LLM_CANCELLED, LLM_TOKENS_SAVED,
+)
+from app.core.tokens import count_tokens
+
+QueueListener = Callable[[int], Awaitable[None]]
+
+# Custom graph event carrying a caller's queue position
+LLM_QUEUE_EVENT = "llm_queue"
+
+
+class LLMOverloaded(Exception):
+    """Raised when a provider cannot admit another request."""
+
+    def __init__(self, provider: str, reason: str):
+        self.provider = provider
+        self.reason = reason
+        super().__init__(f"LLM provider '{provider}' is overloaded ({reason})")
+
+
+class LLMGate:
+    """Concurrency limit plus bounded FIFO wait queue for one provider."""
+
+    def __init__(self, provider: str, max_in_flight: int, max_queue: int, queue_timeout: float):
+        self.provider = provider
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._listeners: Dict[asyncio.Future, Tuple[QueueListener, contextvars.Context]] = {}
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def saturated(self) -> bool:
+        """True when a new request would be rejected right away."""
+        return self.in_flight >= self.max_in_flight and len(self._waiters) >= self.max_queue
+
+    @asynccontextmanager
+    async def slot(self, on_queued: Optional[QueueListener] = None):
+        await self.acquire(on_queued)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, on_queued: Optional[QueueListener] = None):
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self._admit()
+            return
+        if len(self._waiters) >= self.max_queue:
+            LLM_ADMISSION_REJECTED.labels(provider=self.provider, reason="queue_full").inc()
+            raise LLMOverloaded(self.provider, "queue_full")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        if on_queued:
+            # Position updates run in the waiting caller's context (its run, its trace)
+            self._listeners[waiter] = (on_queued, contextvars.copy_context())
+        LLM_QUEUE_DEPTH.labels(provider=self.provider).set(len(self._waiters))
+        start = time.perf_counter()
+        try:
+            if on_queued:
+                await on_queued(len(self._waiters))
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except asyncio.TimeoutError:
+            self._abandon(waiter)
+            LLM_ADMISSION_REJECTED.labels(provider=self.provider, reason="queue_timeout").inc()
+            raise LLMOverloaded(self.provider, "queue_timeout")
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        finally:
+            self._listeners.pop(waiter, None)
+            LLM_QUEUE_WAIT_SECONDS.labels(provider=self.provider).observe(time.perf_counter() - start)
+
+    def try_acquire(self) -> bool:
+        """Take a free slot without queueing; False when none is free."""
+        if self.in_flight < self.max_in_flight and not self._waiters:
+            self._admit()
+            return True
+        return False
+
+    def release(self):
+        self.in_flight -= 1
+        # Hand the slot straight to the next waiter so nobody can jump the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self.in_flight += 1
+                break
+        LLM_INFLIGHT.labels(provider=self.provider).set(self.in_flight)
+        LLM_QUEUE_DEPTH.labels(provider=self.provider).set(len(self._waiters))
+        self._notify_positions()
+
+    def _admit(self):
+        self.in_flight += 1
+        LLM_INFLIGHT.labels(provider=self.provider).set(self.in_flight)
+
+    def _abandon(self, waiter: asyncio.Future):
+        if waiter.done() and not waiter.cancelled():
+            # The slot was handed over while we were giving up: pass it on
+            self.release()
+            return
+        waiter.cancel()
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        LLM_QUEUE_DEPTH.labels(provider=self.provider).set(len(self._waiters))
+        self._notify_positions()
+
+    def _notify_positions(self):
+        loop = asyncio.get_running_loop()
+        for position, waiter in enumerate(self._waiters, start=1):
+            if waiter in self._listeners:
+                listener, context = self._listeners[waiter]
+                loop.create_task(listener(position), context=context)
+
+
+class LatencyTracker:
+    """Sliding window of first-token latencies for one backend."""
+
+    def __init__(self, window: int):
+        self._samples: Deque[float] = deque(maxlen=window)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def record(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, q: float) -> float:
+        return float(np.percentile(self._samples, q)) if self._samples else 0.0
+
+
+class HealthTracker:
+    """Recent error rate for one backend, with ejection and cooldown."""
+
+    def __init__(self, provider: str, window: int, min_requests: int, max_error_rate: float, cooldown: float):
+        self.provider = provider
+        self.min_requests = min_requests
+        self.max_error_rate = max_error_rate
+        self.cooldown = cooldown
+        self._outcomes: Deque[bool] = deque(maxlen=window)
+        self._ejected_until = 0.0
+        LLM_BACKEND_HEALTHY.labels(provider=provider).set(1)
+
+    @property
+    def error_rate(self) -> float:
+        if not self._outcomes:
+            return 0.0
+        return self._outcomes.count(False) / len(self._outcomes)
+
+    def healthy(self) -> bool:
+        if self._ejected_until and time.monotonic() >= self._ejected_until:
+            # Cooldown over: give the backend a clean slate
+            self._ejected_until = 0.0
+            self._outcomes.clear()
+            LLM_BACKEND_HEALTHY.labels(provider=self.provider).set(1)
+        return not self._ejected_until
+
+    def record(self, ok: bool):
+        self._outcomes.append(ok)
+        if not ok:
+            LLM_BACKEND_ERRORS.labels(provider=self.provider).inc()
+        if (not self._ejected_until and len(self._outcomes) >= self.min_requests
+                and self.error_rate >= self.max_error_rate):
+            self._ejected_until = time.monotonic() + self.cooldown
+            LLM_BACKEND_HEALTHY.labels(provider=self.provider).set(0)
+
+
+class LLMBackend:
+    """One OpenAI-compatible endpoint: its chat model, gate and latency/health trackers."""
+
+    def __init__(self, name: str, model: BaseChatModel, gate: LLMGate, model_name: str = ""):
+        self.name = name
+        self.model = model
+        self.model_name = model_name
+        self.gate = gate
+        self.latency = LatencyTracker(settings.LLM_LATENCY_WINDOW)
+        self.health = HealthTracker(
+            name,
+            window=settings.LLM_FAILOVER_WINDOW,
+            min_requests=settings.LLM_FAILOVER_MIN_REQUESTS,
+            max_error_rate=settings.LLM_FAILOVER_ERROR_RATE,
+            cooldown=settings.LLM_FAILOVER_COOLDOWN_SECONDS,
+        )
+        # Moving average of answer length, to estimate what a cancelled call would have cost
+        self.completion_tokens = float(settings.LLM_EXPECTED_COMPLETION_TOKENS)
+
+    def record_completion(self, tokens: int, streaming_seconds: float = 0.0):
+        self.completion_tokens += 0.1 * (tokens - self.completion_tokens)
+        if tokens > 1 and streaming_seconds > 0:
+            LLM_TOKENS_PER_SECOND.labels(provider=self.name, model=self.model_name).observe(tokens / streaming_seconds)
+
+    def record_cancelled(self, phase: str, emitted: int = 0):
+        LLM_CANCELLED.labels(provider=self.name, phase=phase).inc()
+        LLM_TOKENS_SAVED.labels(provider=self.name).inc(max(0.0, self.completion_tokens - emitted))
+
+    def hedge_delay(self) -> float:
+        """How long to wait for this backend's first token before hedging."""
+        if len(self.latency) < settings.LLM_HEDGE_MIN_SAMPLES:
+            return settings.LLM_HEDGE_DEFAULT_DELAY_SECONDS
+        return max(settings.LLM_HEDGE_MIN_DELAY_SECONDS, self.latency.percentile(settings.LLM_HEDGE_PERCENTILE))
+
+
+async def _report_queue_position(position: int):
+    try:
+        await adispatch_custom_event(LLM_QUEUE_EVENT, {"position": position})
+    except RuntimeError:
+        pass  # Not running inside a graph run, nobody to tell
+
+
+_END = object()
+
+
+class _Failure:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class _Attempt:
+    """One streaming request to one backend, pumped into a queue by a background task."""
+
+    def __init__(self, backend: LLMBackend, stream: Callable[[], AsyncIterator[ChatGenerationChunk]], hedge: bool):
+        self.backend = backend
+        self.hedge = hedge
+        self.queue: asyncio.Queue = asyncio.Queue()
+        # First chunk, _END for an empty answer, or _Failure before any output
+        self.first: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._stream = stream
+        self._started = time.perf_counter()
+        self.first_token_at = 0.0
+        self.task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        gate = self.backend.gate
+        try:
+            if self.hedge:
+                # A hedge is opportunistic: never queue behind other callers
+                if not gate.try_acquire():
+                    raise LLMOverloaded(self.backend.name, "hedge_skipped")
+            else:
+                await gate.acquire(on_queued=_report_queue_position)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.first.set_result(_Failure(e))
+            return
+        stream = self._stream()
+        try:
+            async for chunk in stream:
+                if not self.first.done():
+                    self.first_token_at = time.perf_counter()
+                    ttft = self.first_token_at - self._started
+                    self.backend.latency.record(ttft)
+                    LLM_FIRST_TOKEN_SECONDS.labels(provider=self.backend.name, model=self.backend.model_name).observe(ttft)
+                    self.first.set_result(chunk)
+                else:
+                    self.queue.put_nowait(chunk)
+            self.backend.health.record(True)
+            if not self.first.done():
+                self.first.set_result(_END)
+            self.queue.put_nowait(_END)
+        except asyncio.CancelledError:
+            if not self.first.done():
+                # Lost the race: still tells us this backend was at least this slow
+                self.backend.latency.record(time.perf_counter() - self._started)
+            raise
+        except Exception as e:
+            self.backend.health.record(False)
+            if not self.first.done():
+                self.first.set_result(_Failure(e))
+            else:
+                self.queue.put_nowait(_Failure(e))
+        finally:
+            # Closing the generator closes the upstream HTTP response right away
+            await stream.aclose()
+            gate.release()
+
+    def cancel(self):
+        self.task.cancel()
+
+
+def usable_backends(backends: List[LLMBackend]) -> List[LLMBackend]:
+    """Healthy backends in priority order."""
+    healthy = [b for b in backends if b.health.healthy()]
+    # With every backend ejected, trying them beats failing outright
+    return healthy or list(backends)
+
+
+class HedgedChatModel(BaseChatModel):
+    """Chat model that streams from a list of backends with hedging and failover."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    backends: List[Any]
+    hedge_enabled: bool = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "hedged-openai-compatible"
+
+    def _candidates(self) -> List[LLMBackend]:
+        return usable_backends(self.backends)
+
+    def bind_tools(self, tools, *, tool_choice: Optional[str] = None, **kwargs):
+        """Bind tools as OpenAI tool schemas; they go to whichever backend serves the call."""
+        if tool_choice:
+            kwargs["tool_choice"] = tool_choice
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Sync callers get plain failover only; the app itself always runs async
+        error = None
+        for backend in self._candidates():
+            try:
+                result = backend.model._generate(messages, stop=stop, **kwargs)
+            except Exception as e:
+                backend.health.record(False)
+                LLM_FAILOVERS.labels(provider=backend.name).inc()
+                error = e
+                continue
+            backend.health.record(True)
+            return result
+        raise error
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        return await agenerate_from_stream(self._astream(messages, stop, run_manager, **kwargs))
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        candidates = self._candidates()
+        pending = list(candidates)
+        attempts: List[_Attempt] = []
+
+        def launch(hedge: bool) -> _Attempt:
+            backend = pending.pop(0)
+            attempt = _Attempt(backend, lambda: backend.model._astream(messages, stop=stop, **kwargs), hedge)
+            attempts.append(attempt)
+            return attempt
+
+        primary = launch(hedge=False)
+        hedged = False
+        winner, first = None, None
+        try:
+            while winner is None:
+                timeout = None
+                if self.hedge_enabled and not hedged and pending:
+                    timeout = max(0.0, primary.backend.hedge_delay() - (time.perf_counter() - primary._started))
+                done, _ = await asyncio.wait(
+                    [a.first for a in attempts], timeout=timeout, return_when=asyncio.FIRST_COMPLETED
+                )
+                if not done:
+                    hedged = True
+                    launch(hedge=True)
+                    continue
+                for attempt in list(attempts):
+                    if not attempt.first.done():
+                        continue
+                    result = attempt.first.result()
+                    if isinstance(result, _Failure):
+                        attempts.remove(attempt)
+                        if attempt.hedge and isinstance(result.error, LLMOverloaded):
+                            LLM_HEDGES.labels(provider=attempt.backend.name, outcome="skipped").inc()
+                            continue
+                        LLM_FAILOVERS.labels(provider=attempt.backend.name).inc()
+                        if not attempts:
+                            if not pending:
+                                raise result.error
+                            # Fail over; the replacement gets a fresh hedge budget
+                            primary = launch(hedge=False)
+                            hedged = False
+                        continue
+                    winner, first = attempt, result
+                    break
+        except (asyncio.CancelledError, GeneratorExit):
+            # Caller went away (client disconnect, node deadline) before any output
+            primary.backend.record_cancelled("before_first_token")
+            raise
+        finally:
+            for attempt in attempts:
+                if attempt is not winner:
+                    attempt.cancel()
+                    if attempt.hedge:
+                        LLM_HEDGES.labels(provider=attempt.backend.name, outcome="lost").inc()
+        if winner.hedge:
+            LLM_HEDGES.labels(provider=winner.backend.name, outcome="won").inc()
+
+        emitted = 0
+        try:
+            item = first
+            while item is not _END:
+                if isinstance(item, _Failure):
+                    raise item.error  # Too late to fail over: tokens were already sent
+                if run_manager:
+                    await run_manager.on_llm_new_token(item.text, chunk=item)
+                emitted += count_tokens(item.text)
+                yield item
+                item = await winner.queue.get()
+            winner.backend.record_completion(emitted, time.perf_counter() - winner.first_token_at)
+        except (asyncio.CancelledError, GeneratorExit):
+            winner.backend.record_cancelled("streaming", emitted)
+            raise
+        finally:
+            winner.cancel()
+
+
+class LLMClients:
+    """Shared HTTP pools, backends, chat models and gates, one set per process."""
+
+    def __init__(self):
+        limits = httpx.Limits(
+            max_connections=settings.LLM_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.LLM_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.LLM_POOL_KEEPALIVE_SECONDS,
+        )
+        timeout = httpx.Timeout(settings.LLM_REQUEST_TIMEOUT_SECONDS, connect=10.0)
+        self.http_client = httpx.Client(limits=limits, timeout=timeout)
+        self.http_async_client = httpx.AsyncClient(limits=limits, timeout=timeout)
+        self._gates: Dict[str, LLMGate] = {}
+        self.backends = [self.backend(**config) for config in self._backend_configs()]
+
+    @staticmethod
+    def _backend_configs() -> List[Dict[str, Any]]:
+        primary = {
+            "name": settings.LLM_PROVIDER,
+            "model": settings.LLM_MODEL,
+            "api_base": settings.LLM_API_BASE,
+            "api_key": settings.LLM_API_KEY or settings.OPENAI_API_KEY,
+            "kind": "fake" if settings.LLM_PROVIDER == "fake" else "openai",
+        }
+        return [primary] + list(settings.LLM_BACKENDS)
+
+    def gate(self, provider: str = None) -> LLMGate:
+        provider = provider or settings.LLM_PROVIDER
+        gate = self._gates.get(provider)
+        if gate is None:
+            gate = self._gates[provider] = LLMGate(
+                provider,
+                max_in_flight=settings.LLM_MAX_IN_FLIGHT,
+                max_queue=settings.LLM_MAX_QUEUE,
+                queue_timeout=settings.LLM_QUEUE_TIMEOUT_SECONDS,
+            )
+        return gate
+
+    def backend(self, name: str, model: str, api_base: str = "", api_key: str = "",
+                kind: str = "openai", **overrides) -> LLMBackend:
+        if kind == "fake":
+            return LLMBackend(name, self._fake_model(**overrides), self.gate(name), model)
+        params = dict(
+            model=model,
+            temperature=0,
+            openai_api_base=api_base,
+            openai_api_key=api_key or "EMPTY",
+            max_retries=settings.LLM_MAX_RETRIES,
+            http_client=self.http_client,
+            http_async_client=self.http_async_client,
+        )
+        params.update(overrides)
+        return LLMBackend(name, ChatOpenAI(**params), self.gate(name), model)
+
+    @staticmethod
+    def _fake_model(**overrides) -> BaseChatModel:
+        from app.core.fake_llm import FakeChatModel
+
+        params = dict(
+            answer_tokens=settings.FAKE_LLM_ANSWER_TOKENS,
+            first_token_delay=settings.FAKE_LLM_TTFT_MS / 1000,
+            tokens_per_second=settings.FAKE_LLM_TOKENS_PER_SECOND,
+            failure_rate=settings.FAKE_LLM_FAILURE_RATE,
+            failure_mode=settings.FAKE_LLM_FAILURE_MODE,
+            seed=settings.FAKE_LLM_SEED,
+        )
+        params.update(overrides)
+        return FakeChatModel(**params)
+
+    def chat_model(self, backends: Optional[List[LLMBackend]] = None) -> HedgedChatModel:
+        return HedgedChatModel(backends=backends or self.backends, hedge_enabled=settings.LLM_HEDGE_ENABLED)
+
+    def saturated(self) -> bool:
+        """True when no usable backend could admit another request."""
+        return all(b.gate.saturated() for b in usable_backends(self.backends))
+
+    async def aclose(self):
+        await self.http_async_client.aclose()
+        self.http_client.close()
+
+
+llm_clients = LLMClients()
@@ -0,0 +1,319 @@
+"""
+Bounded per-session conversation memory.
+
+Each session keeps a sliding window of recent turns verbatim. Once the window
+holds more than ``SESSION_WINDOW_TURNS`` turns or ``SESSION_HISTORY_TOKEN_BUDGET``
+tokens, the oldest turns are folded into a rolling summary capped at
+``SESSION_SUMMARY_TOKEN_BUDGET`` tokens, so the history sent with each prompt
+stays bounded however long the conversation runs. Folding runs in the
+background; the next turn of the same session waits for it.
+
+Sessions live in process memory (LRU, idle TTL) or in Redis
+(``SESSION_STORE=redis``, ``REDIS_URL``) where keys expire when idle.
+The shared ``"default"`` session id carries no memory.
+
+Every change to a session is a read-modify-write through ``store.update``
+(atomic in process, WATCH/MULTI in Redis), taken under a per-session lock,
+so concurrent turns of one session never overwrite each other.
+"""
+import asyncio
+import hashlib
+import json
+import time
+import weakref
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+from app.core.config import settings
+from app.core.context import truncate_to_sentences
+from app.core.metrics import SESSION_MEMORY_FOLDS, SESSION_MEMORY_SESSIONS
+from app.core.tokens import count_tokens
+
+# Sent by clients that do not track sessions; never remembered
+SHARED_SESSION_ID = "default"
+
+# Each folded turn keeps at most this many tokens of its answer
+SUMMARY_ANSWER_TOKENS = 48
+
+Turn = Tuple[str, str]
+Summarizer = Callable[[str, List[Turn]], Awaitable[str]]
+# Maps the stored session (None when there is none) to its new value; None leaves it as is
+Update = Callable[[Optional[str]], Optional[str]]
+
+
+@dataclass
+class SessionMemory:
+    summary: str = ""
+    turns: List[Turn] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.summary or self.turns)
+
+    def messages(self) -> List[BaseMessage]:
+        out: List[BaseMessage] = []
+        for question, answer in self.turns:
+            out.append(HumanMessage(content=question))
+            out.append(AIMessage(content=answer))
+        return out
+
+    def history_tokens(self) -> int:
+        return sum(count_tokens(q) + count_tokens(a) for q, a in self.turns)
+
+    def fingerprint(self) -> str:
+        """Stable digest of the history; empty for a fresh session."""
+        if not self:
+            return ""
+        raw = json.dumps([self.summary, self.turns], ensure_ascii=False)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def to_json(self) -> str:
+        return json.dumps(asdict(self), ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, raw: str) -> "SessionMemory":
+        data = json.loads(raw)
+        return cls(summary=data.get("summary", ""), turns=[tuple(t) for t in data.get("turns", [])])
+
+
+class InMemorySessionStore:
+    """Process-local sessions, least recently used first out, expired when idle."""
+
+    def __init__(self, max_sessions: int, idle_ttl: float):
+        self.max_sessions = max_sessions
+        self.idle_ttl = idle_ttl
+        self._data: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+
+    async def get(self, session_id: str) -> Optional[str]:
+        self._evict()
+        entry = self._data.get(session_id)
+        if entry is None:
+            return None
+        self._data[session_id] = (time.monotonic(), entry[1])
+        self._data.move_to_end(session_id)
+        return entry[1]
+
+    async def put(self, session_id: str, raw: str):
+        self._data[session_id] = (time.monotonic(), raw)
+        self._data.move_to_end(session_id)
+        self._evict()
+
+    async def update(self, session_id: str, fn: Update) -> Optional[str]:
+        # No await between the read and the write: atomic on the event loop
+        entry = self._data.get(session_id)
+        raw = fn(entry[1] if entry else None)
+        if raw is not None:
+            self._data[session_id] = (time.monotonic(), raw)
+            self._data.move_to_end(session_id)
+            self._evict()
+        return raw
+
+    async def delete(self, session_id: str):
+        self._data.pop(session_id, None)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def _evict(self):
+        # Access order == idle order, so expired sessions are always at the front
+        deadline = time.monotonic() - self.idle_ttl
+        while self._data:
+            session_id, (touched, _) = next(iter(self._data.items()))
+            if touched > deadline and len(self._data) <= self.max_sessions:
+                break
+            del self._data[session_id]
+        SESSION_MEMORY_SESSIONS.set(len(self._data))
+
+    async def aclose(self):
+        pass
+
+
+class RedisSessionStore:
+    """Sessions shared across workers; Redis expires keys idle for ``idle_ttl``."""
+
+    def __init__(self, url: str, idle_ttl: float, prefix: str = "chat:session:"):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url, decode_responses=True)
+        self.idle_ttl = int(idle_ttl)
+        self.prefix = prefix
+
+    async def get(self, session_id: str) -> Optional[str]:
+        key = self.prefix + session_id
+        raw = await self._redis.get(key)
+        if raw is not None:
+            await self._redis.expire(key, self.idle_ttl)
+        return raw
+
+    async def put(self, session_id: str, raw: str):
+        await self._redis.set(self.prefix + session_id, raw, ex=self.idle_ttl)
+
+    async def update(self, session_id: str, fn: Update) -> Optional[str]:
+        """Optimistic transaction: retried when another worker writes the session in between."""
+        from redis.exceptions import WatchError
+
+        key = self.prefix + session_id
+        async with self._redis.pipeline(transaction=True) as pipe:
+            while True:
+                try:
+                    await pipe.watch(key)
+                    raw = fn(await pipe.get(key))
+                    if raw is None:
+                        await pipe.unwatch()
+                        return None
+                    pipe.multi()
+                    pipe.set(key, raw, ex=self.idle_ttl)
+                    await pipe.execute()
+                    return raw
+                except WatchError:
+                    continue
+
+    async def delete(self, session_id: str):
+        await self._redis.delete(self.prefix + session_id)
+
+    async def aclose(self):
+        await self._redis.aclose()
+
+
+async def extractive_summary(summary: str, turns: List[Turn]) -> str:
+    """One line per folded turn: the question and the opening of its answer."""
+    lines = [summary] if summary else []
+    for question, answer in turns:
+        head = truncate_to_sentences(answer, SUMMARY_ANSWER_TOKENS) or answer[:SUMMARY_ANSWER_TOKENS]
+        lines.append(f"问：{question} 答：{head}")
+    return "\n".join(lines)
+
+
+async def llm_summary(summary: str, turns: List[Turn]) -> str:
+    """Fold turns into the summary with the LLM, falling back to the extractive form."""
+    from app.core.llm import llm_clients
+
+    transcript = "\n".join(f"用户：{q}\n助手：{a}" for q, a in turns)
+    prompt = (
+        "请将以下对话并入已有摘要，保留用户的关键信息（如出生日期、姓氏、所问之事）和已给出的结论，"
+        f"总字数不超过{settings.SESSION_SUMMARY_TOKEN_BUDGET}字。\n"
+        f"已有摘要：{summary or '无'}\n新对话：\n{transcript}"
+    )
+    try:
+        response = await llm_clients.chat_model().ainvoke(prompt)
+        return response.content.strip()
+    except Exception as e:
+        print(f"Session summary error: {e}")
+        return await extractive_summary(summary, turns)
+
+
+def _clip_summary(summary: str, budget: int) -> str:
+    """Keep the newest summary lines that fit ``budget`` tokens."""
+    if count_tokens(summary) <= budget:
+        return summary
+    kept, used = [], 0
+    for line in reversed(summary.split("\n")):
+        tokens = count_tokens(line)
+        if used + tokens > budget:
+            break
+        kept.append(line)
+        used += tokens
+    return "\n".join(reversed(kept)) or truncate_to_sentences(summary, budget)
+
+
+class SessionMemoryManager:
+    def __init__(self, store, summarizer: Summarizer, window_turns: int,
+                 history_budget: int, summary_budget: int):
+        self.store = store
+        self.summarizer = summarizer
+        self.window_turns = window_turns
+        self.history_budget = history_budget
+        self.summary_budget = summary_budget
+        self._folds: Dict[str, asyncio.Task] = {}
+        # Dropped once no turn of the session holds or waits for it
+        self._locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+    def _lock(self, session_id: str) -> asyncio.Lock:
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
+
+    @staticmethod
+    def enabled_for(session_id: str) -> bool:
+        return settings.SESSION_MEMORY_ENABLED and bool(session_id) and session_id != SHARED_SESSION_ID
+
+    async def load(self, session_id: str) -> SessionMemory:
+        if not self.enabled_for(session_id):
+            return SessionMemory()
+        fold = self._folds.get(session_id)
+        if fold:
+            await asyncio.shield(fold)
+        raw = await self.store.get(session_id)
+        return SessionMemory.from_json(raw) if raw else SessionMemory()
+
+    async def record(self, session_id: str, question: str, answer: str):
+        """Append a finished turn; folding into the summary happens in the background."""
+        if not self.enabled_for(session_id) or not answer:
+            return
+
+        def append(raw: Optional[str]) -> str:
+            memory = SessionMemory.from_json(raw) if raw else SessionMemory()
+            memory.turns.append((question, answer))
+            return memory.to_json()
+
+        async with self._lock(session_id):
+            fold = self._folds.get(session_id)
+            if fold:
+                await asyncio.shield(fold)
+            memory = SessionMemory.from_json(await self.store.update(session_id, append))
+            if self._over_budget(memory):
+                self._folds[session_id] = asyncio.ensure_future(self._fold(session_id, memory))
+
+    async def clear(self, session_id: str):
+        await self.store.delete(session_id)
+
+    def _over_budget(self, memory: SessionMemory) -> bool:
+        return len(memory.turns) > self.window_turns or memory.history_tokens() > self.history_budget
+
+    async def _fold(self, session_id: str, memory: SessionMemory):
+        try:
+            folded = []
+            while memory.turns and self._over_budget(memory):
+                folded.append(memory.turns.pop(0))
+            summary = _clip_summary(await self.summarizer(memory.summary, folded), self.summary_budget)
+
+            def apply(raw: Optional[str]) -> Optional[str]:
+                # Turns recorded meanwhile (another worker) are kept; a session that was
+                # cleared or folded elsewhere is left alone
+                current = SessionMemory.from_json(raw) if raw else None
+                if current is None or current.summary != memory.summary or current.turns[:len(folded)] != folded:
+                    return None
+                current.summary = summary
+                current.turns = current.turns[len(folded):]
+                return current.to_json()
+
+            if await self.store.update(session_id, apply) is not None:
+                SESSION_MEMORY_FOLDS.inc()
+        except Exception as e:
+            print(f"Session fold error: {e}")
+        finally:
+            if self._folds.get(session_id) is asyncio.current_task():
+                del self._folds[session_id]
+
+    async def aclose(self):
+        if self._folds:
+            await asyncio.gather(*self._folds.values(), return_exceptions=True)
+        await self.store.aclose()
+
+
+def _build_store():
+    if settings.SESSION_STORE == "redis":
+        return RedisSessionStore(settings.REDIS_URL, settings.SESSION_IDLE_TTL_SECONDS)
+    return InMemorySessionStore(settings.SESSION_MAX_SESSIONS, settings.SESSION_IDLE_TTL_SECONDS)
+
+
+session_memory = SessionMemoryManager(
+    _build_store(),
+    llm_summary if settings.SESSION_SUMMARY_MODE == "llm" else extractive_summary,
+    window_turns=settings.SESSION_WINDOW_TURNS,
+    history_budget=settings.SESSION_HISTORY_TOKEN_BUDGET,
+    summary_budget=settings.SESSION_SUMMARY_TOKEN_BUDGET,
+)
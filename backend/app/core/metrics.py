@@ -0,0 +1,192 @@
+"""
+Prometheus metrics shared across the application.
+
+Metrics are module-level singletons registered on the default
+prometheus_client registry.
+"""
+from prometheus_client import Counter, Gauge, Histogram
+
+# Answer cache (app.core.answer_cache)
+ANSWER_CACHE_LOOKUPS = Counter(
+    "chat_answer_cache_lookups_total",
+    "Answer cache lookups by result (exact_hit, semantic_hit, miss)",
+    ["result"],
+)
+ANSWER_CACHE_EVICTIONS = Counter(
+    "chat_answer_cache_evictions_total",
+    "Answer cache evictions by reason (ttl, lru)",
+    ["reason"],
+)
+ANSWER_CACHE_ENTRIES = Gauge(
+    "chat_answer_cache_entries",
+    "Number of answers currently held in the answer cache",
+)
+
+# Single-flight request coalescing (app.core.singleflight)
+SINGLEFLIGHT_REQUESTS = Counter(
+    "chat_singleflight_requests_total",
+    "Coalesced requests by mode (call, stream) and role (leader, follower)",
+    ["mode", "role"],
+)
+SINGLEFLIGHT_INFLIGHT = Gauge(
+    "chat_singleflight_inflight",
+    "Shared executions currently running",
+)
+
+# LLM client admission control (app.core.llm)
+LLM_INFLIGHT = Gauge(
+    "llm_requests_in_flight",
+    "LLM requests currently holding a concurrency slot",
+    ["provider"],
+)
+LLM_QUEUE_DEPTH = Gauge(
+    "llm_queue_depth",
+    "LLM requests waiting for a concurrency slot",
+    ["provider"],
+)
+LLM_QUEUE_WAIT_SECONDS = Histogram(
+    "llm_queue_wait_seconds",
+    "Time spent waiting for an LLM concurrency slot",
+    ["provider"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+LLM_ADMISSION_REJECTED = Counter(
+    "llm_admission_rejected_total",
+    "LLM requests rejected by admission control by reason (queue_full, queue_timeout)",
+    ["provider", "reason"],
+)
+
+# LLM backend hedging and failover (app.core.llm)
+LLM_FIRST_TOKEN_SECONDS = Histogram(
+    "llm_backend_first_token_seconds",
+    "Time from request start to first streamed token, per backend and model",
+    ["provider", "model"],
+    buckets=(0.1, 0.25, 0.5, 0.75, 1, 1.5, 2, 3, 5, 10, 30),
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "llm_backend_tokens_per_second",
+    "Streaming rate after the first token of completed answers, per backend and model",
+    ["provider", "model"],
+    buckets=(5, 10, 20, 30, 50, 75, 100, 150, 200, 400),
+)
+LLM_HEDGES = Counter(
+    "llm_hedged_requests_total",
+    "Hedged requests by the backend that served the hedge and outcome (won, lost, skipped)",
+    ["provider", "outcome"],
+)
+LLM_FAILOVERS = Counter(
+    "llm_failovers_total",
+    "Requests moved to another backend after this backend failed before its first token",
+    ["provider"],
+)
+LLM_BACKEND_ERRORS = Counter(
+    "llm_backend_errors_total",
+    "Failed LLM backend requests",
+    ["provider"],
+)
+LLM_BACKEND_HEALTHY = Gauge(
+    "llm_backend_healthy",
+    "1 while a backend takes traffic, 0 while it is ejected for its error rate",
+    ["provider"],
+)
+
+# Session memory (app.core.memory)
+SESSION_MEMORY_SESSIONS = Gauge(
+    "chat_session_memory_sessions",
+    "Sessions held by the in-process session store",
+)
+SESSION_MEMORY_FOLDS = Counter(
+    "chat_session_memory_folds_total",
+    "Times older turns were folded into a session's rolling summary",
+)
+
+# Resumable SSE streams (app.core.resumable)
+SSE_LIVE_STREAMS = Gauge(
+    "chat_sse_live_streams",
+    "Stream producers currently running",
+)
+SSE_RESUMES = Counter(
+    "chat_sse_resumes_total",
+    "Reconnects carrying Last-Event-ID by where they were served from (live, buffer, checkpoint, miss)",
+    ["source"],
+)
+
+# Cancellation and deadlines
+LLM_CANCELLED = Counter(
+    "llm_requests_cancelled_total",
+    "LLM calls abandoned by their caller, by phase (before_first_token, streaming)",
+    ["provider", "phase"],
+)
+LLM_TOKENS_SAVED = Counter(
+    "llm_tokens_saved_total",
+    "Estimated completion tokens not generated because the call was cancelled",
+    ["provider"],
+)
+SSE_ABANDONED = Counter(
+    "chat_sse_abandoned_total",
+    "Stream runs cancelled because no client was listening any more",
+)
+CHAT_DISCONNECTS = Counter(
+    "chat_client_disconnects_total",
+    "Requests whose client disconnected before the answer was complete, by endpoint",
+    ["endpoint"],
+)
+NODE_DEADLINE_EXCEEDED = Counter(
+    "agent_node_deadline_exceeded_total",
+    "Graph nodes stopped by their deadline",
+    ["node"],
+)
+
+# Batch chat (/chat/batch)
+BATCH_ITEMS = Counter(
+    "chat_batch_items_total",
+    "Batch questions answered, by outcome (ok, error)",
+    ["outcome"],
+)
+
+# Agent graph tracing (app.core.tracing)
+NODE_DURATION_SECONDS = Histogram(
+    "agent_node_duration_seconds",
+    "Wall time of one graph node call",
+    ["node"],
+    buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+)
+RETRIEVAL_LOOP_ITERATIONS = Histogram(
+    "agent_retrieval_loop_iterations",
+    "Retrieve passes (initial plus query rewrites) before generating an answer",
+    buckets=(1, 2, 3, 4, 5, 10),
+)
+GRADER_DURATION_SECONDS = Histogram(
+    "agent_grader_duration_seconds",
+    "Time to score one retrieval's documents against the question",
+    buckets=(0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+)
+GRADER_DOCUMENTS = Counter(
+    "agent_grader_documents_total",
+    "Retrieved documents graded, by result (kept, dropped); dropped / total is the drop rate",
+    ["result"],
+)
+
+# Micro-batched query embedding (app.core.embedding_service)
+EMBED_BATCH_SIZE = Histogram(
+    "rag_embed_batch_size",
+    "Queries embedded together in one embedder call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+
+# Query vector and retrieval result caches (app.core.retrieval_cache)
+RAG_CACHE_LOOKUPS = Counter(
+    "rag_cache_lookups_total",
+    "Retrieval cache lookups by cache (vector, result) and result (memory_hit, disk_hit, miss)",
+    ["cache", "result"],
+)
+RAG_CACHE_ENTRIES = Gauge(
+    "rag_cache_entries",
+    "Entries held in memory per retrieval cache",
+    ["cache"],
+)
+RAG_CACHE_BYTES = Gauge(
+    "rag_cache_bytes",
+    "Approximate size of the retrieval caches: keys and values in memory per cache, the SQLite file on disk",
+    ["cache", "tier"],
+)
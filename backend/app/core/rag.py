@@ -1,25 +1,209 @@
-import os
+"""
+Retrieval over the local knowledge base index (see app.core.vector_index).
+
+The index is built offline by ``scripts/build_index.py`` and memory-mapped on
+first use (or at startup, ``load_index``). Queries are embedded with the
+index's model, EMBEDDING_MODEL (see app.core.embeddings). Without an index
+file, with one built by another embedder, or when the model cannot be
+loaded, RAG is off and ``retrieve_documents`` returns nothing, so questions
+are answered by the LLM directly.
+
+Retrieval is hybrid: the vector index and the BM25 inverted index built next
+to it each rank their best candidates, and the two rankings are merged with
+reciprocal rank fusion (a document's score is the sum of 1 / (RAG_RRF_K +
+rank) over the rankings it appears in). Fusion uses ranks only, so the very
+different score scales of cosine similarity and BM25 need no calibration.
+
+Query vectors and rankings are cached (app.core.retrieval_cache) per corpus
+version, so repeated questions skip both the embedding and the search.
+"""
+import threading
+from typing import Dict, List, Optional, Sequence
+
+import structlog
+
+from app.core.bm25 import InvertedIndex, tokenize
+from app.core.config import settings
+from app.core.corpus import corpus_version
+from app.core.embedding_service import EmbeddingService
+from app.core.embeddings import HASHING, backend_of, load_embedder
+from app.core.retrieval_cache import RetrievalCache
+from app.core.text import normalize_question
+from app.core.vector_index import SearchHit, VectorIndex
+
+logger = structlog.get_logger()
 
 # Global cache for index
-_index_cache = None
-_settings_configured = False
-_rag_available = True
+_index_cache: Optional[VectorIndex] = None
+_lexical_index: Optional[InvertedIndex] = None
+_embedder = None
+_cache: Optional[RetrievalCache] = None
+_index_lock = threading.Lock()
+_rag_available = False
+_loaded = False
+
+
+def load_index(path: Optional[str] = None) -> bool:
+    """(Re)open the index at ``path`` (RAG_INDEX_PATH by default); False when RAG stays off."""
+    global _index_cache, _lexical_index, _embedder, _cache, _rag_available, _loaded
+    path = path or settings.RAG_INDEX_PATH
+    with _index_lock:
+        _loaded = True
+        try:
+            index = VectorIndex(path)
+        except FileNotFoundError:
+            logger.warning("rag_index_missing", path=path)
+            _index_cache, _rag_available = None, False
+            return False
+        # Quantised or not, another backend's query vectors drift from the index's
+        expected = (settings.EMBEDDING_MODEL, backend_of(settings.EMBEDDING_MODEL, settings.EMBEDDING_BACKEND))
+        if (index.embedder, index.backend) != expected:
+            logger.error("rag_index_embedder_mismatch", path=path, embedder=index.embedder, backend=index.backend,
+                         expected=settings.EMBEDDING_MODEL, expected_backend=expected[1])
+            _index_cache, _rag_available = None, False
+            return False
+        try:
+            embedder = _query_embedder(index.dim)
+        except Exception as e:
+            logger.error("rag_embedder_unavailable", embedder=index.embedder, error=str(e))
+            _index_cache, _rag_available = None, False
+            return False
+        try:
+            lexical = InvertedIndex.load(path)
+        except FileNotFoundError:
+            logger.warning("rag_bm25_index_missing", path=path)
+            lexical = None
+        if lexical is not None and len(lexical) != len(index):
+            logger.error("rag_bm25_index_mismatch", path=path, documents=len(lexical))
+            lexical = None
+        if settings.EMBED_BATCH_ENABLED:
+            embedder = EmbeddingService(embedder, settings.EMBED_BATCH_MAX_SIZE, settings.EMBED_BATCH_WINDOW_MS)
+        _close_embedder()
+        _index_cache, _lexical_index, _embedder, _rag_available = index, lexical, embedder, True
+        _cache = _open_cache(path)
+        logger.info("rag_index_loaded", path=path, documents=len(index), dim=index.dim, hybrid=lexical is not None)
+        return True
+
+
+def _query_embedder(dim: int):
+    """The EMBEDDING_MODEL embedder, loaded now; a loaded model is reused across index reloads."""
+    current = getattr(_embedder, "embedder", _embedder)
+    if (current is not None and current.name == settings.EMBEDDING_MODEL and current.dim == dim
+            and current.backend == backend_of(settings.EMBEDDING_MODEL, settings.EMBEDDING_BACKEND)):
+        return current
+    embedder = load_embedder(settings.EMBEDDING_MODEL, dim, settings.EMBEDDING_DEVICE,
+                             settings.EMBEDDING_BACKEND, settings.EMBEDDING_ONNX_DIR)
+    if embedder.dim != dim:
+        raise ValueError(f"index has {dim} dimensions, the embedder {embedder.dim}")
+    # Load (and warm up) the model now rather than on the first query
+    embedder.embed("乾")
+    return embedder
+
+
+def query_embedder():
+    """The loaded model embedding queries, or None while RAG is off or runs on the hashing embedder."""
+    embedder = _embedder if _rag_available else None
+    if embedder is None or getattr(embedder, "embedder", embedder).name == HASHING:
+        return None
+    return embedder
+
+
+def _close_embedder():
+    if isinstance(_embedder, EmbeddingService):
+        _embedder.close()
+
+
+def _open_cache(path: str) -> Optional[RetrievalCache]:
+    """The retrieval cache for the index at ``path``, switched to its corpus version."""
+    if not settings.RAG_CACHE_ENABLED:
+        if _cache is not None:
+            _cache.close()
+        return None
+    cache_path = settings.RAG_CACHE_DB or path + ".cache.db"
+    cache = _cache
+    if cache is None or cache.path != cache_path:
+        if cache is not None:
+            cache.close()
+        cache = RetrievalCache(cache_path, settings.RAG_CACHE_MAX_ENTRIES, settings.RAG_CACHE_MAX_DISK_ENTRIES)
+    version = corpus_version(path)
+    cache.open(version)
+    logger.info("rag_cache_opened", path=cache_path, corpus_version=version)
+    return cache
+
+
+def close():
+    """Stop the query embedding service and close the retrieval cache."""
+    global _cache
+    with _index_lock:
+        _close_embedder()
+        if _cache is not None:
+            _cache.close()
+            _cache = None
+
 
 def check_rag_available():
-    """Check if RAG is available (embeddings working)"""
-    global _rag_available
+    """Check if RAG is available (an index is loaded)"""
+    if not _loaded:
+        load_index()
     return _rag_available
 
-def retrieve_documents(query: str):
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int, c: int = 60) -> List[tuple]:
+    """Best ``k`` (row, score) pairs of the fused ``rankings``, best first; ties keep first-seen order."""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            scores[row] = scores.get(row, 0.0) + 1.0 / (c + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])[:k]
+
+
+def search(query: str, k: Optional[int] = None, source: Optional[str] = None) -> List[SearchHit]:
+    """Top ``k`` (RAG_TOP_K) index entries for ``query``, optionally from one ``source`` only."""
+    if not check_rag_available():
+        return []
+    index, lexical, embedder, cache = _index_cache, _lexical_index, _embedder, _cache
+    k = k or settings.RAG_TOP_K
+    if not settings.RAG_HYBRID_ENABLED:
+        lexical = None
+    # Ranked as normalised, with or without the cache: questions differing only in
+    # punctuation, spacing, case or script get the same, cacheable, results
+    query = normalize_question(query)
+    if cache is None:
+        ranked = _rank(index, lexical, embedder.embed, query, k, source)
+    else:
+        mode = "dense" if lexical is None else f"hybrid:{settings.RAG_HYBRID_CANDIDATES}:{settings.RAG_RRF_K}"
+        key = f"{query}\x00{k}\x00{source or ''}\x00{mode}"
+
+        def embed(text: str):
+            return cache.vector(text, lambda: embedder.embed(text))
+
+        ranked = cache.results(key, lambda: _rank(index, lexical, embed, query, k, source))
+    return [index.hit(row, score) for row, score in ranked]
+
+
+def _rank(index: VectorIndex, lexical: Optional[InvertedIndex], embed, query: str, k: int,
+          source: Optional[str]) -> List[tuple]:
+    """(row, score) pairs, best first: dense only without ``lexical``, else fused with BM25."""
+    rows = None if source is None else index.source_rows(source)
+    if lexical is None:
+        return [(int(row), float(score)) for row, score in zip(*index.top(embed(query), k, rows))]
+    candidates = max(k, settings.RAG_HYBRID_CANDIDATES)
+    dense_rows, _ = index.top(embed(query), candidates, rows)
+    lexical_rows, _ = lexical.top(tokenize(query), candidates, rows)
+    return reciprocal_rank_fusion([dense_rows.tolist(), lexical_rows.tolist()], k, settings.RAG_RRF_K)
+
+
+def retrieve_documents(query: str, k: Optional[int] = None, source: Optional[str] = None) -> List[str]:
     """
     Retrieve documents from vector store.
-    Temporarily disabled due to embedding API compatibility issues.
-    Returns empty list to allow direct LLM generation.
+    ``source`` restricts results to one kind of document (iching, horoscope, zodiac).
     """
-    # TODO: Fix embedding model compatibility with DashScope
-    # For now, return empty to skip RAG and use direct LLM generation
-    return []
+    return [hit.text for hit in search(query, k, source)]
+
 
 def query_index(query: str):
     """Query the knowledge base"""
-    return "Knowledge base temporarily unavailable. Using direct LLM response."
+    documents = retrieve_documents(query)
+    if not documents:
+        return "Knowledge base temporarily unavailable. Using direct LLM response."
+    return "\n\n".join(documents)
@@ -0,0 +1,332 @@
+"""
+Resumable SSE streams.
+
+Every graph stream runs in a producer task that is detached from the HTTP
+response: its frames are numbered (``id: <stream_id>:<seq>``), kept in an
+in-memory buffer and checkpointed in batches to SQLite. A client that drops
+and reconnects with ``Last-Event-ID`` is served from that point on: from the
+live buffer while the run is still going (re-attaching to it), from the
+buffer or SQLite once it has finished, or by polling SQLite when another
+worker process owns the run. Finished streams are evicted after
+``SSE_RESUME_TTL_SECONDS``.
+
+Only the frames are checkpointed, not the graph's state: when the owning
+worker dies mid-run, a stream followed from SQLite stops changing, and after
+``SSE_RESUME_TTL_SECONDS`` without a checkpoint it ends with a ``stream_lost``
+error frame carrying the last event id it delivered, so the client can tell
+it from a finished answer and ask again.
+
+A run that nobody has followed for ``SSE_ABANDON_GRACE_SECONDS`` (the
+client closed the tab and did not come back) is cancelled, which cancels
+the graph run and the upstream LLM request behind it.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.metrics import SSE_RESUMES, SSE_LIVE_STREAMS, SSE_ABANDONED, CHAT_DISCONNECTS
+
+
+def parse_event_id(event_id: str) -> Optional[Tuple[str, int]]:
+    stream_id, _, seq = (event_id or "").strip().rpartition(":")
+    if not stream_id or not seq.isdigit():
+        return None
+    return stream_id, int(seq)
+
+
+class StreamBuffer:
+    """Frames of one stream; any number of readers can follow it from any point."""
+
+    def __init__(self, stream_id: str, on_idle: Optional[Callable[["StreamBuffer"], None]] = None):
+        self.stream_id = stream_id
+        self.frames: List[dict] = []
+        self.finished_at: Optional[float] = None
+        self.followers = 0
+        self._on_idle = on_idle
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def append(self, frame: dict) -> dict:
+        frame = {**frame, "id": f"{self.stream_id}:{len(self.frames) + 1}"}
+        self.frames.append(frame)
+        self._wake()
+        return frame
+
+    def finish(self):
+        self.finished_at = time.time()
+        self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def follow(self, after: int = 0) -> AsyncIterator[dict]:
+        index = after
+        self.followers += 1
+        try:
+            while True:
+                changed = self._changed
+                while index < len(self.frames):
+                    yield self.frames[index]
+                    index += 1
+                if self.finished:
+                    return
+                await changed.wait()
+        finally:
+            # The response is closed when its client disconnects
+            self.followers -= 1
+            if not self.followers and not self.finished and self._on_idle:
+                self._on_idle(self)
+
+
+class SQLiteStreamStore:
+    """Checkpointed frames, written from a single background thread."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._conn: Optional[sqlite3.Connection] = None
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self._conn = sqlite3.connect(self.path, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript("""
+                CREATE TABLE IF NOT EXISTS sse_streams (
+                    stream_id TEXT PRIMARY KEY,
+                    finished_at REAL,
+                    updated_at REAL NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS sse_frames (
+                    stream_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    event TEXT NOT NULL,
+                    data TEXT NOT NULL,
+                    PRIMARY KEY (stream_id, seq)
+                ) WITHOUT ROWID;
+            """)
+        return self._conn
+
+    def _write(self, stream_id: str, frames: List[dict], finished_at: Optional[float]):
+        db = self._db()
+        with db:
+            db.execute(
+                "INSERT INTO sse_streams (stream_id, finished_at, updated_at) VALUES (?, ?, ?) "
+                # Batches may land out of order; never un-finish a stream
+                "ON CONFLICT(stream_id) DO UPDATE SET "
+                "finished_at = COALESCE(excluded.finished_at, sse_streams.finished_at), updated_at = excluded.updated_at",
+                (stream_id, finished_at, time.time()),
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO sse_frames (stream_id, seq, event, data) VALUES (?, ?, ?, ?)",
+                [(stream_id, parse_event_id(f["id"])[1], f.get("event", "message"), f.get("data", "")) for f in frames],
+            )
+
+    def _read(self, stream_id: str, after: int):
+        db = self._db()
+        row = db.execute("SELECT finished_at, updated_at FROM sse_streams WHERE stream_id = ?", (stream_id,)).fetchone()
+        if row is None:
+            return None
+        rows = db.execute(
+            "SELECT seq, event, data FROM sse_frames WHERE stream_id = ? AND seq > ? ORDER BY seq",
+            (stream_id, after),
+        ).fetchall()
+        frames = [{"id": f"{stream_id}:{seq}", "event": event, "data": data} for seq, event, data in rows]
+        return frames, row[0], row[1]
+
+    def _evict(self, before: float):
+        db = self._db()
+        with db:
+            stale = "SELECT stream_id FROM sse_streams WHERE updated_at < ?"
+            db.execute(f"DELETE FROM sse_frames WHERE stream_id IN ({stale})", (before,))
+            db.execute("DELETE FROM sse_streams WHERE updated_at < ?", (before,))
+
+    def _submit(self, fn, *args) -> asyncio.Future:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sse-checkpoint")
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    async def _run(self, fn, *args):
+        return await self._submit(fn, *args)
+
+    def write(self, stream_id: str, frames: List[dict], finished_at: Optional[float] = None) -> asyncio.Future:
+        """Queue a batch; the single writer thread applies batches in the order they were queued."""
+        return self._submit(self._write, stream_id, frames, finished_at)
+
+    async def read(self, stream_id: str, after: int):
+        """(frames after ``after``, finished_at, updated_at), or None for an unknown stream."""
+        return await self._run(self._read, stream_id, after)
+
+    async def evict(self, before: float):
+        await self._run(self._evict, before)
+
+    async def follow(self, stream_id: str, after: int, poll: float, stale: float) -> AsyncIterator[dict]:
+        """
+        Frames of a stream produced elsewhere, polled until it finishes; a
+        stream that goes quiet for ``stale`` seconds (or is evicted) before
+        finishing ends with a ``stream_lost`` error frame.
+        """
+        while True:
+            found = await self.read(stream_id, after)
+            if found is None:
+                yield stream_lost_frame(stream_id, after)
+                return
+            frames, finished_at, updated_at = found
+            for frame in frames:
+                yield frame
+                after = parse_event_id(frame["id"])[1]
+            if finished_at is not None:
+                return
+            if time.time() - updated_at > stale:
+                yield stream_lost_frame(stream_id, after)
+                return
+            await asyncio.sleep(poll)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.submit(self._close_db)
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _close_db(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+
+def stream_lost_frame(stream_id: str, seq: int) -> dict:
+    """Terminal frame of a stream whose producer stopped without finishing it (no id: not part of the stream)."""
+    return {
+        "event": "error",
+        "data": json.dumps({
+            "error": "回答生成中断，请重新提问",
+            "code": "stream_lost",
+            "last_event_id": f"{stream_id}:{seq}",
+        }),
+    }
+
+
+def _report_checkpoint_error(written: asyncio.Future):
+    if not written.cancelled() and written.exception() is not None:
+        print(f"Stream checkpoint error: {written.exception()}")
+
+
+class ResumableStreams:
+    def __init__(self, store: SQLiteStreamStore, ttl: float, checkpoint_interval: float, abandon_grace: float):
+        self.store = store
+        self.ttl = ttl
+        self.checkpoint_interval = checkpoint_interval
+        self.abandon_grace = abandon_grace
+        self._live: Dict[str, StreamBuffer] = {}
+        self._producers: Dict[str, asyncio.Task] = {}
+        self._last_evicted = 0.0
+
+    def start(self, frames: AsyncIterator[dict]) -> StreamBuffer:
+        """Run ``frames`` to completion in the background, whoever is listening."""
+        self._evict()
+        buffer = StreamBuffer(uuid.uuid4().hex, on_idle=self._schedule_abandon)
+        self._live[buffer.stream_id] = buffer
+        self._producers[buffer.stream_id] = asyncio.ensure_future(self._produce(buffer, frames))
+        SSE_LIVE_STREAMS.set(len(self._producers))
+        return buffer
+
+    def _schedule_abandon(self, buffer: StreamBuffer):
+        CHAT_DISCONNECTS.labels(endpoint="stream").inc()
+        asyncio.get_running_loop().call_later(self.abandon_grace, self._abandon_if_idle, buffer)
+
+    def _abandon_if_idle(self, buffer: StreamBuffer):
+        producer = self._producers.get(buffer.stream_id)
+        if buffer.followers or producer is None or producer.done():
+            return
+        SSE_ABANDONED.inc()
+        producer.cancel()
+
+    async def _produce(self, buffer: StreamBuffer, frames: AsyncIterator[dict]):
+        pending: List[dict] = []
+        last_flush = time.monotonic()
+        try:
+            async for frame in frames:
+                pending.append(buffer.append(frame))
+                if time.monotonic() - last_flush >= self.checkpoint_interval:
+                    # Fire and forget: queued now, so batches reach the writer thread in order
+                    self._checkpoint(buffer.stream_id, pending)
+                    pending, last_flush = [], time.monotonic()
+        except Exception as e:
+            print(f"Resumable stream error: {e}")
+        finally:
+            buffer.finish()
+            try:
+                await self._checkpoint(buffer.stream_id, pending, buffer.finished_at)
+            except Exception:
+                pass  # Reported by _checkpoint
+            self._producers.pop(buffer.stream_id, None)
+            SSE_LIVE_STREAMS.set(len(self._producers))
+
+    def _checkpoint(self, stream_id: str, frames: List[dict], finished_at: Optional[float] = None) -> asyncio.Future:
+        written = self.store.write(stream_id, frames, finished_at)
+        written.add_done_callback(_report_checkpoint_error)
+        return written
+
+    async def resume(self, last_event_id: str) -> Optional[AsyncIterator[dict]]:
+        """Frames after ``last_event_id``, or None when the stream is unknown or expired."""
+        parsed = parse_event_id(last_event_id)
+        if parsed is None:
+            return None
+        stream_id, seq = parsed
+        self._evict()
+        buffer = self._live.get(stream_id)
+        if buffer is not None:
+            SSE_RESUMES.labels(source="live" if not buffer.finished else "buffer").inc()
+            return buffer.follow(seq)
+        try:
+            found = await self.store.read(stream_id, seq)
+        except Exception as e:
+            print(f"Stream checkpoint read error: {e}")
+            return None
+        # Eviction is lazy, so an expired checkpoint may still be on disk
+        if found is None or (found[1] is not None and time.time() - found[1] > self.ttl):
+            SSE_RESUMES.labels(source="miss").inc()
+            return None
+        SSE_RESUMES.labels(source="checkpoint").inc()
+        return self.store.follow(stream_id, seq, poll=self.checkpoint_interval, stale=self.ttl)
+
+    def _evict(self):
+        now = time.time()
+        for stream_id, buffer in list(self._live.items()):
+            if buffer.finished and now - buffer.finished_at > self.ttl:
+                del self._live[stream_id]
+        if now - self._last_evicted > self.ttl:
+            self._last_evicted = now
+            asyncio.ensure_future(self._evict_checkpoints(now - self.ttl))
+
+    async def _evict_checkpoints(self, before: float):
+        try:
+            await self.store.evict(before)
+        except Exception as e:
+            print(f"Stream checkpoint eviction error: {e}")
+
+    async def aclose(self):
+        if self._producers:
+            await asyncio.gather(*self._producers.values(), return_exceptions=True)
+        self.store.close()
+
+
+resumable_streams = ResumableStreams(
+    SQLiteStreamStore(settings.SSE_RESUME_DB),
+    ttl=settings.SSE_RESUME_TTL_SECONDS,
+    checkpoint_interval=settings.SSE_CHECKPOINT_INTERVAL_MS / 1000,
+    abandon_grace=settings.SSE_ABANDON_GRACE_SECONDS,
+)
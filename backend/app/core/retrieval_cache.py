@@ -0,0 +1,253 @@
+"""
+Query vector and retrieval result caches for app.core.rag.
+
+Two kinds of entries, each in an in-memory LRU in front of one SQLite file
+shared by all worker processes and kept across restarts:
+
+- vector: the embedding of a query text (keyed on the exact text, since the
+  embedder sees it as is)
+- result: the ranked (row, score) pairs of a search, keyed on the normalised
+  query (the text that is ranked) plus k, the source filter and the
+  retrieval mode
+
+Every entry belongs to a corpus version (see
+``app.core.corpus``). ``open`` switches to the version of the
+index just loaded: the LRUs are emptied and the file drops the rows of other
+versions, so neither vectors nor row numbers ever outlive the corpus they
+were computed against. Misses are written to the file from a background
+thread; a failing file only costs hits, never a retrieval.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+import structlog
+
+from app.core.metrics import RAG_CACHE_BYTES, RAG_CACHE_ENTRIES, RAG_CACHE_LOOKUPS
+
+logger = structlog.get_logger()
+
+KINDS = ("vector", "result")
+
+
+class _LRU:
+    """OrderedDict LRU that tracks the approximate bytes of its values."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self.nbytes = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key: str, value, size: int):
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self.nbytes -= old[1]
+        self._entries[key] = (value, size)
+        self.nbytes += size
+        while len(self._entries) > self.max_entries:
+            _, (_, evicted) = self._entries.popitem(last=False)
+            self.nbytes -= evicted
+
+    def clear(self):
+        self._entries.clear()
+        self.nbytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def _encode(kind: str, value) -> bytes:
+    if kind == "vector":
+        return np.asarray(value, dtype=np.float32).tobytes()
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def _decode(kind: str, blob: bytes):
+    if kind == "vector":
+        return np.frombuffer(blob, dtype=np.float32)
+    return [tuple(pair) for pair in json.loads(blob)]
+
+
+def _size(kind: str, key: str, value) -> int:
+    # Key and payload; the dict/tuple overhead is roughly constant per entry
+    if kind == "vector":
+        return len(key.encode("utf-8")) + value.nbytes
+    return len(key.encode("utf-8")) + 16 * len(value)
+
+
+class RetrievalCache:
+    def __init__(self, path: str, max_entries: int = 4096, max_disk_entries: int = 100000):
+        self.path = path
+        self.max_disk_entries = max_disk_entries
+        self.version: Optional[str] = None
+        self._memory: Dict[str, _LRU] = {kind: _LRU(max_entries) for kind in KINDS}
+        self._counts = {kind: {"memory_hit": 0, "disk_hit": 0, "miss": 0} for kind in KINDS}
+        self._lock = threading.Lock()
+        # WAL: every reading thread gets its own connection and never waits for the writer,
+        # which owns one more on the single writer thread
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._writer: Optional[ThreadPoolExecutor] = None
+        self._writes = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS rag_cache (
+                kind TEXT NOT NULL,
+                version TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (kind, version, key)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS rag_cache_created ON rag_cache (created_at);
+        """)
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def _db(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def open(self, version: str):
+        """Serve entries of corpus ``version`` only; entries of other versions are dropped."""
+        with self._lock:
+            self.version = version
+            for memory in self._memory.values():
+                memory.clear()
+            for kind, memory in self._memory.items():
+                RAG_CACHE_ENTRIES.labels(cache=kind).set(0)
+                RAG_CACHE_BYTES.labels(cache=kind, tier="memory").set(0)
+        self._submit(self._purge, version)
+
+    def vector(self, query: str, compute: Callable[[], np.ndarray]) -> np.ndarray:
+        """The cached embedding of ``query``, or ``compute()`` stored."""
+        return self._get("vector", query, compute)
+
+    def results(self, key: str, compute: Callable[[], List[tuple]]) -> List[tuple]:
+        """The cached (row, score) ranking for ``key``, or ``compute()`` stored."""
+        return self._get("result", key, compute)
+
+    def _get(self, kind: str, key: str, compute: Callable):
+        version = self.version
+        with self._lock:
+            value = self._memory[kind].get(key)
+        if value is not None:
+            self._record(kind, "memory_hit")
+            return value
+        blob = self._safe(self._read, kind, version, key)
+        if blob is not None:
+            value = _decode(kind, blob)
+            self._record(kind, "disk_hit")
+        else:
+            value = compute()
+            self._record(kind, "miss")
+            self._submit(self._insert, kind, version, key, _encode(kind, value))
+        with self._lock:
+            if version == self.version:
+                self._memory[kind].put(key, value, _size(kind, key, value))
+                RAG_CACHE_ENTRIES.labels(cache=kind).set(len(self._memory[kind]))
+                RAG_CACHE_BYTES.labels(cache=kind, tier="memory").set(self._memory[kind].nbytes)
+        return value
+
+    def stats(self) -> Dict:
+        stats = {}
+        for kind, counts in self._counts.items():
+            lookups = sum(counts.values())
+            hits = counts["memory_hit"] + counts["disk_hit"]
+            stats[kind] = {
+                "entries": len(self._memory[kind]),
+                "memory_bytes": self._memory[kind].nbytes,
+                **counts,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+        return stats
+
+    def close(self):
+        """Finish pending writes and close every connection."""
+        if self._writer is not None:
+            self._writer.shutdown(wait=True)
+            self._writer = None
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    def _record(self, kind: str, result: str):
+        self._counts[kind][result] += 1
+        RAG_CACHE_LOOKUPS.labels(cache=kind, result=result).inc()
+
+    def _safe(self, fn, *args):
+        try:
+            return fn(self._db(), *args)
+        except sqlite3.Error as exc:
+            logger.warning("rag_cache_disk_error", path=self.path, error=str(exc))
+            return None
+
+    def _submit(self, fn, *args):
+        with self._lock:
+            if self._writer is None:
+                self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-cache")
+            self._writer.submit(self._safe, fn, *args)
+
+    @staticmethod
+    def _read(db: sqlite3.Connection, kind: str, version: str, key: str) -> Optional[bytes]:
+        row = db.execute(
+            "SELECT value FROM rag_cache WHERE kind = ? AND version = ? AND key = ?", (kind, version, key)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _insert(self, db: sqlite3.Connection, kind: str, version: str, key: str, blob: bytes):
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO rag_cache (kind, version, key, value, created_at) VALUES (?, ?, ?, ?, ?)",
+                (kind, version, key, blob, time.time()),
+            )
+        self._writes += 1
+        if self._writes % 1000 == 0:
+            self._trim(db)
+        if self._writes % 100 == 0:
+            self._report_disk_size(db)
+
+    def _purge(self, db: sqlite3.Connection, version: str):
+        with db:
+            db.execute("DELETE FROM rag_cache WHERE version != ?", (version,))
+        self._trim(db)
+        self._report_disk_size(db)
+
+    def _trim(self, db: sqlite3.Connection):
+        # Keep the newest max_disk_entries rows
+        with db:
+            db.execute(
+                "DELETE FROM rag_cache WHERE created_at < ("
+                "SELECT created_at FROM rag_cache ORDER BY created_at DESC LIMIT 1 OFFSET ?)",
+                (self.max_disk_entries - 1,),
+            )
+
+    @staticmethod
+    def _report_disk_size(db: sqlite3.Connection):
+        pages, page_size = db.execute("PRAGMA page_count").fetchone()[0], db.execute("PRAGMA page_size").fetchone()[0]
+        RAG_CACHE_BYTES.labels(cache="all", tier="disk").set(pages * page_size)
@@ -0,0 +1,118 @@
+"""
+Single-flight coalescing of identical in-flight work.
+
+Concurrent callers that use the same key share one execution: ``do`` for
+coroutines returning a value, ``stream`` for async generators whose items are
+fanned out to every subscriber. Late subscribers first receive the items
+already produced, then follow the live stream.
+
+Each caller can be cancelled independently (e.g. its HTTP client went away);
+the shared execution is only cancelled when its last caller leaves.
+"""
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Tuple
+
+from app.core.metrics import SINGLEFLIGHT_REQUESTS, SINGLEFLIGHT_INFLIGHT
+
+
+class _Flight:
+    def __init__(self):
+        self.task: asyncio.Task = None
+        self.subscribers = 0
+        self.items: List[Any] = []
+        self.done = False
+        self.error: BaseException = None
+        self._changed = asyncio.Event()
+
+    def notify(self):
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights: Dict[Tuple[str, str], _Flight] = {}
+
+    def inflight(self) -> int:
+        return len(self._flights)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """Run ``fn()`` once for all concurrent callers of ``key`` and share its result."""
+        flight = self._join("call", key)
+        if flight.task is None:
+            flight.task = asyncio.ensure_future(fn())
+            self._track(("call", key), flight)
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            self._leave(flight)
+
+    async def stream(self, key: str, fn: Callable[[], AsyncIterator[Any]]) -> AsyncIterator[Any]:
+        """Subscribe to the shared stream for ``key``, starting ``fn()`` if nobody else has."""
+        flight = self._join("stream", key)
+        if flight.task is None:
+            flight.task = asyncio.ensure_future(self._pump(flight, fn))
+            self._track(("stream", key), flight)
+        try:
+            index = 0
+            while True:
+                changed = flight._changed
+                while index < len(flight.items):
+                    yield flight.items[index]
+                    index += 1
+                if flight.done:
+                    if flight.error is not None:
+                        raise flight.error
+                    return
+                await changed.wait()
+        finally:
+            self._leave(flight)
+
+    def _join(self, mode: str, key: str) -> _Flight:
+        flight = self._flights.get((mode, key))
+        role = "follower"
+        if flight is None:
+            flight = _Flight()
+            self._flights[(mode, key)] = flight
+            role = "leader"
+        flight.subscribers += 1
+        SINGLEFLIGHT_REQUESTS.labels(mode=mode, role=role).inc()
+        return flight
+
+    def _track(self, flight_key: Tuple[str, str], flight: _Flight):
+        SINGLEFLIGHT_INFLIGHT.inc()
+
+        def _finished(_task):
+            SINGLEFLIGHT_INFLIGHT.dec()
+            if self._flights.get(flight_key) is flight:
+                del self._flights[flight_key]
+
+        flight.task.add_done_callback(_finished)
+
+    def _leave(self, flight: _Flight):
+        flight.subscribers -= 1
+        if flight.subscribers == 0 and not flight.task.done():
+            # Last interested caller is gone: stop the upstream work and make
+            # sure nobody attaches to the dying flight
+            for flight_key, candidate in list(self._flights.items()):
+                if candidate is flight:
+                    del self._flights[flight_key]
+            flight.task.cancel()
+
+    @staticmethod
+    async def _pump(flight: _Flight, fn: Callable[[], AsyncIterator[Any]]):
+        try:
+            async for item in fn():
+                flight.items.append(item)
+                flight.notify()
+        except asyncio.CancelledError:
+            flight.error = asyncio.CancelledError()
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            flight.done = True
+            flight.notify()
+
+
+single_flight = SingleFlight()
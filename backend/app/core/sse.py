@@ -0,0 +1,102 @@
+"""
+Helpers for the chat SSE stream: frame construction and token coalescing.
+"""
+import asyncio
+import json
+from typing import Any, AsyncIterator, Dict, List, Union
+
+STREAM_MODES = ("full", "compact")
+
+_END = object()
+_FLUSH = object()
+
+
+class _SourceError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def message_frame(payload: Dict[str, Any]) -> dict:
+    # Raw UTF-8 instead of \uXXXX escapes: a CJK character is 3 bytes, not 6
+    return {"event": "message", "data": json.dumps(payload, ensure_ascii=False)}
+
+
+def token_frame(content: str) -> dict:
+    return message_frame({"type": "token", "content": content})
+
+
+async def coalesce_tokens(
+    source: AsyncIterator[Union[str, dict]],
+    window_ms: float = 50,
+    max_bytes: int = 1024,
+) -> AsyncIterator[dict]:
+    """
+    Batch token text from ``source`` into token frames.
+
+    ``source`` yields token text (``str``) or ready-made frames (``dict``).
+    The first token is sent immediately so time-to-first-token is unaffected;
+    later tokens are buffered until ``window_ms`` has passed since the first
+    buffered token or ``max_bytes`` of UTF-8 text has accumulated. Any other
+    frame flushes the buffer first, so ordering is preserved.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def pump():
+        try:
+            async for item in source:
+                queue.put_nowait(item)
+        except Exception as e:
+            queue.put_nowait(_SourceError(e))
+        finally:
+            queue.put_nowait(_END)
+
+    pending: List[str] = []
+    pending_bytes = 0
+    timer = None
+    first_token = True
+    task = asyncio.ensure_future(pump())
+
+    def flush() -> dict:
+        nonlocal pending, pending_bytes, timer
+        if timer is not None:
+            timer.cancel()
+            timer = None
+        frame = token_frame("".join(pending))
+        pending, pending_bytes = [], 0
+        return frame
+
+    try:
+        while True:
+            item = await queue.get()
+
+            if item is _FLUSH:
+                if pending:
+                    yield flush()
+                continue
+            if item is _END:
+                if pending:
+                    yield flush()
+                return
+            if isinstance(item, _SourceError):
+                raise item.error
+            if isinstance(item, str):
+                if first_token:
+                    first_token = False
+                    yield token_frame(item)
+                    continue
+                if not pending:
+                    # The window timer posts a flush marker behind any queued tokens
+                    timer = loop.call_later(window_ms / 1000, queue.put_nowait, _FLUSH)
+                pending.append(item)
+                pending_bytes += len(item.encode("utf-8"))
+                if pending_bytes >= max_bytes:
+                    yield flush()
+            else:
+                if pending:
+                    yield flush()
+                yield item
+    finally:
+        if timer is not None:
+            timer.cancel()
+        task.cancel()
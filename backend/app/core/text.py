@@ -0,0 +1,39 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+import opencc
+
+# 繁体转简体，进程内共享一个转换器
+_t2s = opencc.OpenCC("t2s")
+
+_WHITESPACE = re.compile(r"\s+")
+_DIGITS = re.compile(r"\d+")
+
+
+def _is_punct(ch: str) -> bool:
+    return unicodedata.category(ch).startswith(("P", "S"))
+
+
+def to_simplified(text: str) -> str:
+    """NFKC (full-width -> half-width), traditional -> simplified Chinese, lower case."""
+    text = unicodedata.normalize("NFKC", text or "")
+    return _t2s.convert(text).lower()
+
+
+def normalize_text(text: str) -> str:
+    """``to_simplified`` with whitespace and punctuation removed."""
+    text = to_simplified(text)
+    text = "".join(ch for ch in text if not _is_punct(ch))
+    return _WHITESPACE.sub("", text)
+
+
+@lru_cache(maxsize=4096)
+def normalize_question(text: str) -> str:
+    """Canonical form of a user question used for cache and dedup keys."""
+    return normalize_text(text)
+
+
+def extract_numbers(text: str) -> tuple:
+    """Digit runs in ``text``; years and dates must match exactly between cache hits."""
+    return tuple(_DIGITS.findall(text))
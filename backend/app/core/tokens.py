@@ -0,0 +1,49 @@
+"""
+Local token counting for prompt budgets.
+
+``CONTEXT_TOKENIZER=estimate`` (the default) uses a conservative offline
+estimate: one token per CJK character, one per four letters of a Latin word,
+one per three digits and one per other symbol. Any other value names a
+tiktoken encoding (e.g. ``cl100k_base``), used when its BPE file is available
+locally; otherwise the estimate is used.
+"""
+import math
+import re
+from functools import lru_cache
+
+from app.core.config import settings
+
+_PIECES = re.compile(r"[㐀-鿿豈-﫿]|[A-Za-z]+|\d+|\S")
+
+
+@lru_cache(maxsize=1)
+def _encoding():
+    if settings.CONTEXT_TOKENIZER == "estimate":
+        return None
+    try:
+        import tiktoken
+        return tiktoken.get_encoding(settings.CONTEXT_TOKENIZER)
+    except Exception as e:
+        print(f"Tokenizer {settings.CONTEXT_TOKENIZER} unavailable, estimating tokens: {e}")
+        return None
+
+
+def estimate_tokens(text: str) -> int:
+    count = 0
+    for piece in _PIECES.findall(text):
+        if piece.isascii() and piece.isalpha():
+            count += math.ceil(len(piece) / 4)
+        elif piece.isdigit():
+            count += math.ceil(len(piece) / 3)
+        else:
+            count += 1
+    return count
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _encoding()
+    if encoding is None:
+        return estimate_tokens(text)
+    return len(encoding.encode(text, disallowed_special=()))
@@ -0,0 +1,185 @@
+"""
+In-process vector index over memory-mapped embeddings.
+
+An index is two files next to each other:
+
+- ``<path>.npy``: float32 matrix, one L2-normalised embedding per row
+- ``<path>.meta.json``: the embedder and backend used, and the text,
+  ``source`` and ``name`` of every row as parallel lists
+
+The matrix is opened with ``np.load(mmap_mode="r")``: pages are read on
+first use and shared through the page cache by every worker process on the
+host. A query is one matrix-vector product plus ``argpartition`` for the
+top k; metadata filters select rows before the ranking. No external service
+is involved.
+
+``write_index`` (or ``IndexWriter``, batch by batch) replaces both files
+atomically, so a running process keeps its mapping of the previous index
+until it reloads.
+"""
+import json
+import os
+import shutil
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.core.embeddings import backend_of
+
+META_SUFFIX = ".meta.json"
+VECTORS_SUFFIX = ".npy"
+FORMAT_VERSION = 1
+
+
+@dataclass
+class SearchHit:
+    text: str
+    source: str
+    name: str
+    score: float
+
+
+class IndexWriter:
+    """
+    Streams an index to disk in batches (``add``), for corpora that do not fit
+    in memory: vector rows and texts go to temporary files as they arrive, and
+    ``close`` assembles ``<path>.npy`` and ``<path>.meta.json`` and swaps them in.
+    Only the short ``source``/``name`` columns are held in memory.
+    """
+
+    def __init__(self, path: str, dim: int, embedder: str, backend: str):
+        self.path = path
+        self.dim = dim
+        self.embedder = embedder
+        self.backend = backend
+        self.count = 0
+        self.sources: List[str] = []
+        self.names: List[str] = []
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._rows = open(path + ".rows.tmp", "w+b")
+        self._texts = open(path + ".texts.tmp", "w+", encoding="utf-8")
+
+    def add(self, vectors: np.ndarray, texts: Sequence[str], sources: Sequence[str], names: Sequence[str]):
+        if not len(vectors) == len(texts) == len(sources) == len(names):
+            raise ValueError("embeddings and metadata must have one entry per document")
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        self._rows.write((vectors / np.where(norms > 0, norms, 1)).tobytes())
+        for text in texts:
+            self._texts.write(json.dumps(text, ensure_ascii=False))
+            self._texts.write("\n")
+        self.sources.extend(sources)
+        self.names.extend(names)
+        self.count += len(texts)
+
+    def row(self, i: int) -> np.ndarray:
+        """A row written earlier (duplicate texts reuse its vector)."""
+        self._rows.flush()
+        size = self.dim * 4
+        return np.frombuffer(os.pread(self._rows.fileno(), size, i * size), dtype=np.float32)
+
+    def close(self):
+        self._rows.flush()
+        self._rows.seek(0)
+        with open(self.path + VECTORS_SUFFIX + ".tmp", "wb") as f:
+            header = {"descr": np.lib.format.dtype_to_descr(np.dtype(np.float32)), "fortran_order": False,
+                      "shape": (self.count, self.dim)}
+            np.lib.format.write_array_header_1_0(f, header)
+            shutil.copyfileobj(self._rows, f, 1 << 20)
+        self._texts.flush()
+        self._texts.seek(0)
+        with open(self.path + META_SUFFIX + ".tmp", "w", encoding="utf-8") as f:
+            head = {"version": FORMAT_VERSION, "embedder": self.embedder, "backend": self.backend, "dim": self.dim}
+            f.write(json.dumps(head, ensure_ascii=False, separators=(",", ":"))[:-1])
+            f.write(',"text":[')
+            for i, line in enumerate(self._texts):
+                if i:
+                    f.write(",")
+                f.write(line.rstrip("\n"))
+            f.write('],"source":')
+            json.dump(self.sources, f, ensure_ascii=False, separators=(",", ":"))
+            f.write(',"name":')
+            json.dump(self.names, f, ensure_ascii=False, separators=(",", ":"))
+            f.write("}")
+        self._discard()
+        os.replace(self.path + VECTORS_SUFFIX + ".tmp", self.path + VECTORS_SUFFIX)
+        os.replace(self.path + META_SUFFIX + ".tmp", self.path + META_SUFFIX)
+
+    def abort(self):
+        self._discard()
+
+    def _discard(self):
+        for f in (self._rows, self._texts):
+            f.close()
+            if os.path.exists(f.name):
+                os.remove(f.name)
+
+
+def write_index(path: str, embeddings: np.ndarray, texts: Sequence[str], sources: Sequence[str],
+                names: Sequence[str], embedder: str, backend: str):
+    """Write normalised ``embeddings`` and their metadata to ``path``.npy/.meta.json."""
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    writer = IndexWriter(path, int(vectors.shape[1]) if vectors.ndim == 2 else 0, embedder, backend)
+    try:
+        writer.add(vectors, texts, sources, names)
+    except Exception:
+        writer.abort()
+        raise
+    writer.close()
+
+
+class VectorIndex:
+    """Read-only top-k cosine search over an index written by ``write_index``."""
+
+    def __init__(self, path: str):
+        with open(path + META_SUFFIX, encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("version") != FORMAT_VERSION:
+            raise ValueError(f"unsupported index format {meta.get('version')!r} in {path}")
+        self.path = path
+        self.embedder: str = meta["embedder"]
+        # Indexes from before the backend was recorded were built with PyTorch
+        self.backend: str = meta.get("backend") or backend_of(self.embedder, "torch")
+        self.dim: int = meta["dim"]
+        self.vectors: np.ndarray = np.load(path + VECTORS_SUFFIX, mmap_mode="r")
+        self.texts: List[str] = meta["text"]
+        self.sources: List[str] = meta["source"]
+        self.names: List[str] = meta["name"]
+        if self.vectors.shape != (len(self.texts), self.dim):
+            raise ValueError(f"{path}: {self.vectors.shape} vectors for {len(self.texts)} documents of dim {self.dim}")
+        # Row numbers per source, for filtered queries
+        sources = np.asarray(self.sources)
+        self._rows: Dict[str, np.ndarray] = {s: np.flatnonzero(sources == s) for s in set(self.sources)}
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def source_rows(self, source: str) -> np.ndarray:
+        """Row numbers of the documents from ``source`` (empty for unknown sources)."""
+        return self._rows.get(source, np.zeros(0, dtype=np.intp))
+
+    def top(self, query: np.ndarray, k: int, rows: Optional[np.ndarray] = None):
+        """Row numbers and scores of the ``k`` rows (of ``rows``, default all) most similar to ``query``."""
+        if rows is None:
+            return top_k(self.vectors @ query, k)
+        order, scores = top_k(self.vectors[rows] @ query, k)
+        return rows[order], scores
+
+    def search(self, query: np.ndarray, k: int, source: Optional[str] = None) -> List[SearchHit]:
+        """The ``k`` rows most similar to the normalised ``query``, best first."""
+        rows = None if source is None else self.source_rows(source)
+        return [self.hit(int(r), float(s)) for r, s in zip(*self.top(query, k, rows))]
+
+    def hit(self, row: int, score: float) -> SearchHit:
+        return SearchHit(text=self.texts[row], source=self.sources[row], name=self.names[row], score=score)
+
+
+def top_k(scores: np.ndarray, k: int):
+    """Indices and values of the ``k`` largest ``scores``, best first (argpartition, then a sort of k)."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.intp), scores[:0]
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return top, scores[top]
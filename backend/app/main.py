@@ -2,14 +2,18 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from contextlib import asynccontextmanager
 import structlog
+from prometheus_fastapi_instrumentator import Instrumentator
 
 from app.core.config import settings
 from app.api.endpoints import auth, chat, history, misc
+from app.core.tracing import TraceMiddleware
 from app.db import init_db
 
 # Configure structured logging
 structlog.configure(
     processors=[
+        # Request-scoped fields such as trace_id (app.core.tracing)
+        structlog.contextvars.merge_contextvars,
         structlog.processors.TimeStamper(fmt="iso"),
         structlog.processors.JSONRenderer()
     ]
@@ -30,9 +34,30 @@ async def lifespan(app: FastAPI):
         await init_tutorials(db)
     
     logger.info("Database initialized successfully")
+
+    # 预编译Agent工作流，所有请求共享同一份编译结果
+    from app.agent.registry import graph_registry
+    build_times = graph_registry.warm()
+    logger.info("graph_registry_warmed", build_ms=build_times)
+    # 64卦表（按爻象索引）
+    from app.tools import hexagrams
+    hexagrams.load_table()
+    # 映射知识库向量索引（多个worker进程共享页缓存）
+    from app.core import rag
+    rag.load_index()
+    # 预加载分词词典，避免首个问题等待约1秒
+    from app.core import bm25
+    bm25.warm()
     yield
     # 关闭时清理资源
     logger.info("Shutting down...")
+    from app.core.llm import llm_clients
+    from app.core.memory import session_memory
+    from app.core.resumable import resumable_streams
+    rag.close()
+    await resumable_streams.aclose()
+    await session_memory.aclose()
+    await llm_clients.aclose()
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
@@ -49,7 +74,13 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Trace-ID"],
 )
+# Every request gets a trace ID in its logs, SSE done frame and response headers
+app.add_middleware(TraceMiddleware)
+
+# Prometheus metrics: HTTP request metrics plus everything in app.core.metrics
+Instrumentator(excluded_handlers=["/metrics", "/health"]).instrument(app).expose(app, include_in_schema=False)
 
 # Include routers
 app.include_router(auth.router, prefix=f"{settings.API_V1_STR}/auth", tags=["auth"])
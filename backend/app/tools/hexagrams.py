@@ -0,0 +1,193 @@
+"""
+The 64 hexagrams as a table indexed by line pattern.
+
+A pattern is six characters, bottom line first, "1" for yang and "0" for
+yin; ``int(pattern, 2)`` is the hexagram's slot in the table, so a lookup is
+one list index. Each entry carries the King Wen number, name, title
+(乾为天), upper and lower trigrams, and the text of data/iching.txt split
+out: 卦辞 and the six 爻辞 (plus 用九/用六), each with original text and
+translation. Hexagrams the corpus has no text for keep empty strings.
+
+The table is built once from the corpus by ``scripts/build_hexagrams.py``
+into app/data/hexagrams.json; the app only loads that file.
+"""
+import json
+import os
+import re
+from typing import Dict, List, Optional
+
+TABLE_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "hexagrams.json")
+
+# Trigram -> (lines bottom first, nature)
+TRIGRAMS = {
+    "乾": ("111", "天"),
+    "兑": ("110", "泽"),
+    "离": ("101", "火"),
+    "震": ("100", "雷"),
+    "巽": ("011", "风"),
+    "坎": ("010", "水"),
+    "艮": ("001", "山"),
+    "坤": ("000", "地"),
+}
+
+# King Wen order: (name, upper trigram, lower trigram)
+KING_WEN = [
+    ("乾", "乾", "乾"), ("坤", "坤", "坤"), ("屯", "坎", "震"), ("蒙", "艮", "坎"),
+    ("需", "坎", "乾"), ("讼", "乾", "坎"), ("师", "坤", "坎"), ("比", "坎", "坤"),
+    ("小畜", "巽", "乾"), ("履", "乾", "兑"), ("泰", "坤", "乾"), ("否", "乾", "坤"),
+    ("同人", "乾", "离"), ("大有", "离", "乾"), ("谦", "坤", "艮"), ("豫", "震", "坤"),
+    ("随", "兑", "震"), ("蛊", "艮", "巽"), ("临", "坤", "兑"), ("观", "巽", "坤"),
+    ("噬嗑", "离", "震"), ("贲", "艮", "离"), ("剥", "艮", "坤"), ("复", "坤", "震"),
+    ("无妄", "乾", "震"), ("大畜", "艮", "乾"), ("颐", "艮", "震"), ("大过", "兑", "巽"),
+    ("坎", "坎", "坎"), ("离", "离", "离"), ("咸", "兑", "艮"), ("恒", "震", "巽"),
+    ("遯", "乾", "艮"), ("大壮", "震", "乾"), ("晋", "离", "坤"), ("明夷", "坤", "离"),
+    ("家人", "巽", "离"), ("睽", "离", "兑"), ("蹇", "坎", "艮"), ("解", "震", "坎"),
+    ("损", "艮", "兑"), ("益", "巽", "震"), ("夬", "兑", "乾"), ("姤", "乾", "巽"),
+    ("萃", "兑", "坤"), ("升", "坤", "巽"), ("困", "兑", "坎"), ("井", "坎", "巽"),
+    ("革", "兑", "离"), ("鼎", "离", "巽"), ("震", "震", "震"), ("艮", "艮", "艮"),
+    ("渐", "巽", "艮"), ("归妹", "震", "兑"), ("丰", "震", "离"), ("旅", "离", "艮"),
+    ("巽", "巽", "巽"), ("兑", "兑", "兑"), ("涣", "巽", "坎"), ("节", "坎", "兑"),
+    ("中孚", "巽", "兑"), ("小过", "震", "艮"), ("既济", "坎", "离"), ("未济", "离", "坎"),
+]
+
+_POSITIONS = ("初", "二", "三", "四", "五", "上")
+_HEADER = re.compile(r"^第.+?卦\s+(\S+)\s+(\S+)\s+(\S)上(\S)下")
+_LABELED = re.compile(r"^(\S+?)：(.*)$")
+
+_table: Optional[List[list]] = None
+
+
+def pattern_of(upper: str, lower: str) -> str:
+    return TRIGRAMS[lower][0] + TRIGRAMS[upper][0]
+
+
+def line_label(position: int, yang: bool) -> str:
+    """初九, 六二, ... 上六 for line ``position`` (0 = bottom)."""
+    number = "九" if yang else "六"
+    if position in (0, 5):
+        return _POSITIONS[position] + number
+    return number + _POSITIONS[position]
+
+
+def _title(name: str, upper: str, lower: str) -> str:
+    if upper == lower:
+        return f"{name}为{TRIGRAMS[upper][1]}"
+    return f"{TRIGRAMS[upper][1]}{TRIGRAMS[lower][1]}{name}"
+
+
+def _empty_entry(number: int, name: str, upper: str, lower: str) -> Dict:
+    pattern = pattern_of(upper, lower)
+    return {
+        "number": number,
+        "name": name,
+        "title": _title(name, upper, lower),
+        "upper": upper,
+        "lower": lower,
+        "pattern": pattern,
+        "judgment": {"text": "", "translation": ""},
+        "lines": [{"label": line_label(i, bit == "1"), "text": "", "translation": ""} for i, bit in enumerate(pattern)],
+        # 用九 / 用六, only 乾 and 坤 have one
+        "extra": None,
+    }
+
+
+def build_table(corpus: str) -> List[Dict]:
+    """Parse the corpus into the 64 entries, ordered by ``int(pattern, 2)``."""
+    entries = {name: _empty_entry(i + 1, name, upper, lower) for i, (name, upper, lower) in enumerate(KING_WEN)}
+    entry, section = None, None
+    for raw in corpus.splitlines():
+        line = raw.strip()
+        header = _HEADER.match(line)
+        if header:
+            name, _, upper, lower = header.groups()
+            entry = entries.get(name)
+            if entry is None or (entry["upper"], entry["lower"]) != (upper, lower):
+                raise ValueError(f"unknown hexagram header: {line}")
+            section = None
+        elif line in ("【原文】", "【译文】"):
+            section = "text" if line == "【原文】" else "translation"
+        elif line and entry is not None and section:
+            labeled = _LABELED.match(line)
+            if labeled is None:
+                raise ValueError(f"{entry['name']}: unlabeled line: {line}")
+            _fill(entry, section, *labeled.groups())
+    table: List[Optional[Dict]] = [None] * 64
+    for entry in entries.values():
+        table[int(entry["pattern"], 2)] = entry
+    return table
+
+
+def _fill(entry: Dict, section: str, label: str, text: str):
+    if label in (entry["name"], entry["name"] + "卦"):
+        entry["judgment"][section] = text
+        return
+    for line in entry["lines"]:
+        if line["label"] == label:
+            line[section] = text
+            return
+    if label in ("用九", "用六"):
+        entry["extra"] = entry["extra"] or {"label": label, "text": "", "translation": ""}
+        entry["extra"][section] = text
+        return
+    raise ValueError(f"{entry['name']}: unexpected line label {label}")
+
+
+# Serialized form: one positional row per entry, without what the pattern implies
+# (title, line labels), so the file stays small and parses in a fraction of a millisecond:
+# [number, name, upper, lower, [judgment], [[line] * 6], [extra label, text, translation] | null]
+# where each text is [original, translation]
+
+def _row(entry: Dict) -> list:
+    extra = entry["extra"]
+    return [
+        entry["number"], entry["name"], entry["upper"], entry["lower"],
+        [entry["judgment"]["text"], entry["judgment"]["translation"]],
+        [[line["text"], line["translation"]] for line in entry["lines"]],
+        [extra["label"], extra["text"], extra["translation"]] if extra else None,
+    ]
+
+
+def _entry(row: list) -> Dict:
+    number, name, upper, lower, judgment, lines, extra = row
+    pattern = pattern_of(upper, lower)
+    return {
+        "number": number,
+        "name": name,
+        "title": _title(name, upper, lower),
+        "upper": upper,
+        "lower": lower,
+        "pattern": pattern,
+        "judgment": {"text": judgment[0], "translation": judgment[1]},
+        "lines": [
+            {"label": line_label(i, bit == "1"), "text": text, "translation": translation}
+            for i, (bit, (text, translation)) in enumerate(zip(pattern, lines))
+        ],
+        "extra": {"label": extra[0], "text": extra[1], "translation": extra[2]} if extra else None,
+    }
+
+
+def write_table(table: List[Dict], path: str = TABLE_PATH):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump([_row(entry) for entry in table], f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(path + ".tmp", path)
+
+
+def load_table(path: str = TABLE_PATH) -> List[list]:
+    """(Re)load the table rows; entries are expanded on lookup."""
+    global _table
+    with open(path, encoding="utf-8") as f:
+        _table = json.load(f)
+    return _table
+
+
+def hexagram(pattern: str) -> Dict:
+    """The hexagram whose lines (bottom first, "1" = yang) are ``pattern``."""
+    table = _table if _table is not None else load_table()
+    return _entry(table[int(pattern, 2)])
+
+
+def hexagrams() -> List[Dict]:
+    """All 64 entries, in King Wen order."""
+    table = _table if _table is not None else load_table()
+    return sorted((_entry(row) for row in table), key=lambda entry: entry["number"])
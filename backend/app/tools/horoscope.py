@@ -4,6 +4,13 @@ from pydantic import BaseModel, Field
 from datetime import datetime
 import json
 
+# Last day of each month's first sign, and the signs in calendar order
+SIGN_CUTOFF_DAYS = [20, 19, 21, 20, 21, 22, 23, 23, 23, 24, 22, 22]
+SIGNS = [
+    "摩羯座", "水瓶座", "双鱼座", "白羊座", "金牛座", "双子座",
+    "巨蟹座", "狮子座", "处女座", "天秤座", "天蝎座", "射手座", "摩羯座"
+]
+
 class HoroscopeInput(BaseModel):
     date_str: str = Field(..., description="Birth date in YYYY-MM-DD format")
 
@@ -25,15 +32,10 @@ class HoroscopeTool(BaseTool):
             return {"error": str(e)}
 
     def _get_sign(self, month: int, day: int) -> str:
-        dates = [20, 19, 21, 20, 21, 22, 23, 23, 23, 24, 22, 22]
-        signs = [
-            "摩羯座", "水瓶座", "双鱼座", "白羊座", "金牛座", "双子座",
-            "巨蟹座", "狮子座", "处女座", "天秤座", "天蝎座", "射手座", "摩羯座"
-        ]
-        if day > dates[month - 1]:
-            return signs[month]
+        if day > SIGN_CUTOFF_DAYS[month - 1]:
+            return SIGNS[month]
         else:
-            return signs[month - 1]
+            return SIGNS[month - 1]
 
     async def _arun(self, date_str: str) -> Dict:
         return self._run(date_str)
@@ -3,6 +3,21 @@ from typing import List, Dict, Tuple
 from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
 
+from app.tools.hexagrams import hexagram
+
+
+def _summary(entry: Dict) -> Dict:
+    # What an answer needs; the full entry (every 爻辞) stays in the table
+    return {
+        "number": entry["number"],
+        "name": entry["name"],
+        "title": entry["title"],
+        "upper": entry["upper"],
+        "lower": entry["lower"],
+        "pattern": entry["pattern"],
+        "judgment": entry["judgment"]["text"],
+    }
+
 class IChingInput(BaseModel):
     question: str = Field(..., description="The question for divination")
 
@@ -24,6 +39,7 @@ class IChingTool(BaseTool):
                 "question": question,
                 "original_hexagram": original_hexagram,
                 "changed_hexagram": changed_hexagram,
+                "moving_lines": self._moving_lines(hexagram_lines),
                 "lines": hexagram_lines
             }
         except Exception as e:
@@ -46,19 +62,25 @@ class IChingTool(BaseTool):
             lines.append(total)
         return lines
 
-    def _identify_hexagram(self, lines: List[int]) -> str:
-        # Simplified mapping logic for demonstration
-        # In a real app, this would map the binary pattern (0/1) to the 64 hexagram names
+    def _identify_hexagram(self, lines: List[int]) -> Dict:
         # 6->0 (Yin), 7->1 (Yang), 8->0 (Yin), 9->1 (Yang)
         binary = "".join(["1" if x in [7, 9] else "0" for x in lines])
-        # TODO: Implement full 64 hexagram lookup
-        return f"Hexagram Pattern: {binary}"
+        return _summary(hexagram(binary))
 
-    def _identify_changed_hexagram(self, lines: List[int]) -> str:
+    def _identify_changed_hexagram(self, lines: List[int]) -> Dict:
         # 6->1 (Old Yin changes to Yang), 9->0 (Old Yang changes to Yin)
         # 7->1 (Young Yang stays Yang), 8->0 (Young Yin stays Yin)
         binary = "".join(["1" if x in [6, 7] else "0" for x in lines])
-        return f"Changed Hexagram Pattern: {binary}"
+        return _summary(hexagram(binary))
+
+    def _moving_lines(self, lines: List[int]) -> List[Dict]:
+        """爻辞 of the moving lines (6 and 9), read from the original hexagram."""
+        binary = "".join(["1" if x in [7, 9] else "0" for x in lines])
+        entry = hexagram(binary)
+        return [
+            {"label": line["label"], "text": line["text"]}
+            for line, x in zip(entry["lines"], lines) if x in [6, 9]
+        ]
 
     async def _arun(self, question: str) -> Dict:
         return self._run(question)
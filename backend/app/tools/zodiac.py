@@ -2,6 +2,25 @@ from typing import Dict, List
 from langchain.tools import BaseTool
 from pydantic import BaseModel, Field
 
+ZODIAC_SIGNS = ["鼠", "牛", "虎", "兔", "龙", "蛇", "马", "羊", "猴", "鸡", "狗", "猪"]
+
+# Simplified compatibility table, built once
+COMPATIBILITY = {
+    "鼠": {"best": ["龙", "猴", "牛"], "worst": ["马", "羊", "鸡"]},
+    "牛": {"best": ["鼠", "蛇", "鸡"], "worst": ["马", "羊", "狗"]},
+    "虎": {"best": ["马", "狗", "猪"], "worst": ["蛇", "猴"]},
+    "兔": {"best": ["羊", "狗", "猪"], "worst": ["鼠", "鸡", "龙"]},
+    "龙": {"best": ["鼠", "猴", "鸡"], "worst": ["狗", "兔"]},
+    "蛇": {"best": ["牛", "鸡"], "worst": ["猪", "虎"]},
+    "马": {"best": ["虎", "羊", "狗"], "worst": ["鼠", "牛"]},
+    "羊": {"best": ["兔", "马", "猪"], "worst": ["鼠", "牛", "狗"]},
+    "猴": {"best": ["鼠", "龙"], "worst": ["虎", "猪"]},
+    "鸡": {"best": ["牛", "龙", "蛇"], "worst": ["兔", "狗"]},
+    "狗": {"best": ["虎", "兔", "马"], "worst": ["牛", "龙", "羊"]},
+    "猪": {"best": ["羊", "兔", "虎"], "worst": ["蛇", "猴", "猪"]}
+}
+_NO_COMPATIBILITY = {"best": [], "worst": []}
+
 class ZodiacInput(BaseModel):
     year: int = Field(..., description="Birth year (e.g., 1990)")
 
@@ -23,7 +42,6 @@ class ZodiacTool(BaseTool):
             return {"error": str(e)}
 
     def _get_zodiac_sign(self, year: int) -> str:
-        zodiacs = ["鼠", "牛", "虎", "兔", "龙", "蛇", "马", "羊", "猴", "鸡", "狗", "猪"]
         # 1900 is Rat (鼠)
         # (year - 1900) % 12
         # Actually 1900 is Rat.
@@ -33,25 +51,12 @@ class ZodiacTool(BaseTool):
         # Index 0=Rat, 1=Ox, 2=Tiger, 3=Rabbit, 4=Dragon. Correct.
         start_year = 1900
         index = (year - start_year) % 12
-        return zodiacs[index]
+        return ZODIAC_SIGNS[index]
 
     def _get_compatibility(self, sign: str) -> Dict[str, List[str]]:
-        # Simplified compatibility table
-        compatibility_map = {
-            "鼠": {"best": ["龙", "猴", "牛"], "worst": ["马", "羊", "鸡"]},
-            "牛": {"best": ["鼠", "蛇", "鸡"], "worst": ["马", "羊", "狗"]},
-            "虎": {"best": ["马", "狗", "猪"], "worst": ["蛇", "猴"]},
-            "兔": {"best": ["羊", "狗", "猪"], "worst": ["鼠", "鸡", "龙"]},
-            "龙": {"best": ["鼠", "猴", "鸡"], "worst": ["狗", "兔"]},
-            "蛇": {"best": ["牛", "鸡"], "worst": ["猪", "虎"]},
-            "马": {"best": ["虎", "羊", "狗"], "worst": ["鼠", "牛"]},
-            "羊": {"best": ["兔", "马", "猪"], "worst": ["鼠", "牛", "狗"]},
-            "猴": {"best": ["鼠", "龙"], "worst": ["虎", "猪"]},
-            "鸡": {"best": ["牛", "龙", "蛇"], "worst": ["兔", "狗"]},
-            "狗": {"best": ["虎", "兔", "马"], "worst": ["牛", "龙", "羊"]},
-            "猪": {"best": ["羊", "兔", "虎"], "worst": ["蛇", "猴", "猪"]}
-        }
-        return compatibility_map.get(sign, {"best": [], "worst": []})
+        # Fresh lists: the result goes to callers, the table stays as is
+        entry = COMPATIBILITY.get(sign, _NO_COMPATIBILITY)
+        return {"best": list(entry["best"]), "worst": list(entry["worst"])}
 
     async def _arun(self, year: int) -> Dict:
         return self._run(year)
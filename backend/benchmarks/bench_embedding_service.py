@@ -0,0 +1,157 @@
+"""
+Query embedding throughput and tail latency, per request versus micro-batched
+(app.core.embedding_service), and the accuracy of the ONNX Runtime backends
+against the full-precision model.
+
+Each client is an asyncio task issuing queries back to back the way the
+retrieve node does: ``asyncio.to_thread(embedder.embed, q)`` directly, or
+``service.aembed(q)``. Embedders, each skipped with the reason when its
+packages or files are missing:
+
+- hashing: the model-free HashingEmbedder (~20us a query), for reference
+- torch: ``--model`` (BAAI/bge-m3) with sentence-transformers, full precision
+- onnx, onnx-int8: its export in ``--onnx-dir`` (scripts/export_onnx.py) on
+  ONNX Runtime, full precision and dynamically int8-quantised
+
+Accuracy, with the torch vectors as reference (the index is built with them):
+
+- cosine: agreement of each backend's query vectors with the reference's
+- recall@k: share of the reference's top-k rows, over an index of the corpus
+  lines embedded by the reference, that the backend's query vector retrieves
+- batched: max |batched - direct| of the service's vectors (padding in a
+  batch must not change a query's vector)
+
+Usage (from backend/):
+    python benchmarks/bench_embedding_service.py [--requests 400] [--concurrency 1,8,32]
+                                                 [--backends torch,onnx,onnx-int8]
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.core.config import settings
+from app.core.embedding_service import EmbeddingService
+from app.core.embeddings import HASHING, load_embedder
+from app.core.vector_index import top_k
+
+DATA = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "data", "iching.txt"))
+
+
+def _corpus():
+    """(document, query) pairs: every labelled line, and its text after the label."""
+    with open(DATA, encoding="utf-8") as f:
+        lines = list(dict.fromkeys(line.strip() for line in f if "：" in line))
+    return lines, [line.split("：", 1)[-1] for line in lines]
+
+
+def _embedders(args):
+    embedders = {HASHING: load_embedder(HASHING)}
+    for backend in args.backends.split(","):
+        try:
+            embedder = load_embedder(args.model, backend=backend, device=settings.EMBEDDING_DEVICE,
+                                     onnx_dir=args.onnx_dir)
+            embedder.embed("乾")  # loads the model
+        except (ImportError, OSError) as e:
+            print(f"{backend}: skipped ({e})")
+            continue
+        embedders[backend] = embedder
+    return embedders
+
+
+async def _load(embed, queries, requests: int, concurrency: int):
+    latencies = []
+    counter = iter(range(requests))
+
+    async def client():
+        for i in counter:
+            start = time.perf_counter()
+            await embed(queries[i % len(queries)])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return requests / elapsed, statistics.median(latencies), latencies[int(len(latencies) * 0.99) - 1]
+
+
+def _batched(embedder, queries, max_batch: int, window_ms: float) -> np.ndarray:
+    service = EmbeddingService(embedder, max_batch, window_ms)
+
+    async def embed_all():
+        return await asyncio.gather(*(service.aembed(q) for q in queries))
+
+    try:
+        return np.stack(asyncio.run(embed_all()))
+    finally:
+        service.close()
+
+
+def _accuracy(reference, embedders, documents, queries, args):
+    """Rows of (backend, mean cosine, min cosine, recall@k, max |batched - direct|)."""
+    index = reference.embed_batch(documents)
+    expected = reference.embed_batch(queries)
+    expected_top = [set(top_k(index @ q, args.k)[0].tolist()) for q in expected]
+    rows = []
+    for name, embedder in embedders.items():
+        if name == HASHING:
+            continue
+        vectors = embedder.embed_batch(queries)
+        cosine = np.sum(vectors * expected, axis=1)
+        recall = np.mean([
+            len(set(top_k(index @ v, args.k)[0].tolist()) & top) / args.k for v, top in zip(vectors, expected_top)
+        ])
+        batched = _batched(embedder, queries, args.max_batch, args.window_ms)
+        rows.append((name, float(cosine.mean()), float(cosine.min()), float(recall),
+                     float(np.abs(batched - vectors).max())))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400, help="per level for a model, 10x for hashing")
+    parser.add_argument("--concurrency", default="1,8,32")
+    parser.add_argument("--max-batch", type=int, default=settings.EMBED_BATCH_MAX_SIZE)
+    parser.add_argument("--window-ms", type=float, default=settings.EMBED_BATCH_WINDOW_MS)
+    parser.add_argument("--model", default="BAAI/bge-m3")
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--onnx-dir", default=settings.EMBEDDING_ONNX_DIR)
+    parser.add_argument("--k", type=int, default=4)
+    args = parser.parse_args()
+
+    documents, queries = _corpus()
+    levels = [int(c) for c in args.concurrency.split(",")]
+    embedders = _embedders(args)
+    print(f"{args.model}, {len(queries)} distinct queries, max batch {args.max_batch}, window {args.window_ms}ms")
+    print(f"{'embedder':<10}{'clients':>8}{'mode':>9}{'QPS':>10}{'p50 ms':>9}{'p99 ms':>9}")
+    for name, embedder in embedders.items():
+        requests = args.requests * 10 if name == HASHING else args.requests
+        for concurrency in levels:
+            service = EmbeddingService(embedder, args.max_batch, args.window_ms)
+            modes = {
+                "direct": lambda q: asyncio.to_thread(embedder.embed, q),
+                "batched": service.aembed,
+            }
+            for mode, embed in modes.items():
+                qps, p50, p99 = asyncio.run(_load(embed, queries, requests, concurrency))
+                print(f"{name:<10}{concurrency:>8}{mode:>9}{qps:>10,.0f}{p50:>9.2f}{p99:>9.2f}")
+            service.close()
+
+    if "torch" not in embedders:
+        print("accuracy: needs the torch backend as the full-precision reference")
+        return
+    print(f"accuracy against torch, index of {len(documents)} lines embedded by torch")
+    print(f"{'embedder':<10}{'mean cos':>10}{'min cos':>10}{f'recall@{args.k}':>10}{'batched':>10}")
+    for name, mean, low, recall, diff in _accuracy(embedders["torch"], embedders, documents, queries, args):
+        print(f"{name:<10}{mean:>10.4f}{low:>10.4f}{recall:>10.3f}{diff:>10.1e}")
+
+
+if __name__ == "__main__":
+    main()
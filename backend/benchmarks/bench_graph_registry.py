@@ -0,0 +1,53 @@
+"""
+Per-request graph setup overhead: compiling the workflow on every request
+versus fetching it from the process-wide registry.
+
+Usage (from backend/):
+    python benchmarks/bench_graph_registry.py [--requests 500]
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.agent.graph import create_graph
+from app.agent.registry import GraphRegistry, DEFAULT_GRAPH
+
+
+def _measure(fn, n: int):
+    samples = []
+    for _ in range(n):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return {
+        "mean_ms": statistics.fmean(samples),
+        "p50_ms": samples[len(samples) // 2],
+        "p99_ms": samples[min(len(samples) - 1, int(len(samples) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=500)
+    args = parser.parse_args()
+
+    registry = GraphRegistry()
+    registry.register(DEFAULT_GRAPH, create_graph)
+    registry.warm()
+
+    before = _measure(create_graph, args.requests)
+    after = _measure(lambda: registry.get(DEFAULT_GRAPH), args.requests)
+
+    print(f"{'mode':<22}{'mean ms':>12}{'p50 ms':>12}{'p99 ms':>12}")
+    for label, r in (("create_graph()", before), ("graph_registry.get()", after)):
+        print(f"{label:<22}{r['mean_ms']:>12.4f}{r['p50_ms']:>12.4f}{r['p99_ms']:>12.4f}")
+    print(f"speedup: {before['mean_ms'] / max(after['mean_ms'], 1e-9):.0f}x per request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Recall and latency of dense, BM25 and hybrid (RRF) retrieval on exact-quote
+versus paraphrase queries.
+
+The corpus is every line of the original text (【原文】) in data/iching.txt
+plus generated distractor lines of common words mixed with the same words. Each
+original line is looked up twice:
+
+- exact quote: the line's text after the line label (潜龙，勿用)
+- paraphrase: its aligned modern translation (龙潜伏在水中，不宜行动)
+
+Dense vectors come from EMBEDDING_MODEL (BAAI/bge-m3 unless configured
+otherwise), or ``--embedder hashing`` for a run without the model.
+
+Usage (from backend/):
+    python benchmarks/bench_hybrid_retrieval.py [--distractors 20000] [--k 4] [--embedder hashing]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import jieba
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.core import rag
+from app.core.bm25 import InvertedIndex, tokenize, warm
+from app.core.config import settings
+from app.core.embeddings import load_embedder
+from app.core.vector_index import write_index
+
+DATA = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "data", "iching.txt"))
+
+
+def _pairs():
+    """(original line, translation) pairs, aligned by position within each hexagram."""
+    pairs, original, translation, section = [], [], [], None
+    with open(DATA, encoding="utf-8") as f:
+        lines = [line.strip() for line in f] + ["第"]
+    for line in lines:
+        if line.startswith("第"):
+            pairs.extend(zip(original, translation))
+            original, translation, section = [], [], None
+        elif line in ("【原文】", "【译文】"):
+            section = line
+        elif line and section:
+            (original if section == "【原文】" else translation).append(line)
+    return pairs
+
+
+def _distractors(texts, n, seed=0):
+    # Common words from jieba's dictionary, one in four from the real lines: the
+    # distractors share vocabulary with the targets without quoting them
+    rng = np.random.default_rng(seed)
+    jieba.initialize()
+    common = sorted(jieba.dt.FREQ.items(), key=lambda item: -item[1])[:20000]
+    common = np.array([w for w, f in common if f > 0])
+    own = np.array([w for t in texts for w in jieba.lcut(t) if w not in "：，。；"])
+    lines = []
+    for _ in range(n):
+        size = int(rng.integers(6, 16))
+        words = np.where(rng.random(size) < 0.25, rng.choice(own, size), rng.choice(common, size))
+        lines.append("".join(words) + "。")
+    return lines
+
+
+def _run(queries, targets, k, search):
+    found, latencies = 0, []
+    for query, target in zip(queries, targets):
+        start = time.perf_counter()
+        rows = search(query)
+        latencies.append((time.perf_counter() - start) * 1000)
+        found += target in rows[:k]
+    return found / len(queries), statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--distractors", type=int, default=20000)
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--embedder", default=settings.EMBEDDING_MODEL)
+    args = parser.parse_args()
+    settings.EMBEDDING_MODEL = args.embedder
+
+    warm()
+    pairs = _pairs()
+    texts = [original for original, _ in pairs]
+    texts += _distractors(texts, args.distractors)
+    path = os.path.join(tempfile.mkdtemp(), "bench")
+    embedder = load_embedder(args.embedder, device=settings.EMBEDDING_DEVICE, backend=settings.EMBEDDING_BACKEND,
+                             onnx_dir=settings.EMBEDDING_ONNX_DIR)
+    write_index(path, embedder.embed_batch(texts), texts, ["iching"] * len(texts), [""] * len(texts), embedder.name,
+                embedder.backend)
+    InvertedIndex.build([tokenize(t) for t in texts]).save(path)
+
+    start = time.perf_counter()
+    rag.load_index(path)
+    load_ms = (time.perf_counter() - start) * 1000
+    row_of = {t: i for i, t in enumerate(texts)}
+    targets = [row_of[original] for original, _ in pairs]
+    queries = {
+        "exact quote": [original.split("：", 1)[-1] for original, _ in pairs],
+        "paraphrase": [translation.split("：", 1)[-1] for _, translation in pairs],
+    }
+    modes = {
+        "dense": lambda q: rag._index_cache.top(rag._embedder.embed(q), args.k)[0].tolist(),
+        "bm25": lambda q: rag._lexical_index.top(tokenize(q), args.k)[0].tolist(),
+        "hybrid": lambda q: [row_of[h.text] for h in rag.search(q, args.k)],
+    }
+
+    print(f"{len(texts)} documents ({len(pairs)} targets), k={args.k}, both indexes loaded in {load_ms:.1f}ms")
+    print(f"{'queries':<14}{'mode':<8}{'recall@k':>10}{'p50 ms':>9}")
+    for case, qs in queries.items():
+        for mode, search in modes.items():
+            recall, p50 = _run(qs, targets, args.k, search)
+            print(f"{case:<14}{mode:<8}{recall:>10.2f}{p50:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
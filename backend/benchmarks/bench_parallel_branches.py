@@ -0,0 +1,84 @@
+"""
+Wall-clock time of multi-intent questions with graph branches run one at a
+time (max_concurrency=1) versus in parallel.
+
+Retrieval and tools are given a simulated latency (a remote vector store, a
+slow calculation) so the overlap is visible; the LLM is a local stand-in.
+
+Usage (from backend/):
+    python benchmarks/bench_parallel_branches.py [--requests 40] [--retrieve-ms 80] [--tool-ms 40]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import app.agent.nodes as nodes
+from app.agent.graph import create_graph
+from app.core.fake_llm import FakeChatModel
+
+QUESTIONS = {
+    "tool+llm": ["1990年出生属什么，今年运势如何", "1995年3月25日出生是什么星座，性格如何"],
+    "2 tools": ["1990年3月1日出生，什么星座，属什么", "1988年8月8日出生属什么，是什么星座"],
+    "3 tools+llm": ["1990年3月1日8点出生，八字、星座、生肖分别是什么，运势如何"],
+}
+
+
+def _slow(fn, delay: float):
+    def wrapper(*args, **kwargs):
+        time.sleep(delay)
+        return fn(*args, **kwargs)
+    return wrapper
+
+
+def _add_latency(retrieve_ms: float, tool_ms: float):
+    nodes.retrieve_documents = _slow(nodes.retrieve_documents, retrieve_ms / 1000)
+    for attr in ("zodiac_tool", "horoscope_tool", "bazi_tool", "iching_tool", "naming_tool"):
+        tool = getattr(nodes, attr)
+        setattr(nodes, attr, SimpleNamespace(name=tool.name, run=_slow(tool.run, tool_ms / 1000)))
+
+
+async def _run(graph, questions, requests: int):
+    latencies = []
+    for i in range(requests):
+        inputs = {"question": questions[i % len(questions)], "messages": [], "documents": [], "generation": ""}
+        start = time.perf_counter()
+        await graph.ainvoke(inputs)
+        latencies.append((time.perf_counter() - start) * 1000)
+    return statistics.mean(latencies), statistics.median(latencies)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=40)
+    parser.add_argument("--retrieve-ms", type=float, default=80)
+    parser.add_argument("--tool-ms", type=float, default=40)
+    parser.add_argument("--ttft-ms", type=float, default=50)
+    parser.add_argument("--max-concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    nodes.set_llm(FakeChatModel(first_token_delay=args.ttft_ms / 1000, tokens_per_second=0, answer_tokens=50))
+    _add_latency(args.retrieve_ms, args.tool_ms)
+    sequential = create_graph(max_concurrency=1)
+    parallel = create_graph(max_concurrency=args.max_concurrency)
+
+    print(f"{args.requests} requests per case, retrieve={args.retrieve_ms:.0f}ms, tool={args.tool_ms:.0f}ms, "
+          f"stand-in LLM ttft={args.ttft_ms:.0f}ms")
+    print(f"{'case':<14}{'seq mean':>10}{'par mean':>10}{'seq p50':>10}{'par p50':>10}{'speedup':>9}")
+    for case, questions in QUESTIONS.items():
+        # Nodes print progress markers; keep them out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            seq_mean, seq_p50 = asyncio.run(_run(sequential, questions, args.requests))
+            par_mean, par_p50 = asyncio.run(_run(parallel, questions, args.requests))
+        print(f"{case:<14}{seq_mean:>10.1f}{par_mean:>10.1f}{seq_p50:>10.1f}{par_p50:>10.1f}{seq_mean / par_mean:>8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Throughput of the router's zero-LLM tool path versus the RAG + LLM path.
+
+The LLM is a local stand-in with a configurable time-to-first-token and
+token rate, so the LLM path numbers are a lower bound on real latency.
+
+Usage (from backend/):
+    python benchmarks/bench_router.py [--requests 400] [--concurrency 50]
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "tests")))
+
+import app.agent.nodes as nodes
+from app.agent.intent import match_intent
+from app.agent.registry import graph_registry
+from paced_llm import PacedChatModel, answers
+
+QUESTIONS = {
+    "tool": ["帮我占一卦", "1990年出生属什么", "我1995年3月25日出生是什么星座", "八字 1988年8月8日 8点"],
+    "llm": ["乾卦是什么意思", "坤卦的典故", "白羊座性格怎么样", "周易的历史"],
+}
+
+
+async def _run(path: str, requests: int, concurrency: int):
+    app = graph_registry.get()
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i: int):
+        question = QUESTIONS[path][i % len(QUESTIONS[path])]
+        inputs = {"question": question, "messages": [], "documents": [], "generation": ""}
+        async with semaphore:
+            start = time.perf_counter()
+            result = await app.ainvoke(inputs)
+            latencies.append((time.perf_counter() - start) * 1000)
+        assert result["route"] == path, (question, result["route"])
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    wall = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "rps": requests / wall,
+        "p50_ms": statistics.median(latencies),
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--ttft-ms", type=float, default=300)
+    parser.add_argument("--tokens", type=int, default=100)
+    args = parser.parse_args()
+
+    nodes.set_llm(PacedChatModel(messages=answers(args.tokens), first_token_delay=args.ttft_ms / 1000, token_delay=0.02))
+
+    n = 20000
+    start = time.perf_counter()
+    for i in range(n):
+        match_intent(QUESTIONS["tool"][i % 4] + QUESTIONS["llm"][i % 4])
+    print(f"intent matcher: {(time.perf_counter() - start) / n * 1e6:.1f} us/question")
+
+    print(f"{args.requests} requests, concurrency {args.concurrency}, "
+          f"stand-in LLM ttft={args.ttft_ms:.0f}ms, {args.tokens} tokens at 50 tok/s")
+    print(f"{'path':<8}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}")
+    for path in ("tool", "llm"):
+        # Nodes print progress markers; keep them out of the report
+        with contextlib.redirect_stdout(io.StringIO()):
+            r = asyncio.run(_run(path, args.requests, args.concurrency))
+        print(f"{path:<8}{r['rps']:>10.1f}{r['p50_ms']:>10.1f}{r['p99_ms']:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
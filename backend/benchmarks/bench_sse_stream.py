@@ -0,0 +1,103 @@
+"""
+SSE stream cost per connection: "legacy" (the original astream_events v1
+loop), "full" (one frame per event) and "compact" (filtered at the source,
+coalesced tokens).
+
+Drives N concurrent graph runs against a local streaming stand-in for the
+LLM, encodes every frame exactly as sse_starlette does and writes it to its
+own local TCP connection, one send per frame like the ASGI server.
+
+Usage (from backend/):
+    python benchmarks/bench_sse_stream.py [--connections 500] [--tokens 200]
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "tests")))
+
+from sse_starlette.sse import ServerSentEvent
+
+import app.agent.nodes as nodes
+from app.agent.graph import create_graph
+from app.api.endpoints.chat import ChatRequest, _graph_events
+from app.core.config import settings
+from app.core.memory import SessionMemory
+from paced_llm import PacedChatModel, answers
+
+
+async def _legacy_events(app, request: ChatRequest, memory: SessionMemory, mode: str):
+    """The original stream_chat loop: v1 events, one escaped frame per event."""
+    inputs = {"question": request.message, "messages": [], "documents": [], "generation": ""}
+    yield {"event": "message", "data": json.dumps({"type": "status", "content": "正在处理您的请求..."})}
+    async for event in app.astream_events(inputs, version="v1"):
+        kind = event["event"]
+        if kind == "on_chat_model_stream":
+            content = event["data"]["chunk"].content
+            if content:
+                yield {"event": "message", "data": json.dumps({"type": "token", "content": content})}
+        elif kind == "on_chain_start" and event.get("name"):
+            yield {"event": "message", "data": json.dumps({"type": "status", "content": f"正在{event['name']}..."})}
+
+
+async def _discard(reader, writer):
+    while await reader.read(65536):
+        pass
+    writer.close()
+
+
+async def _one_stream(app, index: int, mode: str, port: int, stats: dict):
+    request = ChatRequest(message=f"乾卦是什么意思 {index}")
+    events = _legacy_events if mode == "legacy" else _graph_events
+    _, writer = await asyncio.open_connection("127.0.0.1", port)
+    async for frame in events(app, request, SessionMemory(), mode):
+        data = ServerSentEvent(**frame).encode()
+        writer.write(data)
+        await writer.drain()
+        stats["frames"] += 1
+        stats["bytes"] += len(data)
+    writer.close()
+
+
+async def _run(mode: str, connections: int):
+    app = create_graph()
+    server = await asyncio.start_server(_discard, "127.0.0.1", 0, backlog=connections)
+    port = server.sockets[0].getsockname()[1]
+    stats = {"frames": 0, "bytes": 0}
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    await asyncio.gather(*(_one_stream(app, i, mode, port, stats) for i in range(connections)))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+    server.close()
+    return {
+        "frames_per_sec": stats["frames"] / wall,
+        "frames_per_stream": stats["frames"] / connections,
+        "bytes_per_stream": stats["bytes"] / connections,
+        "cpu_ms_per_stream": cpu * 1000 / connections,
+        "wall_s": wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=500)
+    parser.add_argument("--tokens", type=int, default=200)
+    parser.add_argument("--token-delay-ms", type=float, default=20)
+    args = parser.parse_args()
+
+    nodes.set_llm(PacedChatModel(messages=answers(args.tokens), token_delay=args.token_delay_ms / 1000))
+    print(f"{args.connections} connections, {args.tokens} tokens/answer, "
+          f"window={settings.SSE_COALESCE_WINDOW_MS}ms max_bytes={settings.SSE_COALESCE_MAX_BYTES}")
+    print(f"{'mode':<10}{'frames/s':>12}{'frames/stream':>15}{'bytes/stream':>14}{'cpu ms/stream':>15}{'wall s':>9}")
+    for mode in ("legacy", "full", "compact"):
+        r = asyncio.run(_run(mode, args.connections))
+        print(f"{mode:<10}{r['frames_per_sec']:>12.0f}{r['frames_per_stream']:>15.1f}"
+              f"{r['bytes_per_stream']:>14.0f}{r['cpu_ms_per_stream']:>15.2f}{r['wall_s']:>9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""
+Calls per second of the deterministic tools.
+
+``_run`` is the computation alone; ``run`` is the full BaseTool path used by
+the graph (argument validation, callbacks) in front of it. The computations
+take microseconds and ``run`` is two orders of magnitude slower, which is why
+tool results are not memoized: a cache in front of ``_run`` cannot be seen
+through ``run``.
+
+Usage (from backend/):
+    python benchmarks/bench_tools.py [--calls 20000] [--distinct 200]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from app.tools.bazi import BaZiTool
+from app.tools.horoscope import HoroscopeTool
+from app.tools.zodiac import ZodiacTool
+
+
+def _cases(distinct: int):
+    return {
+        "zodiac": (ZodiacTool(), [{"year": 1950 + i % 70} for i in range(distinct)]),
+        "horoscope": (HoroscopeTool(), [{"date_str": f"1990-{1 + i % 12:02d}-{1 + i % 28:02d}"} for i in range(distinct)]),
+        "bazi": (BaZiTool(), [{"datetime_str": f"1990-01-{1 + i % 28:02d} {i % 24:02d}:00"} for i in range(distinct)]),
+    }
+
+
+def _rate(fn, args_list, calls: int) -> float:
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(args_list[i % len(args_list)])
+    return calls / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--distinct", type=int, default=200, help="distinct argument sets cycled through")
+    args = parser.parse_args()
+
+    print(f"{args.calls} calls over {args.distinct} distinct arguments")
+    print(f"{'tool':<11}{'_run calls/s':>14}{'run calls/s':>14}")
+    for name, (tool, args_list) in _cases(args.distinct).items():
+        computed = _rate(lambda a: tool._run(**a), args_list, args.calls)
+        full = _rate(tool.run, args_list, args.calls)
+        print(f"{name:<11}{computed:>14,.0f}{full:>14,.0f}")
+
+
+if __name__ == "__main__":
+    main()
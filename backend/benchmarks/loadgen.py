@@ -0,0 +1,312 @@
+"""
+End-to-end load generator for /chat/ and /chat/stream.
+
+Requests are started open-loop at a target rate, with at most --connections
+in flight. Reported per endpoint: achieved req/s, errors and p50/p95/p99 end
+to end; for streams also time to first token and inter-token latency. The
+server's CPU and RSS are sampled from /proc (Linux) when its pid is known.
+
+Results can be saved as a JSON baseline and compared with a later run; the
+exit status is 1 when a compared metric regressed beyond --tolerance.
+
+Usage (from backend/):
+    # Start a server on the offline LLM (LLM_PROVIDER=fake) and drive it
+    python benchmarks/loadgen.py --spawn --rps 20 --connections 200 --duration 30 --out baseline.json
+    # Later: same load, compared with the baseline
+    python benchmarks/loadgen.py --spawn --rps 20 --connections 200 --duration 30 --compare baseline.json
+    # Against a server that is already running
+    python benchmarks/loadgen.py --url http://127.0.0.1:8000 --server-pid 12345
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+
+BACKEND_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+QUESTIONS = ["乾卦是什么意思", "坤卦的典故", "周易的历史", "白羊座性格怎么样", "八卦分别代表什么"]
+
+# Lower is better for latencies; higher is better for throughput
+HIGHER_IS_BETTER = ("rps",)
+
+
+class ProcSampler:
+    """CPU and RSS of one process, sampled from /proc."""
+
+    def __init__(self, pid: int, interval: float = 0.5):
+        self.pid = pid
+        self.interval = interval
+        self.cpu_percent: List[float] = []
+        self.rss_mb: List[float] = []
+        self._ticks = os.sysconf("SC_CLK_TCK")
+        self._task = None
+
+    def _cpu_seconds(self) -> float:
+        with open(f"/proc/{self.pid}/stat") as f:
+            # Fields after the parenthesised command name; utime and stime are 14th and 15th
+            fields = f.read().rsplit(")", 1)[1].split()
+        return (int(fields[11]) + int(fields[12])) / self._ticks
+
+    def _rss_mb(self) -> float:
+        with open(f"/proc/{self.pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+        return 0.0
+
+    async def _run(self):
+        last_cpu, last_time = self._cpu_seconds(), time.perf_counter()
+        while True:
+            await asyncio.sleep(self.interval)
+            cpu, now = self._cpu_seconds(), time.perf_counter()
+            self.cpu_percent.append(100 * (cpu - last_cpu) / (now - last_time))
+            self.rss_mb.append(self._rss_mb())
+            last_cpu, last_time = cpu, now
+
+    def start(self):
+        self._task = asyncio.ensure_future(self._run())
+
+    def stop(self) -> dict:
+        self._task.cancel()
+        if not self.cpu_percent:
+            return {}
+        return {
+            "cpu_percent_mean": round(float(np.mean(self.cpu_percent)), 1),
+            "cpu_percent_max": round(max(self.cpu_percent), 1),
+            "rss_mb_mean": round(float(np.mean(self.rss_mb)), 1),
+            "rss_mb_max": round(max(self.rss_mb), 1),
+        }
+
+
+def _percentiles(values: List[float], prefix: str) -> dict:
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {f"{prefix}_p50_ms": round(p50, 1), f"{prefix}_p95_ms": round(p95, 1), f"{prefix}_p99_ms": round(p99, 1)}
+
+
+class Recorder:
+    def __init__(self):
+        self.e2e: List[float] = []
+        self.ttft: List[float] = []
+        self.inter_token: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.completed = 0
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self, wall: float) -> dict:
+        out = {"requests": self.completed + sum(self.errors.values()), "errors": sum(self.errors.values()),
+               "rps": round(self.completed / wall, 2) if wall else 0.0}
+        if self.errors:
+            out["error_kinds"] = dict(self.errors)
+        out.update(_percentiles(self.e2e, "e2e"))
+        out.update(_percentiles(self.ttft, "ttft"))
+        out.update(_percentiles(self.inter_token, "inter_token"))
+        return out
+
+
+async def _chat(client: httpx.AsyncClient, url: str, body: dict, rec: Recorder):
+    start = time.perf_counter()
+    response = await client.post(f"{url}/api/v1/chat/", json=body)
+    data = response.json()
+    if response.status_code != 200 or data.get("error"):
+        rec.error(str(data.get("error") or response.status_code))
+        return
+    rec.e2e.append((time.perf_counter() - start) * 1000)
+    rec.completed += 1
+
+
+async def _stream(client: httpx.AsyncClient, url: str, body: dict, rec: Recorder):
+    start = time.perf_counter()
+    first, last = None, None
+    async with client.stream("POST", f"{url}/api/v1/chat/stream", json=body) as response:
+        event = "message"
+        async for line in response.aiter_lines():
+            if line.startswith("event:"):
+                event = line[6:].strip()
+                continue
+            if not line.startswith("data:"):
+                continue
+            now = time.perf_counter()
+            if event == "error":
+                rec.error(json.loads(line[5:]).get("code", "stream_error"))
+                return
+            data = json.loads(line[5:])
+            if data.get("type") == "token":
+                if first is None:
+                    first = now
+                    rec.ttft.append((now - start) * 1000)
+                else:
+                    rec.inter_token.append((now - last) * 1000)
+                last = now
+            elif data.get("type") == "done":
+                rec.e2e.append((now - start) * 1000)
+                rec.completed += 1
+                return
+            event = "message"
+    rec.error("incomplete")
+
+
+async def _drive(args) -> dict:
+    endpoints = ["chat", "stream"] if args.endpoint == "both" else [args.endpoint]
+    recorders = {name: Recorder() for name in endpoints}
+    total = int(args.rps * args.duration)
+    slots = asyncio.Semaphore(args.connections)
+    limits = httpx.Limits(max_connections=args.connections, max_keepalive_connections=args.connections)
+    timeout = httpx.Timeout(args.timeout)
+
+    async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+        sampler = ProcSampler(args.server_pid) if args.server_pid else None
+        if sampler:
+            sampler.start()
+
+        async def one(i: int):
+            endpoint = endpoints[i % len(endpoints)]
+            question = QUESTIONS[i % len(QUESTIONS)]
+            if not args.allow_cache:
+                question = f"{question} {i}"  # distinct numbers never share a cached answer
+            body = {"message": question, "session_id": "default"}
+            async with slots:
+                try:
+                    await (_chat if endpoint == "chat" else _stream)(client, args.url, body, recorders[endpoint])
+                except (httpx.HTTPError, ValueError) as e:
+                    recorders[endpoint].error(type(e).__name__)
+
+        start = time.perf_counter()
+        tasks = []
+        for i in range(total):
+            # Open loop: requests start on schedule whether or not earlier ones finished
+            delay = start + i / args.rps - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.ensure_future(one(i)))
+        await asyncio.gather(*tasks)
+        wall = time.perf_counter() - start
+        server = sampler.stop() if sampler else {}
+
+    return {
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare", "server_pid")},
+        "results": {name: rec.summary(wall) for name, rec in recorders.items()},
+        "server": server,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def compare(baseline: dict, current: dict, tolerance: float) -> List[str]:
+    """Print metric deltas; return the names of metrics that regressed beyond ``tolerance``."""
+    regressions = []
+    print(f"\n{'metric':<28}{'baseline':>12}{'current':>12}{'change':>10}")
+    for section in ("results", "server"):
+        for group, metrics in _flatten(baseline.get(section, {})).items():
+            now = _flatten(current.get(section, {})).get(group, {})
+            for name, old in metrics.items():
+                new = now.get(name)
+                if not isinstance(old, (int, float)) or not isinstance(new, (int, float)) or name == "requests":
+                    continue
+                change = (new - old) / old if old else 0.0
+                worse = -change if name in HIGHER_IS_BETTER else change
+                flag = ""
+                if name != "errors" and worse > tolerance:
+                    flag = "  REGRESSED"
+                    regressions.append(f"{group}.{name}")
+                elif name == "errors" and new > old:
+                    flag = "  REGRESSED"
+                    regressions.append(f"{group}.{name}")
+                print(f"{group + '.' + name:<28}{old:>12}{new:>12}{change:>+10.1%}{flag}")
+    return regressions
+
+
+def _flatten(section: dict) -> Dict[str, dict]:
+    if section and all(isinstance(v, dict) for v in section.values()):
+        return section
+    return {"server": section} if section else {}
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _spawn_server(args) -> subprocess.Popen:
+    port = _free_port()
+    env = {
+        **os.environ,
+        "LLM_PROVIDER": "fake",
+        "FAKE_LLM_TTFT_MS": str(args.fake_ttft_ms),
+        "FAKE_LLM_TOKENS_PER_SECOND": str(args.fake_tokens_per_second),
+        "FAKE_LLM_ANSWER_TOKENS": str(args.fake_answer_tokens),
+        "FAKE_LLM_FAILURE_RATE": str(args.fake_failure_rate),
+    }
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    args.url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{args.url}/health", timeout=1).status_code == 200:
+                args.server_pid = server.pid
+                return server
+        except httpx.HTTPError:
+            pass
+        if server.poll() is not None:
+            break
+        time.sleep(0.2)
+    server.kill()
+    raise SystemExit("server did not start")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Load generator for the chat endpoints")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--endpoint", choices=("chat", "stream", "both"), default="stream")
+    parser.add_argument("--rps", type=float, default=10)
+    parser.add_argument("--connections", type=int, default=100)
+    parser.add_argument("--duration", type=float, default=20, help="seconds of load")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--allow-cache", action="store_true", help="repeat questions verbatim (answer cache hits)")
+    parser.add_argument("--server-pid", type=int, help="sample this process's CPU and RSS")
+    parser.add_argument("--spawn", action="store_true", help="start a server on the offline LLM")
+    parser.add_argument("--fake-ttft-ms", type=float, default=300)
+    parser.add_argument("--fake-tokens-per-second", type=float, default=50)
+    parser.add_argument("--fake-answer-tokens", type=int, default=200)
+    parser.add_argument("--fake-failure-rate", type=float, default=0.0)
+    parser.add_argument("--out", help="save results as a JSON baseline")
+    parser.add_argument("--compare", help="baseline JSON to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="allowed relative regression")
+    args = parser.parse_args(argv)
+
+    server = _spawn_server(args) if args.spawn else None
+    try:
+        report = asyncio.run(_drive(args))
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=10)
+
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(json.load(f), report, args.tolerance)
+        if regressions:
+            print(f"\nregressed: {', '.join(regressions)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Local OpenAI-compatible chat server for offline tests.
+
+Serves streaming ``POST /v1/chat/completions`` with an injectable first-token
+delay, inter-token delay and failure status, so hedging and failover can be
+exercised without a real provider. Run standalone with
+``python -m tests.mock_openai --port 9001 --first-token-delay 1.5``.
+"""
+import argparse
+import asyncio
+import json
+import socket
+import threading
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+
+class MockOpenAIServer:
+    def __init__(self, answer: str = "乾为天", first_token_delay: float = 0.0,
+                 token_delay: float = 0.0, status: int = 200, port: int = 0):
+        self.answer = answer
+        self.first_token_delay = first_token_delay
+        self.token_delay = token_delay
+        self.status = status
+        self.port = port or _free_port()
+        self.requests = 0
+        self.cancelled = 0
+        self.app = self._build_app()
+        self._server = None
+        self._thread = None
+
+    @property
+    def api_base(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def _build_app(self) -> FastAPI:
+        app = FastAPI()
+
+        @app.post("/v1/chat/completions")
+        async def completions(request: Request):
+            body = await request.json()
+            self.requests += 1
+            if self.status != 200:
+                return JSONResponse({"error": {"message": "injected failure"}}, status_code=self.status)
+            return StreamingResponse(self._chunks(body.get("model", "mock")), media_type="text/event-stream")
+
+        return app
+
+    async def _chunks(self, model: str):
+        try:
+            await asyncio.sleep(self.first_token_delay)
+            for i, ch in enumerate(self.answer):
+                if i:
+                    await asyncio.sleep(self.token_delay)
+                yield _sse(model, {"role": "assistant", "content": ch} if i == 0 else {"content": ch}, None)
+            yield _sse(model, {}, "stop")
+            yield "data: [DONE]\n\n"
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+
+    def __enter__(self):
+        config = uvicorn.Config(self.app, host="127.0.0.1", port=self.port, log_level="error", lifespan="off")
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+        self._thread.start()
+        deadline = time.monotonic() + 5
+        while not self._server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("mock OpenAI server did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+def _sse(model: str, delta: dict, finish_reason):
+    chunk = {
+        "id": "chatcmpl-mock",
+        "object": "chat.completion.chunk",
+        "created": 0,
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+    return f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--port", type=int, default=9001)
+    parser.add_argument("--answer", default="乾为天，元亨利贞。")
+    parser.add_argument("--first-token-delay", type=float, default=0.0)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--status", type=int, default=200)
+    args = parser.parse_args()
+    server = MockOpenAIServer(args.answer, args.first_token_delay, args.token_delay, args.status, args.port)
+    uvicorn.run(server.app, host="127.0.0.1", port=server.port)
@@ -0,0 +1,39 @@
+"""
+Scripted streaming chat model for tests and micro-benchmarks (benchmarks/
+put this directory on ``sys.path``). The offline provider used by the app and
+the load generator is ``app.core.fake_llm.FakeChatModel``.
+"""
+import asyncio
+
+from langchain_core.language_models.fake_chat_models import GenericFakeChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+
+class PacedChatModel(GenericFakeChatModel):
+    """Streams one CJK character per token after a first-token delay, with a fixed inter-token delay."""
+
+    first_token_delay: float = 0.0
+    token_delay: float = 0.005
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        text = next(self.messages).content
+        await asyncio.sleep(self.first_token_delay)
+        for i, ch in enumerate(text):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=ch))
+            if run_manager:
+                await run_manager.on_llm_new_token(ch, chunk=chunk)
+            yield chunk
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        # Non-streaming calls pay the same simulated latency
+        text = "".join([c.text async for c in self._astream(messages, stop, run_manager, **kwargs)])
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=text))])
+
+
+def answers(tokens: int):
+    text = ("乾为天元亨利贞潜龙勿用" * (tokens // 10 + 1))[:tokens]
+    while True:
+        yield AIMessage(content=text)
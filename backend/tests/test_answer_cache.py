@@ -0,0 +1,97 @@
+import json
+
+from fastapi.testclient import TestClient
+
+from app.core.answer_cache import AnswerCache, answer_cache, question_entities
+from app.core.embeddings import HashingEmbedder
+from app.core.text import normalize_question
+
+
+def test_exact_hit_after_normalization():
+    cache = AnswerCache(max_entries=16)
+    cache.store("乾卦是什么意思", "乾为天")
+    hit = cache.lookup(" 乾卦是什麼意思？")
+    assert hit is not None
+    assert hit.tier == "exact"
+    assert hit.answer == "乾为天"
+    assert cache.lookup("乾卦是什么意思", variant="other") is None
+
+
+def test_semantic_hit_respects_threshold_and_numbers():
+    cache = AnswerCache(max_entries=16, similarity_threshold=0.8, embedder=HashingEmbedder())
+    cache.store("请问乾卦是什么意思呢", "乾为天")
+    hit = cache.lookup("请问乾卦是什么意思啊")
+    assert hit is not None and hit.tier == "semantic"
+    assert cache.lookup("白羊座性格") is None
+
+    cache.store("1990年出生属什么生肖", "马")
+    assert cache.lookup("1991年出生属什么生肖") is None
+
+
+def test_semantic_near_miss_with_other_entity_does_not_hit():
+    embedder = HashingEmbedder()
+    cache = AnswerCache(max_entries=16, similarity_threshold=0.9, embedder=embedder)
+    pairs = [
+        ("属龙的人和属猴的人在一起合不合适，婚姻和事业上能不能互相帮助",
+         "属龙的人和属虎的人在一起合不合适，婚姻和事业上能不能互相帮助"),
+        ("请详细讲解一下周易里面乾卦的卦辞和六个爻辞分别是什么意思，对现代人的为人处世有什么启发",
+         "请详细讲解一下周易里面坤卦的卦辞和六个爻辞分别是什么意思，对现代人的为人处世有什么启发"),
+        ("白羊座的人性格上有哪些优点和缺点，在工作和感情里面通常会表现出什么样的特点呢",
+         "金牛座的人性格上有哪些优点和缺点，在工作和感情里面通常会表现出什么样的特点呢"),
+    ]
+    for stored, asked in pairs:
+        # Close enough to pass the threshold: only the differing entity keeps them apart
+        similarity = float(embedder.embed(normalize_question(stored)) @ embedder.embed(normalize_question(asked)))
+        assert similarity >= cache.similarity_threshold
+        cache.store(stored, "answer")
+        assert cache.lookup(asked) is None
+        assert cache.lookup(stored.replace("，", "，请问")).tier == "semantic"
+
+
+def test_question_entities():
+    assert question_entities("乾卦和小畜的关系") == ("乾卦", "小畜")
+    assert question_entities("1990年属马的白羊座") == ("1990", "白羊座", "马")
+    # Bare one-character hexagram names are common words
+    assert question_entities("需要注意什么") == ()
+
+
+def test_semantic_tier_off_without_query_model():
+    # The test app runs on the hashing embedder, which the default cache never uses
+    cache = AnswerCache(max_entries=16, similarity_threshold=0.0)
+    cache.store("请问乾卦是什么意思呢", "乾为天")
+    assert cache.lookup("请问乾卦是什么意思啊") is None
+    assert cache.lookup("请问乾卦是什么意思呢").tier == "exact"
+
+
+def test_ttl_and_lru_eviction():
+    cache = AnswerCache(max_entries=2, ttl_seconds=60)
+    cache.store("问题一", "a")
+    cache.store("问题二", "b")
+    cache.lookup("问题一")
+    cache.store("问题三", "c")
+    assert cache.lookup("问题二") is None
+    assert cache.lookup("问题一").answer == "a"
+
+    cache.ttl_seconds = -1
+    cache.store("问题四", "d")
+    assert cache.lookup("问题四") is None
+    assert cache.stats()["entries"] == 1
+
+
+def test_stream_replays_cached_answer():
+    from app.main import app
+
+    answer_cache.clear()
+    answer_cache.store("白羊座性格", "热情、冲动、自信、勇敢。" * 3)
+    client = TestClient(app)
+    response = client.post("/api/v1/chat/stream", json={"message": "白羊座性格"})
+    payloads = [
+        json.loads(line[len("data:"):])
+        for line in response.text.splitlines()
+        if line.startswith("data:")
+    ]
+    assert [p["type"] for p in payloads][0] == "status"
+    assert payloads[-1]["type"] == "done"
+    tokens = "".join(p["content"] for p in payloads if p["type"] == "token")
+    assert tokens == "热情、冲动、自信、勇敢。" * 3
+    answer_cache.clear()
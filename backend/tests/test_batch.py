@@ -0,0 +1,94 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from app.agent import nodes
+
+
+def _post(client, body):
+    response = client.post("/api/v1/chat/batch", json=body)
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_batch_dedupes_identical_prompts():
+    from app.main import app
+
+    messages = ["1990年出生属什么", "1990年出生属什么？", "帮我占一卦", "帮我占一卦", "1995年3月25日出生，是什么星座"]
+    lines = _post(TestClient(app), {"messages": messages, "concurrency": 2})
+    results, summary = lines[:-1], lines[-1]
+
+    assert summary["type"] == "summary"
+    assert summary["total"] == 5 and summary["unique"] == 4 and summary["errors"] == 0
+    by_index = {line["index"]: line for line in results}
+    assert sorted(by_index) == list(range(5))
+    assert by_index[1]["duplicate_of"] == 0 and by_index[1]["response"] == by_index[0]["response"]
+    # Random tool output (I Ching casts) is never shared
+    assert by_index[2]["duplicate_of"] is None and by_index[3]["duplicate_of"] is None
+    assert all(line["elapsed_time"] >= 0 and line["route"] == "tool" for line in results)
+
+
+def test_batch_bounds_parallelism_and_reports_errors(monkeypatch):
+    from app.main import app
+
+    running, peak = 0, 0
+
+    async def fake_llm(prompt):
+        nonlocal running, peak
+        question = prompt.to_messages()[-1].content
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.02)
+        running -= 1
+        if "坏" in question:
+            raise ValueError("boom")
+        return AIMessage(content="答")
+
+    monkeypatch.setattr(nodes.settings, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(nodes, "rag_chain", nodes.RAG_PROMPT | RunnableLambda(fake_llm))
+    messages = [f"批量问题{i}" for i in range(7)] + ["坏问题"]
+    lines = _post(TestClient(app), {"messages": messages, "concurrency": 3})
+
+    assert peak <= 3
+    errors = [line for line in lines[:-1] if line["error"]]
+    assert [line["message"] for line in errors] == ["坏问题"]
+    assert lines[-1]["errors"] == 1
+
+
+def test_batch_limits():
+    from app.main import app
+
+    client = TestClient(app)
+    assert client.post("/api/v1/chat/batch", json={"messages": []}).status_code == 422
+    too_many = ["乾卦"] * (nodes.settings.BATCH_MAX_ITEMS + 1)
+    assert client.post("/api/v1/chat/batch", json={"messages": too_many}).status_code == 413
+
+
+def test_batch_lines_have_the_same_keys_whatever_the_outcome(monkeypatch):
+    from app.api.endpoints import chat
+    from app.core.llm import LLMOverloaded
+    from app.main import app
+
+    async def invoke(app, request, memory):
+        if "忙" in request.message:
+            raise LLMOverloaded("fake", "queue_full")
+        if "慢" in request.message:
+            raise asyncio.TimeoutError()
+        if "坏" in request.message:
+            raise ValueError("boom")
+        return {"generation": "答", "route": "llm", "prompt_tokens": 12}
+
+    monkeypatch.setattr(nodes.settings, "ANSWER_CACHE_ENABLED", False)
+    monkeypatch.setattr(chat, "_invoke_graph", invoke)
+    lines = _post(TestClient(app), {"messages": ["好问题", "忙问题", "慢问题", "坏问题"]})
+    results = {line["message"]: line for line in lines[:-1]}
+
+    assert len({frozenset(line) for line in results.values()}) == 1
+    assert results["好问题"]["prompt_tokens"] == 12 and results["好问题"]["error"] is None
+    for message, error in (("忙问题", "overloaded"), ("慢问题", "timeout"), ("坏问题", "boom")):
+        line = results[message]
+        assert line["error"] == error
+        assert line["route"] is None and line["prompt_tokens"] is None and line["cached"] is False
@@ -0,0 +1,114 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from langchain_core.messages import HumanMessage
+from prometheus_client import REGISTRY
+
+from app.agent import nodes
+from app.core.llm import LLMClients
+from app.core.resumable import ResumableStreams, SQLiteStreamStore
+from mock_openai import MockOpenAIServer
+from paced_llm import PacedChatModel, answers
+
+
+def _streams(tmp_path, abandon_grace):
+    return ResumableStreams(
+        SQLiteStreamStore(str(tmp_path / "sse.db")), ttl=60, checkpoint_interval=0.01, abandon_grace=abandon_grace,
+    )
+
+
+def _producer(state):
+    async def frames():
+        try:
+            for i in range(50):
+                await asyncio.sleep(0.02)
+                yield {"event": "message", "data": f"frame {i}"}
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+    return frames()
+
+
+def test_abandoned_stream_is_cancelled_after_grace(tmp_path):
+    async def main():
+        streams = _streams(tmp_path, abandon_grace=0.05)
+        state = {}
+        buffer = streams.start(_producer(state))
+        follower = buffer.follow()
+        await follower.__anext__()
+        await follower.aclose()  # client disconnected
+        await asyncio.sleep(0.15)
+        await streams.aclose()
+        return state, buffer
+
+    state, buffer = asyncio.run(main())
+    assert state.get("cancelled")
+    assert buffer.finished and len(buffer.frames) < 50
+
+
+def test_reconnect_within_grace_keeps_the_run(tmp_path):
+    async def main():
+        streams = _streams(tmp_path, abandon_grace=0.1)
+        state = {}
+        buffer = streams.start(_producer(state))
+        follower = buffer.follow()
+        first = await follower.__anext__()
+        await follower.aclose()
+        await asyncio.sleep(0.03)
+        resumed = await streams.resume(first["id"])
+        rest = [frame async for frame in resumed]
+        await streams.aclose()
+        return state, rest
+
+    state, rest = asyncio.run(main())
+    assert not state.get("cancelled")
+    assert len(rest) == 49
+
+
+def test_cancelled_llm_call_closes_upstream_and_counts_saved_tokens():
+    with MockOpenAIServer("乾" * 100, token_delay=0.02) as server:
+        clients = LLMClients()
+        backend = clients.backend("mock-cancel", "mock-model", server.api_base, max_retries=0)
+        model = clients.chat_model([backend])
+
+        async def consume(received):
+            async for chunk in model.astream([HumanMessage(content="乾卦")]):
+                received.append(chunk.content)
+
+        async def main():
+            received = []
+            task = asyncio.ensure_future(consume(received))
+            while len(received) < 3:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            await asyncio.sleep(0.2)
+            await clients.aclose()
+            return received
+
+        received = asyncio.run(main())
+        assert len(received) < 10
+        assert server.cancelled == 1
+        assert backend.gate.in_flight == 0
+        saved = REGISTRY.get_sample_value("llm_tokens_saved_total", {"provider": "mock-cancel"})
+        assert saved >= backend.completion_tokens - len(received) - 5
+
+
+def test_node_deadlines(monkeypatch):
+    monkeypatch.setattr(nodes.settings, "NODE_GENERATE_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(nodes.settings, "NODE_TOOL_TIMEOUT_SECONDS", 0.05)
+    monkeypatch.setattr(nodes, "rag_chain", nodes.RAG_PROMPT | PacedChatModel(messages=answers(10), first_token_delay=1))
+
+    slow_tool = SimpleNamespace(name="slow_tool", run=lambda args: time.sleep(0.5) or {})
+
+    async def main():
+        start = time.perf_counter()
+        generated = await nodes.generate({"question": "乾卦", "documents": []})
+        tool = await nodes._run_tool(slow_tool, str, {"tool_args": {}})
+        return generated, tool, time.perf_counter() - start
+
+    generated, tool, elapsed = asyncio.run(main())
+    assert generated["error"] == "timeout"
+    assert tool["error"] == "timeout"
+    assert elapsed < 0.5
@@ -0,0 +1,46 @@
+import asyncio
+
+from app.core.context import pack_context, truncate_to_sentences
+from app.core.tokens import count_tokens, estimate_tokens
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("乾为天") == 3
+    assert estimate_tokens("hexagram 64") == 2 + 1
+    assert estimate_tokens("元亨利贞。") == 5
+    assert count_tokens("") == 0
+
+
+def test_pack_keeps_retrieval_order_dedupes_and_respects_budget():
+    docs = [
+        "坤卦：元亨，利牝马之贞。",  # ranked first by the retriever, whatever its overlap with the question
+        "乾卦：元亨利贞。初九，潜龙勿用。",
+        "乾卦: 元亨利贞。初九, 潜龙勿用。",  # same text, half-width punctuation
+        "初九，潜龙勿用。",  # contained in a better-ranked document
+    ]
+    packed = pack_context(docs, budget=100)
+    assert packed.text.split("\n") == ["坤卦：元亨，利牝马之贞。", "乾卦：元亨利贞。初九，潜龙勿用。"]
+    assert packed.documents == 2 and packed.dropped == 2
+    assert packed.tokens == count_tokens(packed.text)
+    assert not packed.truncated
+
+
+def test_pack_truncates_at_sentence_boundary():
+    long_doc = "乾，元亨利贞。" * 20
+    packed = pack_context([long_doc], budget=30)
+    assert packed.truncated
+    assert packed.tokens <= 30
+    assert packed.text.endswith("。")
+    assert truncate_to_sentences("初九，潜龙勿用。九二，见龙在田。", 9) == "初九，潜龙勿用。"
+
+
+def test_generate_reports_prompt_tokens(monkeypatch):
+    from app.agent import nodes
+    from paced_llm import PacedChatModel, answers
+
+    monkeypatch.setattr(nodes, "rag_chain", nodes.RAG_PROMPT | PacedChatModel(messages=answers(4), token_delay=0))
+    state = {"question": "乾卦", "documents": ["乾，元亨利贞。" * 1000]}
+    result = asyncio.run(nodes.generate(state))
+    assert result["generation"] == "乾为天元"
+    budget = nodes.prompt_budget(nodes.settings.LLM_MODEL)
+    assert budget - 20 < result["prompt_tokens"] <= budget
@@ -0,0 +1,80 @@
+import asyncio
+import pickle
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from app.core.embedding_service import EmbeddingService
+from app.core.embeddings import HashingEmbedder, OnnxEmbedder, load_embedder
+
+
+class SlowEmbedder(HashingEmbedder):
+    """A forward pass costs the same for one text as for many, like a model's."""
+
+    def __init__(self):
+        super().__init__(32)
+        self.batches = []
+
+    def embed_batch(self, texts):
+        self.batches.append(list(texts))
+        time.sleep(0.02)
+        if "boom" in texts:
+            raise ValueError("boom")
+        return super().embed_batch(texts)
+
+
+def test_concurrent_queries_share_a_forward_pass():
+    embedder = SlowEmbedder()
+    service = EmbeddingService(embedder, max_batch=8, max_wait_ms=20)
+    queries = [f"问题{i}" for i in range(20)]
+
+    async def main():
+        return await asyncio.gather(*(service.aembed(q) for q in queries))
+
+    vectors = asyncio.run(main())
+    service.close()
+    assert [len(b) for b in embedder.batches] == [8, 8, 4]
+    for query, vector in zip(queries, vectors):
+        assert np.array_equal(vector, HashingEmbedder(32).embed(query))
+
+
+def test_errors_reach_every_caller_and_close_drains():
+    embedder = SlowEmbedder()
+    service = EmbeddingService(embedder, max_batch=4, max_wait_ms=20)
+    results = {}
+
+    def call(text):
+        try:
+            results[text] = service.embed(text)
+        except ValueError as exc:
+            results[text] = exc
+
+    threads = [threading.Thread(target=call, args=(t,)) for t in ("乾", "boom")]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert all(isinstance(r, ValueError) for r in results.values()) and len(results) == 2
+
+    pending = service.submit("坤")
+    service.close()
+    assert np.array_equal(pending.result(timeout=1), HashingEmbedder(32).embed("坤"))
+    # After close: embedded directly, not queued
+    assert np.array_equal(service.embed("坤"), HashingEmbedder(32).embed("坤"))
+    with pytest.raises(ValueError):
+        service.embed("boom")
+
+
+def test_embedding_backends(tmp_path):
+    (tmp_path / "config.json").write_text('{"hidden_size": 1024, "pad_token_id": 1}')
+    int8 = load_embedder("BAAI/bge-m3", backend="onnx-int8", onnx_dir=str(tmp_path))
+    assert isinstance(int8, OnnxEmbedder) and int8.dim == 1024 and int8.backend == "onnx-int8"
+    assert int8.MODEL_FILES[int8.quantized] == "model_quantized.onnx"
+    # Nothing is loaded until the first embedding, and nothing loaded is pickled
+    assert int8._session is None and pickle.loads(pickle.dumps(int8)).dim == 1024
+
+    assert isinstance(load_embedder("hashing", 64, backend="onnx-int8"), HashingEmbedder)
+    with pytest.raises(ValueError):
+        load_embedder("BAAI/bge-m3", backend="tensorrt")
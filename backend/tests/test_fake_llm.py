@@ -0,0 +1,61 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from app.core.fake_llm import FakeChatModel, FakeLLMError
+from app.core.llm import LLMClients
+
+
+async def _collect(model, prompt="乾卦"):
+    start = time.perf_counter()
+    stamps, text = [], ""
+    async for chunk in model.astream([HumanMessage(content=prompt)]):
+        stamps.append(time.perf_counter() - start)
+        text += chunk.content
+    return text, stamps
+
+
+def test_answers_are_deterministic_and_paced():
+    model = FakeChatModel(answer_tokens=20, first_token_delay=0.05, tokens_per_second=200)
+    text, stamps = asyncio.run(_collect(model))
+    again, _ = asyncio.run(_collect(model))
+    other, _ = asyncio.run(_collect(model, "坤卦"))
+
+    assert len(text) == 20 and text == again and text != other
+    assert 0.04 <= stamps[0] < 0.2
+    # 19 gaps at 5ms each
+    assert stamps[-1] - stamps[0] == pytest.approx(0.095, abs=0.05)
+
+
+def test_failure_injection():
+    before = FakeChatModel(answer_tokens=10, first_token_delay=0, tokens_per_second=0, failure_rate=1)
+    with pytest.raises(FakeLLMError):
+        asyncio.run(_collect(before))
+
+    received = []
+
+    async def midstream():
+        model = FakeChatModel(answer_tokens=10, first_token_delay=0, tokens_per_second=0,
+                              failure_rate=1, failure_mode="midstream")
+        async for chunk in model.astream([HumanMessage(content="乾卦")]):
+            received.append(chunk.content)
+
+    with pytest.raises(FakeLLMError):
+        asyncio.run(midstream())
+    assert 1 <= len(received) < 10
+
+    with pytest.raises(ValueError):
+        FakeChatModel(failure_mode="sometimes")
+
+
+def test_fake_backend_runs_behind_hedged_model():
+    clients = LLMClients()
+    backend = clients.backend("fake-test", "fake", kind="fake", first_token_delay=0, tokens_per_second=0,
+                              answer_tokens=8)
+    model = clients.chat_model([backend])
+
+    assert isinstance(backend.model, FakeChatModel)
+    assert len(asyncio.run(model.ainvoke([HumanMessage(content="乾卦")])).content) == 8
+    assert len(backend.latency) == 1
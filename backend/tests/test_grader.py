@@ -0,0 +1,55 @@
+import asyncio
+
+from prometheus_client import REGISTRY
+
+from app.agent import nodes
+from app.agent.graph import create_graph
+from app.core.bm25 import BM25, tokenize
+from app.core.fake_llm import FakeChatModel
+
+
+def test_bm25_relevance_prefers_documents_about_the_question():
+    docs = ["乾卦象辞：天行健，君子以自强不息。", "坤卦象辞：地势坤，君子以厚德载物。", "今天的天气预报说明天有雨。"]
+    relevance = BM25([tokenize(d) for d in docs]).relevance(tokenize("乾卦的象辞是什么？"))
+    assert relevance[0] > relevance[1] > relevance[2] == 0
+    assert all(0 <= r < 1 for r in relevance)
+    # Filler words and punctuation are not terms
+    assert tokenize("请问，乾卦是什么？") == ["乾卦"]
+
+
+def _run(monkeypatch, search):
+    queries = []
+
+    def retrieve_documents(query):
+        queries.append(query)
+        return search(query)
+
+    monkeypatch.setattr(nodes, "retrieve_documents", retrieve_documents)
+    monkeypatch.setattr(nodes, "llm", nodes.llm)
+    monkeypatch.setattr(nodes, "rag_chain", nodes.rag_chain)
+    monkeypatch.setattr(nodes, "answer_chain", nodes.answer_chain)
+    nodes.set_llm(FakeChatModel(first_token_delay=0, tokens_per_second=0, answer_tokens=5))
+    inputs = {"question": "讲讲乾卦的象辞", "messages": [], "documents": [], "generation": ""}
+    return asyncio.run(create_graph().ainvoke(inputs)), queries
+
+
+def test_irrelevant_documents_are_dropped_before_generate(monkeypatch):
+    dropped = REGISTRY.get_sample_value("agent_grader_documents_total", {"result": "dropped"}) or 0
+    result, queries = _run(monkeypatch, lambda q: ["乾卦象辞：天行健，君子以自强不息。", "明天有雨，记得带伞。"])
+    assert result["documents"] == ["乾卦象辞：天行健，君子以自强不息。"]
+    assert queries == ["讲讲乾卦的象辞"]
+    assert REGISTRY.get_sample_value("agent_grader_documents_total", {"result": "dropped"}) == dropped + 1
+
+
+def test_rewrite_loop_is_bounded(monkeypatch):
+    monkeypatch.setattr(nodes.settings, "RETRIEVAL_MAX_REWRITES", 1)
+    result, queries = _run(monkeypatch, lambda q: ["明天有雨，记得带伞。"])
+    # The original question, then one keyword rewrite (filler dropped); the question itself is unchanged
+    assert queries == ["讲讲乾卦的象辞", "乾卦 象辞"]
+    assert result["documents"] == [nodes.NO_DOCUMENTS]
+    assert result["question"] == "讲讲乾卦的象辞" and result["retrieve_attempts"] == 2
+
+    # A rewrite identical to the last query is not retried
+    monkeypatch.setattr(nodes.settings, "RETRIEVAL_MAX_REWRITES", 5)
+    _, queries = _run(monkeypatch, lambda q: ["明天有雨，记得带伞。"])
+    assert len(queries) == 2
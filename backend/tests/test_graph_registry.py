@@ -0,0 +1,36 @@
+import pytest
+
+from app.agent.registry import GraphRegistry, graph_registry, DEFAULT_GRAPH
+
+
+def test_default_graph_is_compiled_once():
+    first = graph_registry.get()
+    assert graph_registry.get(DEFAULT_GRAPH) is first
+
+
+def test_variants_and_reload():
+    calls = []
+
+    def builder():
+        calls.append(1)
+        return object()
+
+    registry = GraphRegistry()
+    registry.register("a", builder)
+    registry.register("b", builder)
+    assert registry.variants() == ["a", "b"]
+
+    build_times = registry.warm()
+    assert set(build_times) == {"a", "b"}
+    assert len(calls) == 2
+
+    old = registry.get("a")
+    registry.reload("a")
+    assert registry.get("a") is not old
+    assert registry.get("b") is registry.get("b")
+    assert len(calls) == 3
+
+    with pytest.raises(ValueError):
+        registry.register("a", builder)
+    with pytest.raises(KeyError):
+        registry.get("missing")
@@ -0,0 +1,34 @@
+import os
+
+from app.tools import hexagrams
+from app.tools.iching import IChingTool
+
+CORPUS = os.path.join(os.path.dirname(__file__), "..", "..", "data", "iching.txt")
+
+
+def test_table_covers_every_pattern_once():
+    entries = hexagrams.hexagrams()
+    assert [e["number"] for e in entries] == list(range(1, 65))
+    assert len({e["pattern"] for e in entries}) == 64
+    # Lines bottom first: 屯 is 坎 over 震, 姤 has one yin line at the bottom
+    assert hexagrams.hexagram("100010")["title"] == "水雷屯"
+    assert hexagrams.hexagram("011111")["name"] == "姤"
+    assert [line["label"] for line in hexagrams.hexagram("000000")["lines"]] == ["初六", "六二", "六三", "六四", "六五", "上六"]
+
+
+def test_shipped_table_matches_corpus():
+    with open(CORPUS, encoding="utf-8") as f:
+        table = hexagrams.build_table(f.read())
+    assert [hexagrams._row(e) for e in table] == hexagrams.load_table()
+    qian = hexagrams.hexagram("111111")
+    assert qian["judgment"] == {"text": "元，亨，利，贞。", "translation": "大吉大利，吉祥贞正。"}
+    assert qian["lines"][0] == {"label": "初九", "text": "潜龙，勿用。", "translation": "龙潜伏在水中，不宜行动。"}
+    assert qian["extra"]["label"] == "用九"
+
+
+def test_iching_tool_names_hexagrams_and_moving_lines():
+    tool = IChingTool()
+    lines = [9, 7, 7, 7, 7, 7]
+    assert tool._identify_hexagram(lines)["title"] == "乾为天"
+    assert tool._identify_changed_hexagram(lines)["title"] == "天风姤"
+    assert tool._moving_lines(lines) == [{"label": "初九", "text": "潜龙，勿用。"}]
@@ -0,0 +1,127 @@
+import os
+
+import numpy as np
+import pytest
+
+from app.core import index_builder
+from app.core.embeddings import HashingEmbedder
+from app.core.vector_index import VectorIndex
+
+
+class CountingEmbedder(HashingEmbedder):
+    def __init__(self):
+        super().__init__(32)
+        self.texts = []
+
+    def embed_batch(self, texts):
+        self.texts.extend(texts)
+        return super().embed_batch(texts)
+
+
+def _docs(*texts):
+    return [{"text": t, "source": "iching", "name": t[0]} for t in texts]
+
+
+def test_rebuild_embeds_only_new_and_changed_chunks(tmp_path):
+    path = str(tmp_path / "idx")
+    first = index_builder.build(path, _docs("乾为天", "坤为地", "水雷屯"), CountingEmbedder(), "hashing")
+    assert (first.embedded, first.reused, first.removed) == (3, 0, 0)
+    before = VectorIndex(path)
+    qian = np.array(before.vectors[0])
+
+    embedder = CountingEmbedder()
+    report = index_builder.build(path, _docs("乾为天", "坤为地（改）", "山水蒙", "山水蒙"), embedder, "hashing")
+    assert embedder.texts == ["坤为地（改）", "山水蒙"]  # duplicates are embedded once
+    assert (report.embedded, report.reused, report.removed) == (2, 1, 2)
+    assert report.changed == [("iching", "坤")]
+    after = VectorIndex(path)
+    assert after.texts == ["乾为天", "坤为地（改）", "山水蒙", "山水蒙"]
+    assert np.array_equal(after.vectors[0], qian)
+    assert np.allclose(after.vectors[1], HashingEmbedder(32).embed("坤为地（改）"))
+
+    # Dry run: the diff only, nothing embedded or written
+    mtime = os.path.getmtime(path + ".npy")
+    embedder = CountingEmbedder()
+    dry = index_builder.build(path, _docs("乾为天"), embedder, "hashing", dry_run=True)
+    assert (dry.embedded, dry.reused, dry.removed, dry.dry_run) == (0, 1, 2, True)
+    assert embedder.texts == [] and os.path.getmtime(path + ".npy") == mtime
+
+
+def test_stale_manifest_or_other_embedder_means_full_rebuild(tmp_path):
+    path = str(tmp_path / "idx")
+    index_builder.build(path, _docs("乾为天", "坤为地"), CountingEmbedder(), "hashing")
+    assert index_builder.build(path, _docs("乾为天", "坤为地"), CountingEmbedder(), "other").embedded == 2
+
+    # The metadata no longer matches the manifest (interrupted build)
+    with open(path + ".meta.json", "a", encoding="utf-8") as f:
+        f.write(" ")
+    assert index_builder.build(path, _docs("乾为天", "坤为地"), CountingEmbedder(), "other").embedded == 2
+    assert index_builder.build(path, _docs("乾为天", "坤为地"), CountingEmbedder(), "other").embedded == 0
+
+
+def test_other_backend_means_full_rebuild(tmp_path):
+    class Int8Embedder(CountingEmbedder):
+        backend = "onnx-int8"
+
+    path = str(tmp_path / "idx")
+    index_builder.build(path, _docs("乾为天", "坤为地"), CountingEmbedder(), "model")
+    assert VectorIndex(path).backend == "hashing"
+    # Same model and dimension, quantised: none of the old vectors may be reused
+    assert index_builder.build(path, _docs("乾为天", "坤为地"), Int8Embedder(), "model").embedded == 2
+    assert VectorIndex(path).backend == "onnx-int8"
+    assert index_builder.build(path, _docs("乾为天", "坤为地"), Int8Embedder(), "model").embedded == 0
+
+
+def test_pool_build_streams_batches_in_order(tmp_path, monkeypatch):
+    # Over the budget from the first batch on: every batch is drained before the next is submitted
+    samples = iter([0.0])
+    monkeypatch.setattr(index_builder, "tree_rss_mb", lambda: next(samples, 10.0))
+    texts = [f"第{i}条 {'乾坤' * (i % 5)}" for i in range(50)] + ["第0条 "]
+    stream = (doc for doc in _docs(*texts))
+    ticks = []
+    report = index_builder.build(
+        str(tmp_path / "pool"), stream, HashingEmbedder(32), "hashing",
+        batch_size=8, workers=2, max_memory_mb=1, progress=lambda r: ticks.append(r.written),
+    )
+    assert (report.documents, report.embedded) == (51, 50)  # the last one repeats the first batch
+    assert ticks == list(range(8, 51, 8)) + [51]
+
+    serial = index_builder.build(str(tmp_path / "serial"), _docs(*texts), HashingEmbedder(32), "hashing")
+    pooled, expected = VectorIndex(str(tmp_path / "pool")), VectorIndex(str(tmp_path / "serial"))
+    assert pooled.texts == texts
+    assert np.allclose(pooled.vectors, expected.vectors)
+    assert serial.embedded == 50
+    with open(str(tmp_path / "pool") + ".bm25.npz", "rb") as a, open(str(tmp_path / "serial") + ".bm25.npz", "rb") as b:
+        assert a.read() == b.read()
+
+
+def test_memory_budget_halves_in_process_batches(tmp_path, monkeypatch):
+    over = {"on": False}
+    monkeypatch.setattr(index_builder, "tree_rss_mb", lambda: 500.0 if over["on"] else 100.0)
+    ticks = []
+
+    def progress(report):
+        ticks.append(report.written)
+        over["on"] = report.written >= 16  # the build grows past the budget after two batches
+
+    texts = [f"第{i}条" for i in range(40)]
+    report = index_builder.build(
+        str(tmp_path / "index"), iter(_docs(*texts)), HashingEmbedder(32), "hashing",
+        batch_size=8, max_memory_mb=200, progress=progress,
+    )
+    assert report.documents == 40 and report.peak_rss_mb == 500.0
+    assert ticks[:7] == [8, 16, 20, 22, 23, 24, 25]
+    assert VectorIndex(str(tmp_path / "index")).texts == texts
+
+
+def test_memory_budget_counts_workers_and_rejects_unreachable_budget(tmp_path, monkeypatch):
+    # Every worker reports 1000MB, this process 10MB
+    monkeypatch.setattr(index_builder, "rss_mb", lambda pid="self": 10.0 if pid == "self" else 1000.0)
+    report = index_builder.build(
+        str(tmp_path / "pool"), _docs(*[f"第{i}条" for i in range(20)]), HashingEmbedder(32), "hashing",
+        batch_size=4, workers=2,
+    )
+    assert report.peak_rss_mb >= 2010.0
+
+    with pytest.raises(index_builder.MemoryBudgetExceeded):
+        index_builder.build(str(tmp_path / "other"), _docs("乾为天"), HashingEmbedder(32), "hashing", max_memory_mb=5)
@@ -0,0 +1,99 @@
+import asyncio
+import time
+from types import SimpleNamespace
+
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from app.agent import nodes
+from app.agent.graph import create_graph
+from app.agent.intent import KeywordMatcher, RoutePlan, match_intent, match_intents, plan_route
+from app.agent.registry import graph_registry
+
+
+def test_keyword_matcher_finds_overlapping_keywords():
+    matcher = KeywordMatcher({"he": 1, "she": 2, "his": 3, "hers": 4})
+    assert sorted(matcher.finditer("ushers")) == [(1, "she", 2), (2, "he", 1), (2, "hers", 4)]
+
+
+def test_tool_intents_and_arguments():
+    assert match_intent("帮我占一卦").intent == "iching"
+    assert match_intent("請幫我算一卦").intent == "iching"
+    assert match_intent("1990年出生属什么").args == {"year": 1990}
+    assert match_intent("我1995年3月25日出生，是什么星座").args == {"date_str": "1995-03-25"}
+    assert match_intent("八字 1990年5月1日 8点30分").args == {"datetime_str": "1990-05-01 08:30"}
+    assert match_intent("帮我给姓欧阳的女宝宝起个名").args == {"surname": "欧阳", "gender": "girl"}
+
+
+def test_llm_path_for_knowledge_or_missing_arguments():
+    assert match_intent("乾卦是什么意思") is None
+    assert match_intent("占卜的由来") is None
+    assert match_intent("白羊座性格") is None  # no birth date
+    assert match_intent("起个名字吧") is None  # no surname/gender
+    assert [m.intent for m in match_intents("1990年3月1日出生，什么星座，属什么")] == ["horoscope", "zodiac"]
+
+
+def test_graph_answers_tool_intents_without_llm():
+    inputs = {"question": "1990年出生属什么", "messages": [], "documents": [], "generation": ""}
+    result = asyncio.run(graph_registry.get().ainvoke(inputs))
+    assert result["route"] == "tool"
+    assert result["intent"] == "zodiac"
+    assert "马" in result["generation"]
+
+
+def test_route_plan_for_multi_intent_questions():
+    plan = plan_route("1990年出生属什么，今年运势如何")
+    assert [m.intent for m in plan.intents] == ["zodiac"] and plan.llm
+    assert not plan_route("1990年3月1日出生，什么星座，属什么").llm
+    assert plan_route("乾卦是什么意思") == RoutePlan([], True)
+
+
+def _slow_branches(monkeypatch, delay):
+    def slow_retrieve(question):
+        time.sleep(delay)
+        return ["乾为天"]
+
+    def slow_tool(name, result):
+        return SimpleNamespace(name=name, run=lambda args: time.sleep(delay) or result)
+
+    monkeypatch.setattr(nodes, "retrieve_documents", slow_retrieve)
+    # The stand-in document is unrelated to the questions; keep it (see test_grader)
+    monkeypatch.setattr(nodes.settings, "GRADER_ENABLED", False)
+    monkeypatch.setattr(nodes, "zodiac_tool", slow_tool("zodiac", {"year": 1990, "sign": "马", "compatibility": {"best": ["虎"], "worst": ["鼠"]}}))
+    monkeypatch.setattr(nodes, "horoscope_tool", slow_tool("horoscope", {"date": "1990-03-01", "sign": "双鱼座"}))
+    seen = []
+
+    async def fake_llm(prompt):
+        seen.append(prompt.to_messages()[-1].content)
+        return AIMessage(content="答")
+
+    monkeypatch.setattr(nodes, "rag_chain", nodes.RAG_PROMPT | RunnableLambda(fake_llm))
+    return seen
+
+
+def _timed_run(graph, question):
+    inputs = {"question": question, "messages": [], "documents": [], "generation": ""}
+    start = time.perf_counter()
+    result = asyncio.run(graph.ainvoke(inputs))
+    return result, time.perf_counter() - start
+
+
+def test_tool_and_retrieval_branches_run_in_parallel(monkeypatch):
+    seen = _slow_branches(monkeypatch, 0.2)
+
+    result, elapsed = _timed_run(create_graph(max_concurrency=4), "1990年出生属什么，今年运势如何")
+    assert result["route"] == "llm" and result["generation"] == "答"
+    # The LLM sees the tool result next to the retrieved context
+    assert "生肖是：马" in seen[0] and "乾为天" in seen[0]
+    assert elapsed < 0.35
+
+    result, elapsed = _timed_run(create_graph(max_concurrency=4), "1990年3月1日出生，什么星座，属什么")
+    assert result["route"] == "tool" and result["intent"] == "horoscope,zodiac"
+    assert result["generation"].index("双鱼座") < result["generation"].index("马")
+    assert elapsed < 0.35
+
+
+def test_branch_concurrency_cap(monkeypatch):
+    _slow_branches(monkeypatch, 0.1)
+    _, elapsed = _timed_run(create_graph(max_concurrency=1), "1990年3月1日出生，什么星座，属什么")
+    assert elapsed >= 0.2
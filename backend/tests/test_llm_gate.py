@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.llm import LLMGate, LLMOverloaded, llm_clients
+
+
+def test_gate_limits_in_flight_and_reports_positions():
+    async def main():
+        gate = LLMGate("test", max_in_flight=2, max_queue=2, queue_timeout=5)
+        running, peak, order = 0, 0, []
+        positions = {}
+
+        async def call(i):
+            nonlocal running, peak
+
+            async def on_queued(position):
+                positions.setdefault(i, []).append(position)
+
+            async with gate.slot(on_queued=on_queued):
+                running += 1
+                peak = max(peak, running)
+                order.append(i)
+                await asyncio.sleep(0.02)
+                running -= 1
+
+        tasks = [asyncio.ensure_future(call(i)) for i in range(4)]
+        await asyncio.sleep(0)
+        with pytest.raises(LLMOverloaded) as rejected:
+            await gate.acquire()
+        assert rejected.value.reason == "queue_full"
+        await asyncio.gather(*tasks)
+        await asyncio.sleep(0)
+        return peak, order, positions, gate
+
+    peak, order, positions, gate = asyncio.run(main())
+    assert peak == 2
+    assert order == [0, 1, 2, 3]
+    assert positions[2] == [1]
+    assert positions[3] == [2, 1]
+    assert gate.in_flight == 0 and gate.queue_depth == 0
+
+
+def test_gate_queue_timeout_and_cancelled_waiters():
+    async def main():
+        gate = LLMGate("test", max_in_flight=1, max_queue=4, queue_timeout=0.02)
+        await gate.acquire()
+        with pytest.raises(LLMOverloaded) as timed_out:
+            await gate.acquire()
+        assert timed_out.value.reason == "queue_timeout"
+
+        gate.queue_timeout = 5
+        waiter = asyncio.ensure_future(gate.acquire())
+        await asyncio.sleep(0)
+        waiter.cancel()
+        await asyncio.sleep(0.01)
+        assert gate.queue_depth == 0
+        gate.release()
+        assert gate.in_flight == 0
+
+    asyncio.run(main())
+
+
+def test_saturated_gate_rejects_llm_requests_early():
+    from app.main import app
+
+    gate = llm_clients.gate()
+    saved = gate.in_flight, gate.max_queue
+    gate.in_flight, gate.max_queue = gate.max_in_flight, 0
+    try:
+        client = TestClient(app)
+        headers = {"X-Trace-ID": "trace-busy"}
+        response = client.post("/api/v1/chat/", json={"message": "坤卦讲了什么道理"}, headers=headers)
+        assert response.status_code == 503
+        assert response.json()["error"] == "overloaded"
+        assert response.json()["trace_id"] == "trace-busy"
+
+        stream = client.post("/api/v1/chat/stream", json={"message": "坤卦讲了什么道理"}, headers=headers)
+        assert '"code": "overloaded"' in stream.text
+        assert '"trace_id": "trace-busy"' in stream.text
+
+        # Tool intents never touch the LLM and are still served
+        assert client.post("/api/v1/chat/", json={"message": "1990年出生属什么"}).status_code == 200
+    finally:
+        gate.in_flight, gate.max_queue = saved
@@ -0,0 +1,118 @@
+import asyncio
+import time
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from app.core.llm import LLMClients, LLMOverloaded
+from mock_openai import MockOpenAIServer
+
+
+def _clients(*servers, **overrides):
+    clients = LLMClients()
+    backends = [
+        clients.backend(f"mock-{i}", "mock-model", server.api_base, max_retries=0, **overrides)
+        for i, server in enumerate(servers)
+    ]
+    clients.backends = backends
+    return clients, backends
+
+
+async def _stream(model, question="乾卦"):
+    return "".join([chunk.content async for chunk in model.astream([HumanMessage(content=question)])])
+
+
+def test_slow_primary_is_hedged_and_loser_cancelled():
+    with MockOpenAIServer("慢", first_token_delay=2.0) as slow, MockOpenAIServer("快") as fast:
+        clients, backends = _clients(slow, fast)
+        # Enough samples that the hedge threshold is the primary's p95 (~0.1s)
+        for _ in range(20):
+            backends[0].latency.record(0.1)
+        model = clients.chat_model(backends)
+
+        async def main():
+            start = time.perf_counter()
+            answer = await _stream(model)
+            elapsed = time.perf_counter() - start
+            await asyncio.sleep(0.1)
+            await clients.aclose()
+            return answer, elapsed
+
+        answer, elapsed = asyncio.run(main())
+        assert answer == "快"
+        assert elapsed < 1.0
+        assert slow.requests == 1 and fast.requests == 1
+        assert slow.cancelled == 1
+        assert backends[0].gate.in_flight == 0 and backends[1].gate.in_flight == 0
+        # The lost race is remembered as a (censored) slow sample
+        assert backends[0].latency.percentile(100) >= 0.1
+
+
+def test_fast_primary_is_not_hedged():
+    with MockOpenAIServer("乾为天") as primary, MockOpenAIServer("坤为地") as secondary:
+        clients, backends = _clients(primary, secondary)
+        model = clients.chat_model(backends)
+
+        async def main():
+            answers = [await _stream(model) for _ in range(3)]
+            await clients.aclose()
+            return answers
+
+        assert asyncio.run(main()) == ["乾为天"] * 3
+        assert secondary.requests == 0
+        assert len(backends[0].latency) == 3
+
+
+def test_failover_and_ejection_on_error_rate():
+    with MockOpenAIServer(status=500) as broken, MockOpenAIServer("坤为地") as healthy:
+        clients, backends = _clients(broken, healthy)
+        model = clients.chat_model(backends)
+
+        async def main():
+            answers = [await _stream(model) for _ in range(8)]
+            await clients.aclose()
+            return answers
+
+        assert asyncio.run(main()) == ["坤为地"] * 8
+        # Ejected after LLM_FAILOVER_MIN_REQUESTS failures, then skipped
+        assert broken.requests == 5
+        assert not backends[0].health.healthy()
+        assert backends[0].health.error_rate == 1.0
+
+
+def test_all_backends_failing_raises():
+    with MockOpenAIServer(status=503) as a, MockOpenAIServer(status=500) as b:
+        clients, backends = _clients(a, b)
+        model = clients.chat_model(backends)
+
+        async def main():
+            try:
+                with pytest.raises(Exception):
+                    await _stream(model)
+            finally:
+                await clients.aclose()
+
+        asyncio.run(main())
+        assert a.requests == 1 and b.requests == 1
+
+
+def test_full_primary_queue_fails_over():
+    with MockOpenAIServer("乾") as primary, MockOpenAIServer("坤") as secondary:
+        clients, backends = _clients(primary, secondary)
+        gate = backends[0].gate
+        gate.in_flight, gate.max_queue = gate.max_in_flight, 0
+        model = clients.chat_model(backends)
+
+        async def main():
+            try:
+                return await _stream(model)
+            finally:
+                await clients.aclose()
+
+        assert asyncio.run(main()) == "坤"
+        assert primary.requests == 0
+        assert clients.saturated() is False
+        backends[1].gate.in_flight, backends[1].gate.max_queue = backends[1].gate.max_in_flight, 0
+        assert clients.saturated() is True
+        with pytest.raises(LLMOverloaded):
+            asyncio.run(_stream(clients.chat_model(backends)))
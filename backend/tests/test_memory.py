@@ -0,0 +1,131 @@
+import asyncio
+import time
+
+from fastapi.testclient import TestClient
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+from app.core.memory import (
+    InMemorySessionStore, SessionMemory, SessionMemoryManager, extractive_summary, session_memory,
+)
+from app.core.tokens import count_tokens
+
+
+def _manager(**kwargs):
+    params = dict(window_turns=2, history_budget=200, summary_budget=60)
+    params.update(kwargs)
+    return SessionMemoryManager(InMemorySessionStore(100, 60), extractive_summary, **params)
+
+
+def test_old_turns_fold_into_bounded_summary():
+    async def main():
+        memory = _manager()
+        for i in range(12):
+            await memory.record("s1", f"第{i}个问题", f"第{i}个回答。后面的解释很长很长。")
+        return await memory.load("s1")
+
+    state = asyncio.run(main())
+    assert [q for q, _ in state.turns] == ["第10个问题", "第11个问题"]
+    assert "第9个问题" in state.summary and "第0个问题" not in state.summary
+    assert count_tokens(state.summary) <= 60
+
+
+def test_long_answers_fold_by_token_budget():
+    async def main():
+        memory = _manager(window_turns=10, history_budget=50)
+        await memory.record("s1", "乾卦", "元亨利贞。" * 10)
+        await memory.record("s1", "坤卦", "元亨。")
+        return await memory.load("s1")
+
+    state = asyncio.run(main())
+    assert state.turns == [("坤卦", "元亨。")]
+    assert state.summary.startswith("问：乾卦 答：元亨利贞。")
+
+
+def test_shared_session_is_not_remembered_and_idle_sessions_expire():
+    async def main():
+        memory = _manager()
+        await memory.record("default", "乾卦", "元亨利贞。")
+        assert not await memory.load("default")
+
+        store = InMemorySessionStore(max_sessions=2, idle_ttl=0.05)
+        for sid in ("a", "b", "c"):
+            await store.put(sid, SessionMemory(turns=[("q", "a")]).to_json())
+        assert await store.get("a") is None  # least recently used
+        time.sleep(0.06)
+        assert await store.get("c") is None and len(store) == 0
+
+    asyncio.run(main())
+
+
+def test_generate_sees_history_and_summary(monkeypatch):
+    from app.agent import nodes
+
+    seen = {}
+
+    def fake_llm(prompt):
+        seen["messages"] = prompt.to_messages()
+        return AIMessage(content="回答")
+
+    monkeypatch.setattr(nodes, "rag_chain", nodes.RAG_PROMPT | RunnableLambda(fake_llm))
+    memory = SessionMemory(summary="问：我姓李", turns=[("我是1990年生的", "您属马。")])
+    state = {"question": "那我适合什么名字", "documents": [], "messages": memory.messages(), "summary": memory.summary}
+    result = asyncio.run(nodes.generate(state))
+    contents = [m.content for m in seen["messages"]]
+    assert "问：我姓李" in contents[0]
+    assert contents[1:3] == ["我是1990年生的", "您属马。"]
+    assert result["prompt_tokens"] > count_tokens("".join(contents[:3]))
+
+
+def test_chat_endpoint_records_turns_per_session():
+    from app.main import app
+
+    client = TestClient(app)
+    client.post("/api/v1/chat/", json={"message": "1990年出生属什么", "session_id": "mem-test"})
+    client.post("/api/v1/chat/", json={"message": "1990年出生属什么", "session_id": "mem-other"})
+    state = asyncio.run(session_memory.load("mem-test"))
+    assert len(state.turns) == 1 and "马" in state.turns[0][1]
+    assert len(asyncio.run(session_memory.load("mem-other")).turns) == 1
+
+
+class _NetworkStore(InMemorySessionStore):
+    """Yields between the read and the write of an update, as a remote store does."""
+
+    async def update(self, session_id, fn):
+        raw = await self.get(session_id)
+        await asyncio.sleep(0.01)
+        raw = fn(raw)
+        if raw is not None:
+            await self.put(session_id, raw)
+        return raw
+
+
+def test_concurrent_turns_of_one_session_are_both_kept():
+    async def main():
+        memory = SessionMemoryManager(
+            _NetworkStore(100, 60), extractive_summary, window_turns=10, history_budget=500, summary_budget=60,
+        )
+        await asyncio.gather(memory.record("s1", "乾卦", "元亨利贞。"), memory.record("s1", "坤卦", "元亨。"))
+        return await memory.load("s1")
+
+    state = asyncio.run(main())
+    assert sorted(state.turns) == [("乾卦", "元亨利贞。"), ("坤卦", "元亨。")]
+
+
+def test_fold_keeps_turns_written_meanwhile():
+    async def slow_summary(summary, turns):
+        # Another worker records a turn while the summary is being written
+        await store.put("s1", SessionMemory(turns=stored.turns + [("震卦", "亨。")]).to_json())
+        return await extractive_summary(summary, turns)
+
+    async def main():
+        memory = SessionMemoryManager(store, slow_summary, window_turns=1, history_budget=500, summary_budget=60)
+        await memory.record("s1", "乾卦", "元亨利贞。")
+        stored.turns = [("乾卦", "元亨利贞。"), ("坤卦", "元亨。")]
+        await memory.record("s1", "坤卦", "元亨。")
+        return await memory.load("s1")
+
+    store, stored = InMemorySessionStore(100, 60), SessionMemory()
+    state = asyncio.run(main())
+    assert state.turns == [("坤卦", "元亨。"), ("震卦", "亨。")]
+    assert state.summary.startswith("问：乾卦")
@@ -0,0 +1,121 @@
+import asyncio
+import json
+import time
+
+from fastapi.testclient import TestClient
+
+from app.core.resumable import ResumableStreams, SQLiteStreamStore
+
+
+async def _frames(n, delay=0.0):
+    for i in range(n):
+        if delay:
+            await asyncio.sleep(delay)
+        yield {"event": "message", "data": f"frame {i}"}
+
+
+def _streams(tmp_path, ttl=60, abandon_grace=5):
+    return ResumableStreams(
+        SQLiteStreamStore(str(tmp_path / "sse.db")), ttl=ttl, checkpoint_interval=0.01, abandon_grace=abandon_grace,
+    )
+
+
+def test_reconnect_reattaches_to_running_stream(tmp_path):
+    async def main():
+        streams = _streams(tmp_path)
+        buffer = streams.start(_frames(6, delay=0.01))
+        first = []
+        async for frame in buffer.follow():
+            first.append(frame)
+            if len(first) == 2:
+                break  # connection dropped
+        resumed = await streams.resume(first[-1]["id"])
+        rest = [frame async for frame in resumed]
+        await streams.aclose()
+        return first, rest
+
+    first, rest = asyncio.run(main())
+    assert [f["data"] for f in first + rest] == [f"frame {i}" for i in range(6)]
+    seqs = [int(f["id"].rsplit(":", 1)[1]) for f in first + rest]
+    assert seqs == list(range(1, 7))
+
+
+def test_finished_stream_resumes_from_checkpoint(tmp_path):
+    async def main():
+        streams = _streams(tmp_path)
+        buffer = streams.start(_frames(5))
+        frames = [frame async for frame in buffer.follow()]
+        await streams.aclose()
+
+        # A fresh process (or another worker) only has the SQLite checkpoint
+        restarted = _streams(tmp_path)
+        resumed = await restarted.resume(frames[1]["id"])
+        rest = [frame async for frame in resumed]
+        unknown = await restarted.resume("nope:3")
+        restarted.store.close()
+        return frames, rest, unknown
+
+    frames, rest, unknown = asyncio.run(main())
+    assert rest == frames[2:]
+    assert unknown is None
+
+
+def test_stream_owned_by_other_worker_is_polled(tmp_path):
+    async def main():
+        owner, other = _streams(tmp_path), _streams(tmp_path)
+        buffer = owner.start(_frames(5, delay=0.03))
+        await asyncio.sleep(0.05)
+        resumed = await other.resume(f"{buffer.stream_id}:0")
+        frames = [frame async for frame in resumed]
+        await owner.aclose()
+        other.store.close()
+        return frames
+
+    assert [f["data"] for f in asyncio.run(main())] == [f"frame {i}" for i in range(5)]
+
+
+def test_stream_of_dead_worker_ends_with_error(tmp_path):
+    async def main():
+        # The owner checkpointed two frames and died before finishing the stream
+        owner = SQLiteStreamStore(str(tmp_path / "sse.db"))
+        await owner.write("dead", [{"id": "dead:1", "data": "a"}, {"id": "dead:2", "data": "b"}])
+        owner.close()
+
+        other = _streams(tmp_path, ttl=0.1)
+        resumed = await other.resume("dead:1")
+        frames = [frame async for frame in resumed]
+        other.store.close()
+        return frames
+
+    frames = asyncio.run(main())
+    assert [f.get("id") for f in frames] == ["dead:2", None]
+    lost = json.loads(frames[-1]["data"])
+    assert frames[-1]["event"] == "error" and lost["code"] == "stream_lost" and lost["last_event_id"] == "dead:2"
+
+
+def test_finished_streams_expire(tmp_path):
+    async def main():
+        streams = _streams(tmp_path, ttl=0.05)
+        buffer = streams.start(_frames(2))
+        frames = [frame async for frame in buffer.follow()]
+        await asyncio.sleep(0.1)
+        assert await streams.resume(frames[0]["id"]) is None
+        await streams.aclose()
+
+    asyncio.run(main())
+
+
+def test_stream_endpoint_resumes_with_last_event_id():
+    from app.main import app
+
+    client = TestClient(app)
+    body = {"message": "1990年出生属什么"}
+    with client.stream("POST", "/api/v1/chat/stream", json=body) as response:
+        lines = [line for line in response.iter_lines() if line.startswith(("id:", "data:"))]
+    ids = [line[3:].strip() for line in lines if line.startswith("id:")]
+    assert len(ids) >= 3 and len(set(i.rsplit(":", 1)[0] for i in ids)) == 1
+
+    resumed = client.post("/api/v1/chat/stream", json=body, headers={"Last-Event-ID": ids[0]})
+    resumed_ids = [line[3:].strip() for line in resumed.text.splitlines() if line.startswith("id:")]
+    assert resumed_ids == ids[1:]
+    assert '"type": "done"' in resumed.text
@@ -0,0 +1,85 @@
+import sqlite3
+
+import numpy as np
+
+from app.core import index_builder, rag
+from app.core.corpus import corpus_version
+from app.core.embeddings import HASHING, HashingEmbedder
+from app.core.retrieval_cache import RetrievalCache
+
+
+def test_memory_then_disk_then_compute(tmp_path):
+    path = str(tmp_path / "cache.db")
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return np.arange(4, dtype=np.float32)
+
+    cache = RetrievalCache(path, max_entries=2)
+    cache.open("v1")
+    assert np.array_equal(cache.vector("乾卦", compute), np.arange(4))
+    assert np.array_equal(cache.vector("乾卦", compute), np.arange(4))
+    assert cache.results("乾卦\x004", lambda: [(3, 0.5), (1, 0.25)]) == [(3, 0.5), (1, 0.25)]
+    cache.close()
+    assert len(calls) == 1
+    assert cache.stats()["vector"]["memory_hit"] == 1 and cache.stats()["vector"]["memory_bytes"] > 16
+
+    # A new process: served from the file
+    cache = RetrievalCache(path)
+    cache.open("v1")
+    assert np.array_equal(cache.vector("乾卦", compute), np.arange(4))
+    assert cache.results("乾卦\x004", lambda: []) == [(3, 0.5), (1, 0.25)]
+    assert cache.stats()["result"]["disk_hit"] == 1 and len(calls) == 1
+
+    # A new corpus version: nothing carries over, and the file drops the old rows
+    cache.open("v2")
+    cache.vector("乾卦", compute)
+    cache.close()
+    assert len(calls) == 2
+    with sqlite3.connect(path) as db:
+        assert {v for (v,) in db.execute("SELECT version FROM rag_cache")} == {"v2"}
+
+
+def test_rebuilt_index_invalidates_cached_results(tmp_path, monkeypatch):
+    for name in ("_index_cache", "_lexical_index", "_embedder", "_cache", "_rag_available", "_loaded"):
+        monkeypatch.setattr(rag, name, getattr(rag, name))  # restored after the test
+    monkeypatch.setattr(rag.settings, "EMBEDDING_MODEL", HASHING)
+    path = str(tmp_path / "classics")
+    docs = [{"text": t, "source": "iching", "name": t[0]} for t in ("乾为天：天行健", "坤为地：地势坤")]
+    index_builder.build(path, docs, HashingEmbedder(64), HASHING)
+    rag.load_index(path)
+    first = rag._cache.version
+    assert rag.retrieve_documents("天行健！", k=1) == ["乾为天：天行健"]
+    assert rag.retrieve_documents("天行健", k=1) == ["乾为天：天行健"]  # same normalised query
+    assert rag._cache.stats()["result"]["memory_hit"] == 1
+
+    # A no-op rebuild keeps the version; a changed corpus publishes a new one
+    index_builder.build(path, docs, HashingEmbedder(64), HASHING)
+    assert corpus_version(path) == first
+    docs[0]["text"] = "乾为天：天行健，君子以自强不息"
+    index_builder.build(path, docs, HashingEmbedder(64), HASHING)
+    rag.load_index(path)
+    assert rag._cache.version != first
+    assert rag.retrieve_documents("天行健", k=1) == ["乾为天：天行健，君子以自强不息"]
+    rag.close()
+
+
+def test_cached_and_uncached_rankings_agree(tmp_path, monkeypatch):
+    for name in ("_index_cache", "_lexical_index", "_embedder", "_cache", "_rag_available", "_loaded"):
+        monkeypatch.setattr(rag, name, getattr(rag, name))  # restored after the test
+    monkeypatch.setattr(rag.settings, "EMBEDDING_MODEL", HASHING)
+    path = str(tmp_path / "classics")
+    docs = [{"text": t, "source": "iching", "name": t[0]} for t in ("乾为天：天行健", "坤为地：地势坤", "屯：元亨利贞")]
+    index_builder.build(path, docs, HashingEmbedder(64), HASHING)
+
+    monkeypatch.setattr(rag.settings, "RAG_CACHE_ENABLED", False)
+    rag.load_index(path)
+    uncached = rag.search("天行健", k=3)
+    # The cache key is the normalised question, and so is the text ranked under it
+    monkeypatch.setattr(rag.settings, "RAG_CACHE_ENABLED", True)
+    rag.load_index(path)
+    rag.search("天行健！！ ", k=3)
+    assert rag.search("天行健", k=3) == uncached
+    assert rag._cache.stats()["result"]["memory_hit"] == 1
+    rag.close()
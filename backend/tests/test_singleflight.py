@@ -0,0 +1,76 @@
+import asyncio
+
+from app.core.singleflight import SingleFlight
+
+
+def test_do_coalesces_concurrent_calls():
+    calls = []
+
+    async def work():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        flight = SingleFlight()
+        results = await asyncio.gather(*(flight.do("q", work) for _ in range(10)))
+        assert results == ["answer"] * 10
+        assert flight.inflight() == 0
+
+    asyncio.run(main())
+    assert len(calls) == 1
+
+
+def test_stream_fans_out_to_late_subscribers():
+    starts = []
+
+    async def tokens():
+        starts.append(1)
+        for token in ["a", "b", "c"]:
+            await asyncio.sleep(0.01)
+            yield token
+
+    async def collect(flight, delay=0.0):
+        await asyncio.sleep(delay)
+        return [t async for t in flight.stream("q", tokens)]
+
+    async def main():
+        flight = SingleFlight()
+        return await asyncio.gather(collect(flight), collect(flight, delay=0.015))
+
+    first, late = asyncio.run(main())
+    assert first == late == ["a", "b", "c"]
+    assert len(starts) == 1
+
+
+def test_subscribers_cancel_independently():
+    state = {"cancelled": False, "produced": 0}
+
+    async def tokens():
+        try:
+            for i in range(20):
+                await asyncio.sleep(0.01)
+                state["produced"] += 1
+                yield i
+        except asyncio.CancelledError:
+            state["cancelled"] = True
+            raise
+
+    async def collect(flight):
+        return [t async for t in flight.stream("q", tokens)]
+
+    async def main():
+        flight = SingleFlight()
+        a = asyncio.ensure_future(collect(flight))
+        b = asyncio.ensure_future(collect(flight))
+        await asyncio.sleep(0.03)
+        a.cancel()
+        await asyncio.sleep(0.03)
+        assert not state["cancelled"]
+        b.cancel()
+        await asyncio.sleep(0.02)
+        assert state["cancelled"]
+        assert flight.inflight() == 0
+
+    asyncio.run(main())
+    assert state["produced"] < 20
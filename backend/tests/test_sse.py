@@ -0,0 +1,44 @@
+import asyncio
+import json
+
+from app.core.sse import coalesce_tokens, message_frame
+
+
+async def _collect(source, **kwargs):
+    return [json.loads(f["data"]) async for f in coalesce_tokens(source, **kwargs)]
+
+
+def test_coalesce_batches_tokens_and_preserves_order():
+    async def source():
+        for token in ["乾", "为", "天", "，", "元"]:
+            yield token
+        yield message_frame({"type": "status", "content": "正在generate..."})
+        yield "亨"
+
+    frames = asyncio.run(_collect(source(), window_ms=1000, max_bytes=6))
+    assert frames == [
+        {"type": "token", "content": "乾"},          # first token is not delayed
+        {"type": "token", "content": "为天"},        # max_bytes reached
+        {"type": "token", "content": "，元"},        # flushed before the status frame
+        {"type": "status", "content": "正在generate..."},
+        {"type": "token", "content": "亨"},
+    ]
+
+
+def test_coalesce_flushes_on_window_during_stall():
+    async def source():
+        yield "a"
+        yield "b"
+        await asyncio.sleep(0.2)
+        yield "c"
+
+    async def main():
+        arrivals = []
+        async for frame in coalesce_tokens(source(), window_ms=20, max_bytes=1024):
+            arrivals.append((json.loads(frame["data"])["content"], asyncio.get_running_loop().time()))
+        return arrivals
+
+    arrivals = asyncio.run(main())
+    assert [content for content, _ in arrivals] == ["a", "b", "c"]
+    # "b" is released by the window timer, well before "c" arrives
+    assert arrivals[2][1] - arrivals[1][1] > 0.1
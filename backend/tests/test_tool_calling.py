@@ -0,0 +1,113 @@
+import asyncio
+import json
+import time
+
+from fastapi.testclient import TestClient
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, ToolMessage
+from langchain_core.outputs import ChatGenerationChunk
+from langchain_core.tools import tool
+from prometheus_client import REGISTRY
+
+from app.agent import nodes
+from app.agent.graph import create_graph
+from app.core.llm import LLMBackend, LLMClients
+
+
+class ToolCallingModel(BaseChatModel):
+    """Asks for the scripted tool calls, then answers with the tool results it was given."""
+
+    calls: list
+    requests: list = []
+
+    @property
+    def _llm_type(self) -> str:
+        return "scripted-tools"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        self.requests.append({"messages": messages, "tools": [t["function"]["name"] for t in kwargs.get("tools", [])]})
+        results = [m for m in messages if isinstance(m, ToolMessage)]
+        if not results:
+            chunks = [
+                {"name": c["name"], "args": json.dumps(c["args"]), "id": f"call_{i}", "index": i}
+                for i, c in enumerate(self.calls)
+            ]
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=chunks))
+            return
+        yield ChatGenerationChunk(message=AIMessageChunk(content=" | ".join(f"{m.name}:{m.status}" for m in results)))
+
+
+def _use_model(monkeypatch, model):
+    for name in ("llm", "rag_chain", "answer_chain"):
+        monkeypatch.setattr(nodes, name, getattr(nodes, name))  # restored after the test
+    clients = LLMClients()
+    nodes.set_llm(clients.chat_model([LLMBackend("scripted", model, clients.gate("scripted"))]))
+
+
+def _inputs(question):
+    return {"question": question, "messages": [], "documents": [], "generation": ""}
+
+
+def test_tool_calls_run_concurrently_and_are_answered_in_one_turn(monkeypatch):
+    @tool
+    async def slow_a(x: int) -> str:
+        """Slow tool A."""
+        await asyncio.sleep(0.2)
+        return f"a{x}"
+
+    @tool
+    async def slow_b(x: int) -> str:
+        """Slow tool B."""
+        await asyncio.sleep(0.2)
+        return f"b{x}"
+
+    @tool
+    async def hangs(x: int) -> str:
+        """Never returns in time."""
+        await asyncio.sleep(5)
+        return ""
+
+    @tool
+    def broken(x: int) -> str:
+        """Always fails."""
+        raise ValueError("boom")
+
+    monkeypatch.setattr(nodes.settings, "NODE_TOOL_TIMEOUT_SECONDS", 0.3)
+    monkeypatch.setattr(nodes, "tool_node", nodes.build_tool_node([slow_a, slow_b, hangs, broken]))
+    model = ToolCallingModel(calls=[{"name": n, "args": {"x": 1}} for n in ("slow_a", "slow_b", "hangs", "broken")], requests=[])
+    _use_model(monkeypatch, model)
+
+    answers_before = REGISTRY.get_sample_value("agent_retrieval_loop_iterations_count") or 0
+    start = time.perf_counter()
+    result = asyncio.run(create_graph().ainvoke(_inputs("讲讲周易")))
+    elapsed = time.perf_counter() - start
+
+    assert elapsed < 0.6  # not 0.2 + 0.2 + 0.3
+    assert result["generation"] == "slow_a:success | slow_b:success | hangs:error | broken:error"
+    assert result["tool_rounds"] == 1
+    # Two generate calls, one answer: the retrieval loop is observed once
+    assert REGISTRY.get_sample_value("agent_retrieval_loop_iterations_count") == answers_before + 1
+    # One follow-up turn with every tool answer; the model is offered the app's tools
+    assert len(model.requests) == 2
+    assert "zodiac_calculator" in model.requests[0]["tools"]
+    assert model.requests[1]["tools"] == []
+    contents = {m.name: m.content for m in model.requests[1]["messages"] if isinstance(m, ToolMessage)}
+    assert contents["slow_a"] == "a1" and "timed out" in contents["hangs"] and "boom" in contents["broken"]
+
+
+def test_stream_reports_tool_start_and_end(monkeypatch):
+    from app.main import app
+
+    monkeypatch.setattr(nodes.settings, "ANSWER_CACHE_ENABLED", False)
+    _use_model(monkeypatch, ToolCallingModel(calls=[{"name": "zodiac_calculator", "args": {"year": 1990}}], requests=[]))
+    with TestClient(app).stream("POST", "/api/v1/chat/stream", json={"message": "讲讲周易"}) as response:
+        frames = [json.loads(line[5:]) for line in response.iter_lines() if line.startswith("data:")]
+
+    types = [f["type"] for f in frames]
+    assert types.index("tool_start") < types.index("tool_end") < types.index("done")
+    end = frames[types.index("tool_end")]
+    assert end["name"] == "zodiac_calculator" and end["status"] == "success" and end["duration_ms"] >= 0
+    assert "".join(f["content"] for f in frames if f["type"] == "token") == "zodiac_calculator:success"
@@ -50,6 +50,11 @@ def test_zodiac_tool():
     result = tool._run(1900)
     assert result["sign"] == "鼠"
 
+    # The compatibility table is module-level; callers get their own copy
+    result = tool._run(1990)
+    result["compatibility"]["best"].append("changed")
+    assert "changed" not in tool._run(1990)["compatibility"]["best"]
+
 def test_naming_tool():
     tool = NamingTool()
     result = tool._run("李", "boy")
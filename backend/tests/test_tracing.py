@@ -0,0 +1,83 @@
+import asyncio
+import json
+
+from fastapi.testclient import TestClient
+from langchain_core.messages import HumanMessage
+from prometheus_client import REGISTRY
+
+from app.core.llm import LLMClients
+from app.core.tracing import collect_stages, traced_node
+
+
+def test_traced_nodes_fill_stage_breakdown():
+    async def slow(state):
+        await asyncio.sleep(0.02)
+        return {}
+
+    async def main():
+        stages = collect_stages()
+        await traced_node("slow", slow)({})
+        await traced_node("slow", slow)({})
+        traced_node("fast", lambda state: {})({})
+        return stages
+
+    stages = asyncio.run(main())
+    assert set(stages) == {"slow", "fast"}
+    assert stages["slow"] >= 40
+    assert REGISTRY.get_sample_value("agent_node_duration_seconds_count", {"node": "slow"}) >= 2
+
+
+def test_stream_carries_trace_id_and_metrics_are_exposed():
+    from app.main import app
+
+    client = TestClient(app)
+    with client.stream("POST", "/api/v1/chat/stream", json={"message": "1990年出生属什么"},
+                       headers={"X-Trace-ID": "trace-abc"}) as response:
+        assert response.headers["x-trace-id"] == "trace-abc"
+        frames = [json.loads(line[5:]) for line in response.iter_lines() if line.startswith("data:")]
+    done = frames[-1]
+    assert done["type"] == "done" and done["trace_id"] == "trace-abc"
+    # Also up front, for streams that never reach the done frame
+    assert frames[0]["type"] == "status" and frames[0]["trace_id"] == "trace-abc"
+    assert {"router", "action_zodiac"} <= set(done["stages"])
+
+    # Unusable ids are replaced
+    assert client.get("/health", headers={"X-Trace-ID": "bad id\n"}).headers["x-trace-id"] != "bad id\n"
+
+    metrics = client.get("/metrics").text
+    assert 'agent_node_duration_seconds_count{node="action_zodiac"}' in metrics
+    assert "http_requests_total" in metrics
+
+
+def test_error_frame_carries_trace_id(monkeypatch):
+    from app.api.endpoints import chat
+    from app.main import app
+
+    class BrokenGraph:
+        name = "LangGraph"
+
+        async def astream_events(self, inputs, **kwargs):
+            raise RuntimeError("graph exploded")
+            yield
+
+    monkeypatch.setattr(chat.graph_registry, "get", lambda name: BrokenGraph())
+    client = TestClient(app)
+    with client.stream("POST", "/api/v1/chat/stream", json={"message": "这个问题会让图出错吗"},
+                       headers={"X-Trace-ID": "trace-err"}) as response:
+        lines = list(response.iter_lines())
+    error = json.loads(lines[lines.index("event: error") + 1][5:])
+    assert "graph exploded" in error["error"] and error["trace_id"] == "trace-err"
+
+
+def test_llm_ttft_and_token_rate_per_model():
+    clients = LLMClients()
+    backend = clients.backend("fake-rate", "fake-model", kind="fake", first_token_delay=0,
+                              tokens_per_second=500, answer_tokens=20)
+    model = clients.chat_model([backend])
+    asyncio.run(model.ainvoke([HumanMessage(content="乾卦")]))
+
+    labels = {"provider": "fake-rate", "model": "fake-model"}
+    assert REGISTRY.get_sample_value("llm_backend_first_token_seconds_count", labels) == 1
+    assert REGISTRY.get_sample_value("llm_backend_tokens_per_second_count", labels) == 1
+    rate = REGISTRY.get_sample_value("llm_backend_tokens_per_second_sum", labels)
+    assert 100 < rate < 1000
@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+from app.core import rag
+from app.core.bm25 import BM25, InvertedIndex, tokenize
+from app.core.embeddings import HASHING, HashingEmbedder
+from app.core.vector_index import VectorIndex, write_index
+
+DOCS = [
+    ("乾为天：天行健，君子以自强不息。", "iching", "乾"),
+    ("坤为地：地势坤，君子以厚德载物。", "iching", "坤"),
+    ('{"name": "白羊座", "element": "火", "traits": ["热情", "冲动"]}', "horoscope", "白羊座"),
+    ('{"name": "鼠", "element": "水", "traits": ["机智", "灵活"]}', "zodiac", "鼠"),
+]
+
+
+def _write(path, docs=DOCS):
+    embedder = HashingEmbedder(64)
+    write_index(str(path), embedder.embed_batch([d[0] for d in docs]) * 3,  # normalised on write
+                texts=[d[0] for d in docs], sources=[d[1] for d in docs], names=[d[2] for d in docs],
+                embedder=HASHING, backend=HASHING)
+    InvertedIndex.build([tokenize(d[0]) for d in docs]).save(str(path))
+    return embedder
+
+
+def test_top_k_matches_brute_force_and_filters_by_source(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(500, 32)).astype(np.float32)
+    sources = ["iching", "horoscope", "zodiac"] * 166 + ["iching", "iching"]
+    write_index(str(tmp_path / "idx"), vectors, [str(i) for i in range(500)], sources, [""] * 500, embedder="test", backend="torch")
+    index = VectorIndex(str(tmp_path / "idx"))
+    assert isinstance(index.vectors, np.memmap)
+    assert np.allclose(np.linalg.norm(index.vectors, axis=1), 1, atol=1e-5)
+
+    query = rng.normal(size=32).astype(np.float32)
+    query /= np.linalg.norm(query)
+    expected = np.argsort(-(index.vectors @ query))[:7]
+    assert [int(h.text) for h in index.search(query, 7)] == list(expected)
+
+    hits = index.search(query, 5, source="zodiac")
+    assert len(hits) == 5 and {h.source for h in hits} == {"zodiac"}
+    assert [h.score for h in hits] == sorted((h.score for h in hits), reverse=True)
+    assert index.search(query, 5, source="bazi") == []
+    assert len(index.search(query, 1000)) == 500
+
+
+def test_retrieve_documents_from_index(tmp_path, monkeypatch):
+    _write(tmp_path / "classics")
+    for name in ("_index_cache", "_lexical_index", "_embedder", "_cache", "_rag_available"):
+        monkeypatch.setattr(rag, name, getattr(rag, name))  # restored after the test
+    monkeypatch.setattr(rag, "_loaded", False)
+    monkeypatch.setattr(rag.settings, "RAG_INDEX_PATH", str(tmp_path / "classics"))
+    monkeypatch.setattr(rag.settings, "EMBEDDING_MODEL", HASHING)
+    assert rag.check_rag_available()
+    assert rag.retrieve_documents("乾为天，自强不息", k=1) == [DOCS[0][0]]
+    assert set(rag.retrieve_documents("君子", k=3, source="iching")) == {DOCS[0][0], DOCS[1][0]}
+
+    # No index: RAG is off rather than failing
+    assert not rag.load_index(str(tmp_path / "missing"))
+    assert rag.retrieve_documents("乾为天") == []
+
+
+def test_rag_is_off_without_the_index_embedder(tmp_path, monkeypatch):
+    for name in ("_index_cache", "_lexical_index", "_embedder", "_cache", "_rag_available", "_loaded"):
+        monkeypatch.setattr(rag, name, getattr(rag, name))  # restored after the test
+    _write(tmp_path / "classics")
+    # Served with another model than the index was built with
+    monkeypatch.setattr(rag.settings, "EMBEDDING_MODEL", "BAAI/bge-m3")
+    assert not rag.load_index(str(tmp_path / "classics"))
+
+    # The index's model cannot be loaded (not installed, not downloadable)
+    missing = str(tmp_path / "no" / "such" / "model")
+    write_index(str(tmp_path / "model"), np.eye(2, dtype=np.float32), ["乾", "坤"], ["iching"] * 2, ["", ""],
+                missing, "torch")
+    monkeypatch.setattr(rag.settings, "EMBEDDING_MODEL", missing)
+    assert not rag.load_index(str(tmp_path / "model"))
+    assert rag.retrieve_documents("乾") == []
+
+    # Same model, run by another backend than the index was built with
+    monkeypatch.setattr(rag, "_query_embedder", lambda dim: HashingEmbedder(dim))
+    assert rag.load_index(str(tmp_path / "model"))
+    monkeypatch.setattr(rag.settings, "EMBEDDING_BACKEND", "onnx-int8")
+    assert not rag.load_index(str(tmp_path / "model"))
+
+
+def test_index_rejects_mismatched_files(tmp_path):
+    _write(tmp_path / "idx")
+    np.save(str(tmp_path / "idx.npy"), np.zeros((2, 64), dtype=np.float32))
+    with pytest.raises(ValueError):
+        VectorIndex(str(tmp_path / "idx"))
+
+
+def test_inverted_index_round_trip_matches_bm25(tmp_path):
+    corpus = [tokenize(d[0]) for d in DOCS]
+    InvertedIndex.build(corpus).save(str(tmp_path / "idx"))
+    index = InvertedIndex.load(str(tmp_path / "idx"))
+    query = tokenize("君子自强不息")
+    rows, scores = index.top(query, 10)
+    expected = BM25(corpus).scores(query)
+    assert rows.tolist() == [0, 1]  # documents without a query term are not candidates
+    assert np.allclose(scores, [expected[0], expected[1]], rtol=1e-5)
+    assert index.top(query, 10, rows=np.array([1, 2]))[0].tolist() == [1]
+    assert index.top(["不存在的词"], 10)[0].tolist() == []
+
+
+def test_reciprocal_rank_fusion():
+    fused = rag.reciprocal_rank_fusion([[7, 3, 5], [3, 9]], k=3, c=60)
+    assert [row for row, _ in fused] == [3, 7, 9]
+    assert fused[0][1] == 1 / 62 + 1 / 61
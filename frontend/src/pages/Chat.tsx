@@ -8,6 +8,10 @@ import { fetchEventSource } from '@microsoft/fetch-event-source';
 const { Content, Footer } = Layout;
 const { Text } = Typography;
 
+// Dropped streams are resumed from the last received event
+const MAX_STREAM_RETRIES = 3;
+const STREAM_RETRY_MS = 1000;
+
 interface Message {
   id: string;
   role: 'user' | 'assistant';
@@ -30,6 +34,8 @@ const Chat: React.FC = () => {
   const [inputValue, setInputValue] = useState('');
   const [isLoading, setIsLoading] = useState(false);
   const messagesEndRef = useRef<HTMLDivElement>(null);
+  // One conversation per page visit; the backend keeps its memory under this id
+  const sessionIdRef = useRef(`chat-${Date.now().toString(36)}-${Math.random().toString(36).slice(2, 10)}`);
 
   const scrollToBottom = () => {
     messagesEndRef.current?.scrollIntoView({ behavior: 'smooth' });
@@ -78,6 +84,7 @@ const Chat: React.FC = () => {
       },
     ]);
 
+    let retries = 0;
     try {
       await fetchEventSource('/api/v1/chat/stream', {
         method: 'POST',
@@ -86,7 +93,7 @@ const Chat: React.FC = () => {
         },
         body: JSON.stringify({
           message: userMessage.content,
-          session_id: 'default'
+          session_id: sessionIdRef.current
         }),
         onmessage(msg) {
           try {
@@ -98,8 +105,10 @@ const Chat: React.FC = () => {
                   m.id === aiMessageId ? { ...m, content: aiContent } : m
                 )
               );
-            } else if (data.type === 'status') {
+            } else if (data.type === 'status' || data.type === 'tool_start') {
                console.log('Status:', data.content);
+            } else if (data.type === 'tool_end') {
+               console.log('Tool:', data.name, `${data.duration_ms}ms`, data.status);
             } else if (data.type === 'error') {
                console.error('Stream error:', data.content);
             }
@@ -109,7 +118,9 @@ const Chat: React.FC = () => {
         },
         onerror(err) {
           console.error('EventSource error:', err);
-          throw err; 
+          // Retries send Last-Event-ID, so the server resumes the same answer
+          if (++retries > MAX_STREAM_RETRIES) throw err;
+          return STREAM_RETRY_MS;
         }
       });
 
@@ -0,0 +1,27 @@
+"""
+把周易语料解析为64卦表（按爻象索引），写入 backend/app/data/hexagrams.json
+
+语料（data/iching.txt）修改后运行一次，再运行 build_index.py 重建检索索引。
+
+用法（在仓库根目录）:
+    python scripts/build_hexagrams.py [--corpus data/iching.txt] [--out backend/app/data/hexagrams.json]
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from app.tools.hexagrams import TABLE_PATH, build_table, write_table  # noqa: E402
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "data", "iching.txt"))
+    parser.add_argument("--out", default=os.path.abspath(TABLE_PATH))
+    args = parser.parse_args()
+    with open(args.corpus, encoding="utf-8") as f:
+        table = build_table(f.read())
+    write_table(table, args.out)
+    with_text = sum(1 for entry in table if entry["judgment"]["text"])
+    print(f"wrote {len(table)} hexagrams ({with_text} with text) to {args.out}")
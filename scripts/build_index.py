@@ -1,14 +1,40 @@
-import os
+"""
+构建知识库向量索引（无需Milvus等外部服务）
+
+写出 <out>.npy（归一化向量矩阵）、<out>.meta.json（文本与元数据）、
+<out>.bm25.npz（jieba分词的BM25倒排索引）和 <out>.manifest.json（各分块的内容哈希），
+后端启动时加载，见 backend/app/core/vector_index.py 与 backend/app/core/bm25.py。
+重建是增量的：内容未变的分块沿用已有向量。
+周易经文取自64卦表（先运行 build_hexagrams.py），星座与生肖取自 --data 目录。
+
+向量默认由本地模型 BAAI/bge-m3 生成（sentence-transformers，见 EMBEDDING_MODEL）；
+--backend onnx / onnx-int8 改用 ONNX Runtime 运行导出的模型（见 export_onnx.py）。
+--embedder hashing 使用无需模型的哈希嵌入，仅用于离线环境与测试。
+后端的 EMBEDDING_MODEL 须与构建时一致，否则不加载索引。
+
+用法（在仓库根目录）:
+    python scripts/build_index.py [--data data] [--uploads backend/uploads] [--out backend/storage/classics]
+                                  [--embedder BAAI/bge-m3|hashing] [--device cpu|cuda]
+                                  [--backend torch|onnx|onnx-int8] [--onnx-dir backend/storage/bge-m3-onnx]
+                                  [--dry-run] [--full] [--batch-size 256] [--workers N] [--max-memory MB]
+"""
+import argparse
+import itertools
 import json
-from typing import List, Dict
-from llama_index.core import SimpleDirectoryReader, StorageContext, VectorStoreIndex
-from llama_index.core.node_parser import SentenceSplitter
-from llama_index.core.schema import Document
-from llama_index.vector_stores.milvus import MilvusVectorStore
-from llama_index.core import Settings
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+import os
+import sys
+from typing import Dict, Iterator, Optional
+
 import structlog
 
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from app.core import index_builder  # noqa: E402
+from app.core.config import settings  # noqa: E402
+from app.core.embeddings import BACKENDS, HASHING, load_embedder  # noqa: E402
+from app.tools.hexagrams import hexagrams  # noqa: E402
+
 # 配置日志
 structlog.configure(
     processors=[
@@ -18,95 +44,139 @@ structlog.configure(
 )
 logger = structlog.get_logger()
 
-# 配置嵌入模型
-Settings.embed_model = HuggingFaceEmbedding(
-    model_name="BAAI/bge-m3"
-)
+UPLOAD_CHUNK_CHARS = 500
+
+def _hexagram_text(entry: Dict) -> str:
+    header = f"第{entry['number']}卦 {entry['name']} {entry['title']} {entry['upper']}上{entry['lower']}下"
+    labeled = [(entry["name"], entry["judgment"])] + [(line["label"], line) for line in entry["lines"]]
+    if entry["extra"]:
+        labeled.append((entry["extra"]["label"], entry["extra"]))
+    original = [f"{label}：{part['text']}" for label, part in labeled if part["text"]]
+    translation = [f"{label}：{part['translation']}" for label, part in labeled if part["translation"]]
+    return "\n".join([header, "【原文】", *original, "", "【译文】", *translation])
+
 
-def load_iching_data(file_path: str) -> List[Document]:
+def load_iching_data() -> Iterator[Dict]:
     """
-    加载周易数据并转换为Document对象
+    从64卦表（build_hexagrams.py 生成）加载周易数据，每个有经文的卦一个文档
     """
-    documents = []
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read()
-        # 简单按卦分割
-        sections = content.split('\n\n')
-        for section in sections:
-            if section.strip():
-                doc = Document(
-                    text=section,
-                    metadata={"source": "iching", "type": "classic"}
-                )
-                documents.append(doc)
-    logger.info("loaded_iching_data", count=len(documents))
-    return documents
-
-def load_json_data(file_path: str, data_type: str) -> List[Document]:
+    count = 0
+    for entry in hexagrams():
+        if entry["judgment"]["text"]:
+            count += 1
+            yield {"text": _hexagram_text(entry), "source": "iching", "name": entry["name"]}
+    logger.info("loaded_iching_data", count=count)
+
+
+def load_json_data(file_path: str, data_type: str) -> Iterator[Dict]:
     """
-    加载JSON数据（星座/生肖）并转换为Document对象
+    加载JSON数据（星座/生肖），每条记录一个文档
     """
-    documents = []
     with open(file_path, 'r', encoding='utf-8') as f:
         data = json.load(f)
-        for item in data:
-            doc = Document(
-                text=json.dumps(item, ensure_ascii=False),
-                metadata={"source": data_type, "name": item.get("name")}
-            )
-            documents.append(doc)
-    logger.info(f"loaded_{data_type}_data", count=len(documents))
-    return documents
-
-def build_index():
+    for item in data:
+        yield {"text": json.dumps(item, ensure_ascii=False), "source": data_type, "name": item.get("name", "")}
+    logger.info(f"loaded_{data_type}_data", count=len(data))
+
+
+def _paragraphs(f) -> Iterator[str]:
+    # 逐行读取，以空行分段，不把整个文件读入内存
+    lines = []
+    for line in f:
+        if line.strip():
+            lines.append(line.rstrip("\n"))
+        elif lines:
+            yield "\n".join(lines).strip()
+            lines = []
+    if lines:
+        yield "\n".join(lines).strip()
+
+
+def load_upload_data(upload_dir: str) -> Iterator[Dict]:
     """
-    构建索引并写入Milvus
+    流式加载用户上传的文本（.txt/.md），按段落切分，短段落合并到约 UPLOAD_CHUNK_CHARS 字
     """
-    try:
-        # 1. 加载数据
-        iching_docs = load_iching_data("data/iching.txt")
-        horoscope_docs = load_json_data("data/horoscope.json", "horoscope")
-        zodiac_docs = load_json_data("data/zodiac.json", "zodiac")
-        
-        all_docs = iching_docs + horoscope_docs + zodiac_docs
-        
-        # 2. 连接Milvus
-        # 注意：这里假设Milvus已经启动，如果本地没有Docker环境，这一步会失败
-        # 为了演示代码逻辑，这里添加try-except块
-        try:
-            vector_store = MilvusVectorStore(
-                uri="http://localhost:19530",
-                collection_name="chinese_classics",
-                dim=1024,
-                overwrite=True
-            )
-            storage_context = StorageContext.from_defaults(vector_store=vector_store)
-            
-            # 3. 构建索引
-            index = VectorStoreIndex.from_documents(
-                all_docs,
-                storage_context=storage_context,
-                transformations=[SentenceSplitter(chunk_size=512)]
-            )
-            
-            logger.info("index_build_success", total_docs=len(all_docs))
-            return index
-        except Exception as e:
-            logger.error("milvus_connection_failed", error=str(e))
-            logger.info("falling_back_to_local_storage")
-            
-            # 降级方案：使用本地存储
-            index = VectorStoreIndex.from_documents(
-                all_docs,
-                transformations=[SentenceSplitter(chunk_size=512)]
-            )
-            index.storage_context.persist(persist_dir="./storage")
-            logger.info("local_index_build_success")
-            return index
-
-    except Exception as e:
-        logger.error("index_build_failed", error=str(e))
-        raise
+    if not os.path.isdir(upload_dir):
+        return
+    count = 0
+    for filename in sorted(os.listdir(upload_dir)):
+        if os.path.splitext(filename)[1].lower() not in (".txt", ".md"):
+            continue
+        with open(os.path.join(upload_dir, filename), 'r', encoding='utf-8', errors='ignore') as f:
+            chunk = ""
+            for paragraph in _paragraphs(f):
+                if chunk and len(chunk) + len(paragraph) > UPLOAD_CHUNK_CHARS:
+                    count += 1
+                    yield {"text": chunk, "source": "upload", "name": filename}
+                    chunk = ""
+                chunk = f"{chunk}\n\n{paragraph}" if chunk else paragraph
+            if chunk:
+                count += 1
+                yield {"text": chunk, "source": "upload", "name": filename}
+    logger.info("loaded_upload_data", count=count)
+
+
+def _print_progress(report: index_builder.BuildReport):
+    print(f"\r{report.throughput()}", end="", file=sys.stderr, flush=True)
+
+
+def build_index(data_dir: str, out: str, dim: int = 512, upload_dir: str = "", dry_run: bool = False,
+                full: bool = False, batch_size: int = 256, workers: int = 0, max_memory_mb: Optional[float] = None,
+                embedder_name: str = settings.EMBEDDING_MODEL, device: str = "", backend: str = "torch",
+                onnx_dir: str = ""):
+    """
+    增量构建索引：只嵌入新增或内容变化的分块，删除已消失的分块（见 app/core/index_builder.py）。
+    文档以生成器流式读入，按批在 workers 个进程中分词与嵌入，批量写入索引
+    """
+    all_docs = itertools.chain(
+        load_iching_data(),
+        load_json_data(os.path.join(data_dir, "horoscope.json"), "horoscope"),
+        load_json_data(os.path.join(data_dir, "zodiac.json"), "zodiac"),
+        load_upload_data(upload_dir) if upload_dir else (),
+    )
+    # 向量之外同时重建BM25倒排索引（古文常被原句引用）
+    report = index_builder.build(
+        out, all_docs, load_embedder(embedder_name, dim, device, backend, onnx_dir), embedder_name, dry_run=dry_run, full=full,
+        batch_size=batch_size, workers=workers, max_memory_mb=max_memory_mb, progress=_print_progress,
+    )
+    print(file=sys.stderr)
+    for source, name in report.changed:
+        print(f"changed: {source}/{name}")
+    print(report.summary())
+    logger.info(
+        "index_build_dry_run" if dry_run else "index_build_success",
+        total_docs=report.documents, embedded=report.embedded, reused=report.reused, removed=report.removed,
+        embed_seconds=round(report.embed_seconds, 3), saved_seconds=round(report.saved_seconds, 3),
+        seconds=round(report.seconds, 3), peak_rss_mb=round(report.peak_rss_mb), out=out,
+    )
+
 
 if __name__ == "__main__":
-    build_index()
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--data", default=os.path.join(ROOT, "data"))
+    parser.add_argument("--uploads", default=os.path.join(ROOT, "backend", "uploads"))
+    parser.add_argument("--out", default=os.path.join(ROOT, "backend", "storage", "classics"))
+    parser.add_argument("--embedder", default=settings.EMBEDDING_MODEL,
+                        help=f"sentence-transformers 模型名或目录，或 {HASHING}（离线/测试）")
+    parser.add_argument("--device", default=settings.EMBEDDING_DEVICE, help="模型所用设备，如 cpu、cuda")
+    parser.add_argument("--backend", default=settings.EMBEDDING_BACKEND, choices=BACKENDS, help="模型的推理后端")
+    parser.add_argument("--onnx-dir", default=os.path.join(ROOT, "backend", "storage", "bge-m3-onnx"),
+                        help="export_onnx.py 的输出目录")
+    parser.add_argument("--dim", type=int, default=512, help=f"{HASHING} 嵌入的维数")
+    parser.add_argument("--dry-run", action="store_true", help="只报告将新增/删除的分块，不写文件")
+    parser.add_argument("--full", action="store_true", help="忽略清单，全部重新嵌入")
+    parser.add_argument("--batch-size", type=int, default=256, help="每批分块数")
+    parser.add_argument("--workers", type=int, default=None,
+                        help=f"分词与嵌入进程数，0 为单进程；默认 {HASHING} 为CPU核数，模型为0（模型本身已多线程）")
+    parser.add_argument("--max-memory", type=float, default=None, metavar="MB",
+                        help="主进程与工作进程常驻内存之和的上限，超出时暂停提交新批次（单进程时减半批大小）")
+    args = parser.parse_args()
+    if args.workers is None:
+        args.workers = (os.cpu_count() or 1) if args.embedder == HASHING else 0
+    try:
+        build_index(args.data, args.out, args.dim, args.uploads, dry_run=args.dry_run, full=args.full,
+                    batch_size=args.batch_size, workers=args.workers, max_memory_mb=args.max_memory,
+                    embedder_name=args.embedder, device=args.device, backend=args.backend, onnx_dir=args.onnx_dir)
+    except index_builder.MemoryBudgetExceeded as e:
+        # --max-memory 低于构建开始前已占用的内存，无法满足
+        parser.error(str(e))
@@ -0,0 +1,48 @@
+"""
+把嵌入模型（默认 BAAI/bge-m3）导出为 ONNX，并动态量化为 int8，供 ONNX Runtime 在CPU上推理
+
+输出目录（默认 backend/storage/bge-m3-onnx）：
+    model.onnx (+ model.onnx_data)  全精度，EMBEDDING_BACKEND=onnx
+    model_quantized.onnx            权重int8、激活动态量化，EMBEDDING_BACKEND=onnx-int8
+    tokenizer.json, config.json     分词器与模型配置
+
+量化向量与全精度向量略有差异，启用 onnx-int8 前先运行
+backend/benchmarks/bench_embedding_service.py 检查余弦一致性与top-k召回重合率。
+需要 optimum[onnxruntime]（仅导出时需要）。
+
+用法（在仓库根目录）:
+    python scripts/export_onnx.py [--model BAAI/bge-m3] [--out backend/storage/bge-m3-onnx]
+"""
+import argparse
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+
+from app.core.embeddings import OnnxEmbedder  # noqa: E402
+
+
+def export(model: str, out: str):
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from optimum.onnxruntime import ORTModelForFeatureExtraction
+    from transformers import AutoTokenizer
+
+    # 导出编码器本身（last_hidden_state），池化与归一化在 OnnxEmbedder 中完成
+    ORTModelForFeatureExtraction.from_pretrained(model, export=True).save_pretrained(out)
+    AutoTokenizer.from_pretrained(model).save_pretrained(out)
+    full = os.path.join(out, OnnxEmbedder.MODEL_FILES[False])
+    quantized = os.path.join(out, OnnxEmbedder.MODEL_FILES[True])
+    quantize_dynamic(full, quantized, weight_type=QuantType.QInt8)
+    for path in (full, quantized):
+        # 全精度模型超过2GB，权重在 <file>_data 中
+        size = sum(os.path.getsize(p) for p in (path, path + "_data") if os.path.exists(p))
+        print(f"{path}: {size / 2 ** 20:.0f}MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="BAAI/bge-m3")
+    parser.add_argument("--out", default=os.path.join(ROOT, "backend", "storage", "bge-m3-onnx"))
+    args = parser.parse_args()
+    export(args.model, args.out)